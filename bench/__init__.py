@@ -0,0 +1,12 @@
+"""
+bench
+-----
+Offline benchmarks for pipeline hot paths. 
+Run modules from the repository root, ex. `python -m bench.categories`.
+
+- suite:      timing and peak memory of parsing, geometry, output and raster paths
+- fixtures:   synthetic/recorded Overpass responses and synthetic GeoTIFFs
+- server:     local HTTP stand-in for the Overpass endpoint
+- categories: get_categories against its original implementation
+- imports:    import time of lib modules and CLI entry points
+"""
@@ -0,0 +1,75 @@
+import sys
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from time import perf_counter
+
+import lib.osmtools as ost
+from lib.misc import fmt_time, print_header
+
+"""
+categories.py
+-------------
+Benchmarks second-level label extraction (osmtools.get_categories) 
+against the original row-wise implementation on synthetic OSM frames.
+
+Usage: python -m bench.categories [rows ...]
+"""
+
+
+def legacy_categories(gdf, main_key: str) -> pd.Series:
+    """ Original iterrows implementation, kept as reference output. """
+    categories = []
+    for _, row in gdf.iterrows():
+        filled = row.notnull()
+        label = row[main_key]
+        if (label in gdf.columns) and filled.get(label):
+            categories.append(row[label])
+        else:
+            categories.append(None)
+    return pd.Series(categories)
+
+
+def synthetic_frame(rows: int, n_labels: int = 40, n_keys: int = 2000, fill: float = 0.3, seed: int = 0):
+    """ 
+    Creates wide, mostly-null frame resembling a parsed Overpass query.
+    Half the labels have a value-named sub-category column.
+    """
+    rng = np.random.default_rng(seed)
+    labels = np.array([f"label_{i}" for i in range(n_labels)] + [None], dtype=object)
+    data = {'building': labels[rng.integers(0, len(labels), rows)]}
+    for i in range(0, n_labels, 2):
+        column = np.full(rows, None, dtype=object)
+        hit = rng.random(rows) < fill
+        column[hit] = f"sub_{i}"
+        data[f"label_{i}"] = column
+    for k in range(n_keys - len(data)):
+        column = np.full(rows, None, dtype=object)
+        hit = rng.random(rows) < 0.001
+        column[hit] = 'yes'
+        data[f"key_{k}"] = column
+    geometry = shapely.points(rng.random(rows), rng.random(rows))
+    return gpd.GeoDataFrame(data, geometry=geometry, crs='EPSG:4326')
+
+
+def run(sizes=(1000, 5000, 20000), legacy_limit: int = 20000):
+    print_header("get_categories: vectorized vs iterrows")
+    for rows in sizes:
+        gdf = synthetic_frame(rows)
+        start = perf_counter()
+        fast = ost.get_categories(gdf, 'building')
+        fast_time = perf_counter() - start
+        line = f"- rows={rows} cols={len(gdf.columns)}: vectorized {fmt_time(fast_time)}"
+        if rows <= legacy_limit:
+            start = perf_counter()
+            slow = legacy_categories(gdf, 'building')
+            slow_time = perf_counter() - start
+            assert fast.equals(slow), "Vectorized categories differ from reference output."
+            line += f", iterrows {fmt_time(slow_time)}, speedup {slow_time / fast_time:.1f}x"
+        print(line)
+
+
+if __name__ == '__main__':
+    sizes = [int(a) for a in sys.argv[1:]] or (1000, 5000, 20000)
+    run(sizes)
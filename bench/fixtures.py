@@ -0,0 +1,192 @@
+import os
+import gzip
+import json
+import numpy as np
+import rasterio as rio
+from rasterio.windows import Window
+
+from lib.rasterfetch import raster_grid, utm_crs
+
+"""
+fixtures.py
+-----------
+Offline inputs for benchmarks.
+
+- Synthetic Overpass responses: ways carry both node ids and inline
+  geometry, and their nodes are included, so one response feeds the
+  geom parsers (osmtools) and the overpy parsers (geoscraping).
+- Recorded responses: real Overpass json captured once with
+  `python -m bench.fixtures record <name> <west> <south> <east> <north>`
+  and stored gzipped under bench/recorded/.
+- Synthetic GeoTIFFs on a UTM grid over the same bounds.
+"""
+
+RECORDED_DIR = os.path.join(os.path.dirname(__file__), 'recorded')
+
+# Small Tuscaloosa, AL area
+BOUNDS = {'west': -87.58, 'south': 33.19, 'east': -87.50, 'north': 33.23}
+
+BUILDING_TYPES = ['yes', 'house', 'residential', 'commercial', 'apartments', 'garage']
+HIGHWAY_TYPES = ['residential', 'service', 'footway', 'primary', 'secondary', 'track']
+OTHER_TAGS = [('barrier', 'fence'), ('natural', 'tree_row'), ('power', 'line'), ('waterway', 'stream')]
+
+
+class _Nodes:
+    """ Node id allocator collecting node elements. """
+
+    def __init__(self):
+        self.elements = []
+
+    def add(self, lons, lats) -> list:
+        start = len(self.elements) + 1
+        ids = list(range(start, start + len(lons)))
+        self.elements.extend({'type': 'node', 'id': i, 'lat': float(lat), 'lon': float(lon)}
+                             for i, lon, lat in zip(ids, lons, lats))
+        return ids
+
+
+def _way(way_id: int, node_ids: list, nodes: _Nodes, tags: dict) -> dict:
+    geometry = [{'lat': nodes.elements[i - 1]['lat'], 'lon': nodes.elements[i - 1]['lon']} for i in node_ids]
+    return {'type': 'way', 'id': way_id, 'nodes': node_ids, 'geometry': geometry, 'tags': tags}
+
+
+def synthetic_overpass(n_buildings: int = 1000, n_roads: int = 500, n_other: int = 200, n_keys: int = 200,
+                       bounds: dict = BOUNDS, seed: int = 0) -> dict:
+    """
+    Generates an Overpass json response with OSM-like buildings, roads and other ways.
+
+    Buildings are small rectangles, about 8% are left unclosed, 1% have two
+    nodes only and 1% are self-touching rings (two overlapping squares through
+    a shared node) that need repair. Roads are chains of 1-6 ways sharing end nodes, about 5%
+    are repeated reversed. Rare extra tags from n_keys keys make the frame wide.
+
+    Args:
+        n_buildings (int): Building ways.
+        n_roads (int):     Road ways (approximate, chains are kept whole).
+        n_other (int):     Ways of other classes (fences, streams, ...).
+        n_keys (int):      Distinct rare tag keys spread over all ways.
+        bounds (dict):     Lat/lon bounds of the features.
+        seed (int):        Random seed.
+    Returns:
+        dict: Overpass json, elements under 'elements'.
+    """
+    rng = np.random.default_rng(seed)
+    nodes = _Nodes()
+    ways = []
+    (w, s, e, n) = (bounds['west'], bounds['south'], bounds['east'], bounds['north'])
+    rare_keys = [f"key_{k}" for k in range(n_keys)]
+
+    def tags_for(base: dict) -> dict:
+        tags = dict(base)
+        for k in rng.choice(rare_keys, rng.poisson(1.5)) if rare_keys else []:
+            tags[str(k)] = 'yes'
+        return tags
+
+    # Buildings
+    x = rng.uniform(w, e, n_buildings)
+    y = rng.uniform(s, n, n_buildings)
+    dx = rng.uniform(5e-5, 2e-4, n_buildings)
+    dy = rng.uniform(5e-5, 2e-4, n_buildings)
+    kind = rng.random(n_buildings)
+    for i in range(n_buildings):
+        ids = nodes.add([x[i], x[i] + dx[i], x[i] + dx[i], x[i]], [y[i], y[i], y[i] + dy[i], y[i] + dy[i]])
+        if kind[i] < 0.01:
+            ids = ids[:2]
+        elif kind[i] < 0.02:
+            # Second square from the center of the first, the ring passes its start node twice
+            (hx, hy) = (x[i] + dx[i] / 2, y[i] + dy[i] / 2)
+            second = nodes.add([hx, hx + dx[i], hx + dx[i], hx], [hy, hy, hy + dy[i], hy + dy[i]])
+            ids = ids + ids[:1] + second + second[:1]
+        elif kind[i] >= 0.1:
+            ids = ids + ids[:1]
+        label = BUILDING_TYPES[rng.integers(len(BUILDING_TYPES))]
+        base = {'building': label}
+        if label == 'house' and rng.random() < 0.5:
+            base['house'] = 'detached'
+        ways.append(_way(len(ways) + 1, ids, nodes, tags_for(base)))
+
+    # Road chains, consecutive ways share end nodes
+    made = 0
+    while made < n_roads:
+        (cx, cy) = (rng.uniform(w, e), rng.uniform(s, n))
+        steps = rng.integers(1, 7)
+        per_way = rng.integers(2, 6, steps)
+        lons = cx + np.cumsum(rng.normal(0, 3e-4, per_way.sum() - steps + 1))
+        lats = cy + np.cumsum(rng.normal(0, 3e-4, per_way.sum() - steps + 1))
+        ids = nodes.add(lons, lats)
+        label = HIGHWAY_TYPES[rng.integers(len(HIGHWAY_TYPES))]
+        base = {'highway': label, 'name': f"Road {made}"}
+        if label == 'service' and rng.random() < 0.5:
+            base['service'] = 'driveway'
+        pos = 0
+        for count in per_way:
+            chain_ids = ids[pos:pos + count]
+            ways.append(_way(len(ways) + 1, chain_ids, nodes, tags_for(base)))
+            if rng.random() < 0.05:
+                ways.append(_way(len(ways) + 1, chain_ids[::-1], nodes, tags_for(base)))
+            pos += count - 1
+            made += 1
+
+    # Other classes
+    for i in range(n_other):
+        count = rng.integers(2, 6)
+        (cx, cy) = (rng.uniform(w, e), rng.uniform(s, n))
+        ids = nodes.add(cx + np.cumsum(rng.normal(0, 1e-4, count)), cy + np.cumsum(rng.normal(0, 1e-4, count)))
+        (key, value) = OTHER_TAGS[rng.integers(len(OTHER_TAGS))]
+        ways.append(_way(len(ways) + 1, ids, nodes, tags_for({key: value})))
+
+    # Way ids follow node ids, as both share one id space here
+    offset = len(nodes.elements)
+    for way in ways:
+        way['id'] += offset
+    return {'version': 0.6, 'generator': 'bench.fixtures', 'elements': ways + nodes.elements}
+
+
+def recorded_path(name: str) -> str:
+    return os.path.join(RECORDED_DIR, name + '.json.gz')
+
+
+def load_recorded(name: str) -> dict:
+    """ Loads a response recorded with record(). """
+    with gzip.open(recorded_path(name), 'rt') as f:
+        return json.load(f)
+
+
+def record(name: str, bounds: dict, verbosity: str = 'geom') -> str:
+    """ Queries every way in bounds (with nodes) from the live Overpass API and stores the response. """
+    from lib.osmtools import fetch_overpass, overpass_bounds
+    response = fetch_overpass("way" + overpass_bounds(bounds) + ";(._;>;);", verbosity=verbosity, cache=False)
+    os.makedirs(RECORDED_DIR, exist_ok=True)
+    with gzip.open(recorded_path(name), 'wt') as f:
+        json.dump(response, f)
+    return recorded_path(name)
+
+
+def synthetic_geotiff(fp: str, bounds: dict = BOUNDS, scale: float = 1.0, count: int = 4,
+                      dtype: str = 'uint8', empty_frac: float = 0.1, seed: int = 0, block: int = 1024) -> str:
+    """
+    Writes a random tiled GeoTIFF covering bounds on a UTM grid, block by block.
+    The first empty_frac of rows is left as nodata (0), like imagery edges.
+    """
+    rng = np.random.default_rng(seed)
+    crs = utm_crs(bounds)
+    transform, width, height = raster_grid(bounds, scale, crs)
+    empty_rows = int(height * empty_frac)
+    with rio.open(fp, 'w', driver='GTiff', width=width, height=height, count=count, dtype=dtype, crs=crs,
+                  transform=transform, nodata=0, tiled=True, blockxsize=256, blockysize=256,
+                  compress='deflate', BIGTIFF='IF_SAFER') as dst:
+        for row in range(empty_rows - empty_rows % block, height, block):
+            rows = min(block, height - row)
+            data = rng.integers(1, 255, (count, rows, width), dtype=dtype)
+            data[:, :max(0, empty_rows - row)] = 0
+            dst.write(data, window=Window(0, row, width, rows))
+    return fp
+
+
+if __name__ == '__main__':
+    import sys
+    if (len(sys.argv) != 7) or (sys.argv[1] != 'record'):
+        print("Usage: python -m bench.fixtures record <name> <west> <south> <east> <north>")
+        sys.exit(1)
+    bounds = dict(zip(['west', 'south', 'east', 'north'], map(float, sys.argv[3:])))
+    print(f"> Recorded: '{record(sys.argv[2], bounds)}'")
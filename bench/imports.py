@@ -0,0 +1,129 @@
+import os
+import sys
+import subprocess
+from statistics import median
+from time import perf_counter
+
+from lib.misc import fmt_time, print_header
+
+"""
+imports.py
+----------
+Import-time benchmark for lib modules and the CLI entry points.
+
+Every measurement runs in a fresh interpreter, so nothing is already
+in sys.modules. Module cost is read from `python -X importtime`,
+summed over the top-level imports after interpreter startup (parent
+packages included). Entry points are timed as whole processes.
+
+Usage: python -m bench.imports [modules ...] [--repeat <n>] [--top <n>]
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ['lib', 'lib.osmtools', 'lib.geoscraping', 'lib.imagetools', 'lib.authkit', 'lib.catalog',
+           'lib.tagstats', 'pipe_script', 'cli']
+COMMANDS = [('cli.py --help', [sys.executable, 'cli.py', '--help'])]
+
+
+def parse_importtime(stderr: str) -> list:
+    """ (cumulative us, depth, module) per line of -X importtime output. """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        (_, cumulative, name) = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((int(cumulative), depth, name.strip()))
+    return entries
+
+
+def _startup_modules() -> set:
+    """ Modules imported by the interpreter itself, before any user import. """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'pass'], cwd=ROOT, capture_output=True, text=True)
+    return {name for (_, _, name) in parse_importtime(proc.stderr)}
+
+
+def import_time(module: str, startup: set = frozenset()) -> tuple:
+    """
+    Imports module in a fresh interpreter.
+
+    Args:
+        module (str):  Dotted module name.
+        startup (set): Interpreter startup modules, left out of the total.
+    Returns:
+        tuple: (seconds or None if the import failed, importtime entries, error line).
+               Seconds sum every top-level import after startup, so parent
+               packages (ex. lib for lib.osmtools) are included.
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                          cwd=ROOT, capture_output=True, text=True)
+    entries = parse_importtime(proc.stderr)
+    if proc.returncode != 0:
+        error = [l for l in proc.stderr.splitlines() if not l.startswith('import time:')]
+        return None, entries, error[-1] if error else f"exit code {proc.returncode}"
+    total = sum(cumulative for (cumulative, depth, name) in entries if (depth == 0) and (name not in startup))
+    return total / 1e6, entries, None
+
+
+def heaviest(entries: list, startup: set = frozenset(), top: int = 5) -> list:
+    """ Largest imports one level below the top-level imports, (seconds, name). """
+    # importtime lists children before their parent, one level deeper
+    (children, pending) = ([], [])
+    for (cumulative, depth, name) in entries:
+        if depth == 1:
+            pending.append((cumulative / 1e6, name))
+        elif depth == 0:
+            if name not in startup:
+                children.extend(pending)
+            pending = []
+    return sorted(children, reverse=True)[:top]
+
+
+def command_time(args: list) -> float:
+    start = perf_counter()
+    subprocess.run(args, cwd=ROOT, capture_output=True)
+    return perf_counter() - start
+
+
+def run(modules=MODULES, repeat: int = 5, top: int = 5) -> list:
+    """ Prints median import and command times, returns the result records. """
+    records = []
+    print_header(f"Import time, median of {repeat} fresh interpreters")
+    startup = _startup_modules()
+    for module in modules:
+        times, entries, error = [], [], None
+        for _ in range(repeat):
+            (seconds, entries, error) = import_time(module, startup)
+            if seconds is None:
+                break
+            times.append(seconds)
+        if error is not None:
+            print(f"- {module}: failed ({error})")
+            records.append({'name': module, 'seconds': None, 'error': error})
+            continue
+        records.append({'name': module, 'seconds': round(median(times), 6)})
+        print(f"- {module}: {fmt_time(median(times))} ({median(times)*1000:.0f} ms)")
+        for (seconds, name) in heaviest(entries, startup, top):
+            print(f"    - {name}: {seconds*1000:.0f} ms")
+
+    print_header("Entry points")
+    baseline = median(command_time([sys.executable, '-c', 'pass']) for _ in range(repeat))
+    print(f"- python -c pass: {baseline*1000:.0f} ms")
+    for (name, args) in COMMANDS:
+        seconds = median(command_time(args) for _ in range(repeat))
+        records.append({'name': name, 'seconds': round(seconds, 6)})
+        print(f"- {name}: {seconds*1000:.0f} ms")
+    return records
+
+
+def _flag_value(flag: str, default=None):
+    if flag in sys.argv:
+        return sys.argv[sys.argv.index(flag) + 1]
+    return default
+
+
+if __name__ == '__main__':
+    values = {_flag_value(f) for f in ('--repeat', '--top')}
+    modules = [a for a in sys.argv[1:] if not a.startswith('--') and (a not in values)] or MODULES
+    run(modules, repeat=int(_flag_value('--repeat', 5)), top=int(_flag_value('--top', 5)))
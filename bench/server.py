@@ -0,0 +1,114 @@
+import json
+import threading
+from time import sleep
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""
+server.py
+---------
+Local HTTP stand-in for the Overpass interpreter endpoint.
+
+Serves a fixed response (or one built per query) on a background
+thread, so the request, streaming and parsing paths can be measured
+without the network. Use as a context manager, it installs a shared
+overpass_client pointed at itself (without rate limits) while open.
+"""
+
+
+class OverpassStandIn:
+    """
+    Local Overpass endpoint.
+
+    Args:
+        response:      Overpass json dict or bytes returned for every query, or a
+                       callable (query str) -> (status code, bytes).
+        delay (float): Seconds to wait before answering, simulates latency.
+        chunk (int):   Bytes per write, the body is sent in chunks.
+        port (int):    Port, 0 picks a free one.
+        status (str):  Body of the /status page, default reports free slots.
+    """
+
+    def __init__(self, response, delay: float = 0.0, chunk: int = 1 << 16, port: int = 0, status: str = None):
+        if isinstance(response, dict):
+            response = json.dumps(response).encode('utf-8')
+        if isinstance(response, (bytes, bytearray)):
+            body = bytes(response)
+            self.respond = lambda query: (200, body)
+        else:
+            self.respond = response
+        self.delay = delay
+        self.chunk = chunk
+        self.status = status or "Connected as: 0\nRate limit: 2\n2 slots available now.\n"
+        self.queries = []
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._thread = None
+        self._previous = None
+        self._client = None
+
+    @property
+    def url(self) -> str:
+        (host, port) = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/interpreter"
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, so pooled connections are reused
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                query = parse_qs(self.rfile.read(length).decode('utf-8')).get('data', [''])[0]
+                standin.queries.append(query)
+                if standin.delay:
+                    sleep(standin.delay)
+                (status, body) = standin.respond(query)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                for start in range(0, len(body), standin.chunk):
+                    self.wfile.write(body[start:start + standin.chunk])
+
+            def do_GET(self):
+                body = standin.status.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def client(self, **kwargs):
+        """ OverpassClient for this stand-in, unthrottled unless kwargs say otherwise. """
+        from lib.overpass_client import OverpassClient
+        kwargs = {'rate': 1e6, 'burst': 1e6, 'slots': 0, **kwargs}
+        return OverpassClient([self.url], **kwargs)
+
+    def __enter__(self):
+        from lib.overpass_client import set_client
+        self.start()
+        self._client = self.client()
+        self._previous = set_client(self._client)
+        return self
+
+    def __exit__(self, *exc):
+        from lib.overpass_client import set_client
+        set_client(self._previous)
+        self._client.close()
+        self.stop()
@@ -0,0 +1,171 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import tracemalloc
+import overpy
+from time import perf_counter
+
+import lib.osmtools as ost
+import lib.geoscraping as gs
+from lib.cache import set_default_cache
+from lib.outputs import LayerWriter
+from lib.chips import generate_chips
+from lib.masks import rasterize_layers
+from lib.misc import file_size, fmt_time, print_header
+from bench.fixtures import BOUNDS, load_recorded, synthetic_geotiff, synthetic_overpass
+from bench.server import OverpassStandIn
+
+"""
+suite.py
+--------
+Offline benchmark suite over the parsing, geometry, output and raster paths.
+
+Every benchmark runs on synthetic Overpass responses at several sizes
+(or on a recorded response), queries go to a local HTTP stand-in, and
+raster benchmarks use a synthetic GeoTIFF. Each case is timed once,
+then run again under tracemalloc for peak Python/numpy memory (worker
+processes are not traced).
+
+Usage: python -m bench.suite [sizes ...] [--recorded <name>] [--raster <scale m>]
+                             [--no-memory] [--out <results.jsonl>]
+"""
+
+
+def measure(func, trace_memory: bool = True) -> tuple:
+    """ Runs func, returns (result, seconds, peak traced bytes or None). """
+    start = perf_counter()
+    result = func()
+    elapsed = perf_counter() - start
+    peak = None
+    if trace_memory:
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def osm_cases(response: dict, work_dir: str) -> list:
+    """ (name, items, func) benchmark cases for one Overpass response. """
+    body = json.dumps(response).encode('utf-8')
+    raw = ost.geojson_to_gdf(ost.overpass_to_geojson(response))
+    buildings = ost.parse_osm_gdf(raw[raw.building.notnull()].reset_index(drop=True), 'building')
+    roads = ost.parse_osm_gdf(raw[raw.highway.notnull()].reset_index(drop=True), 'highway')
+    result = overpy.Result.from_json(response)
+
+    def query_ways():
+        with OverpassStandIn(body):
+            return ost.query_ways(BOUNDS)
+
+    def write(fmt):
+        def run():
+            out_dir = tempfile.mkdtemp(dir=work_dir)
+            writer = LayerWriter(out_dir, fmt=fmt, partition_by='label')
+            writer.write('buildings', buildings)
+            writer.write('roads', roads)
+            return out_dir
+        return run
+
+    n_ways = sum(1 for e in response['elements'] if e['type'] == 'way')
+    return [
+        ("overpass_to_geojson + geojson_to_gdf", n_ways,
+         lambda: ost.geojson_to_gdf(ost.overpass_to_geojson(response))),
+        ("query_ways (local stand-in)", n_ways, query_ways),
+        ("parse_osm_gdf (buildings)", len(buildings),
+         lambda: ost.parse_osm_gdf(raw[raw.building.notnull()].reset_index(drop=True), 'building')),
+        ("gdf_polygonize", len(buildings), lambda: ost.gdf_polygonize(buildings)),
+        ("merge_roads", len(roads), lambda: ost.merge_roads(roads)),
+        ("overpy Result + linetopoly", len(result.ways),
+         lambda: gs.querytoframe(overpy.Result.from_json(response))),
+        ("ArrayResult + arraytopoly", len(result.ways),
+         lambda: gs.querytoframe(gs.ArrayResult.from_elements(response['elements']))),
+        ("LayerWriter parquet", len(buildings) + len(roads), write('parquet')),
+        ("LayerWriter gpkg", len(buildings) + len(roads), write('gpkg')),
+    ], buildings, roads
+
+
+def raster_cases(raster_fp: str, buildings, roads, work_dir: str) -> list:
+    layers = {'buildings': buildings.set_crs('EPSG:4326', allow_override=True),
+              'roads': roads.set_crs('EPSG:4326', allow_override=True)}
+    import rasterio as rio
+    with rio.open(raster_fp) as src:
+        pixels = src.width * src.height
+    return [
+        ("rasterize_layers", pixels,
+         lambda: rasterize_layers(raster_fp, layers, out_fp=os.path.join(work_dir, 'mask.tif'))),
+        ("generate_chips", pixels,
+         lambda: generate_chips(raster_fp, tempfile.mkdtemp(dir=work_dir), size=256, workers=4)),
+    ]
+
+
+def run(sizes=(1000, 10000, 50000), recorded: str = None, raster_scale: float = 2.0,
+        trace_memory: bool = True, out_fp: str = None) -> list:
+    """
+    Runs every case, prints a table and returns the result records.
+
+    Args:
+        sizes (list):         Building counts of the synthetic responses, roads and
+                              other ways scale with them.
+        recorded (str):       Use this recorded response instead of synthetic ones.
+        raster_scale (float): Pixel size (m) of the synthetic GeoTIFF, None skips rasters.
+        trace_memory (bool):  Also measure peak traced memory.
+        out_fp (str):         Optional JSON lines output.
+    """
+    set_default_cache(False)
+    work_dir = tempfile.mkdtemp(prefix='geoscrape-bench-')
+    records = []
+    try:
+        if recorded:
+            datasets = [(recorded, load_recorded(recorded))]
+        else:
+            datasets = [(f"synthetic-{n}", synthetic_overpass(n_buildings=n, n_roads=n // 2, n_other=n // 5))
+                        for n in sizes]
+
+        for (name, response) in datasets:
+            print_header(f"{name}: {len(response['elements'])} elements")
+            cases, buildings, roads = osm_cases(response, work_dir)
+            (_, report) = ost.gdf_polygonize(buildings, return_report=True)
+            print(f"- gdf_polygonize: {report['closed']} closed, {report['repaired']} repaired, "
+                  f"{report['dropped']} dropped of {report['total']}")
+            if raster_scale and (name == datasets[-1][0]):
+                raster_fp = synthetic_geotiff(os.path.join(work_dir, 'image.tif'), scale=raster_scale)
+                print(f"- raster: '{raster_fp}' ({file_size(filepath=raster_fp)})")
+                cases += raster_cases(raster_fp, buildings, roads, work_dir)
+
+            for (case, items, func) in cases:
+                _, elapsed, peak = measure(func, trace_memory=trace_memory)
+                record = {'dataset': name, 'case': case, 'items': items, 'seconds': round(elapsed, 6),
+                          'items_per_s': round(items / elapsed, 1) if elapsed else None, 'peak_bytes': peak}
+                records.append(record)
+                line = f"- {case}: {fmt_time(elapsed)}, {record['items_per_s']:,.0f} items/s"
+                if peak is not None:
+                    line += f", peak {file_size(size=peak)}"
+                print(line)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if out_fp:
+        with open(out_fp, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+        print(f"> Results: '{out_fp}'")
+    return records
+
+
+def _flag_value(flag: str, default=None):
+    if flag in sys.argv:
+        return sys.argv[sys.argv.index(flag) + 1]
+    return default
+
+
+if __name__ == '__main__':
+    values = {_flag_value(f) for f in ('--recorded', '--raster', '--out')}
+    sizes = [int(a) for a in sys.argv[1:] if a.isdigit() and (a not in values)] or (1000, 10000, 50000)
+    scale = _flag_value('--raster', 2.0)
+    run(sizes,
+        recorded=_flag_value('--recorded'),
+        raster_scale=float(scale) if scale != 'none' else None,
+        trace_memory=('--no-memory' not in sys.argv),
+        out_fp=_flag_value('--out'))
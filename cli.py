@@ -1,5 +1,7 @@
 import click
-from lib import geoscraping as geo
+
+# lib.geoscraping pulls in the geospatial stack, it is imported
+# inside commands so '--help' and argument errors stay fast
 
 @click.group()
 def query():
@@ -11,6 +13,7 @@ def query():
 @click.argument('key')
 @click.argument('value')
 def buildingquery(bounds, key, value):
+    from lib import geoscraping as geo
     result = geo.buildingquery(bounds, key, value)
     frame = geo.querytoframe(result)
     click.echo(frame)
@@ -21,6 +24,7 @@ def buildingquery(bounds, key, value):
 @click.argument('key')
 @click.argument('value')
 def roadquery(bounds, key, value):
+    from lib import geoscraping as geo
     result = geo.roadquery(bounds, key, value)
     click.echo(result)
 
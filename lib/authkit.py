@@ -1,6 +1,11 @@
 import os
+import json
+from typing import TYPE_CHECKING
 from datetime import datetime as dt
 
+if TYPE_CHECKING:
+    from pydrive.drive import GoogleDrive
+
 """
 authkit.py
 ----------
@@ -8,25 +13,44 @@ Authentication tools and shorthands.
 
 Todo:
 Create setup script for keys. 
+
+ee and pydrive are imported on first use.
 """
 
-import ee 
-def ee_client(verbose=False):
+def ee_client(verbose=False, interactive: bool = True, service_key_fp: str = None):
     """
     Authenticates and initializes ee client.
     Returns synced time.
     
     Args:
-        user (bool): Optionally force user auth for drive connection
-            default = True
         verbose (bool): enable printing
             defualt = False
+        interactive (bool): Run the browser sign-in when no credentials are saved,
+            else raise. Unattended runs pass False.
+            default = True
+        service_key_fp (str): Optional service account key (json), used instead of
+            user credentials.
+    Raises:
+        RuntimeError: If interactive is False and no credentials are saved.
     """ 
-    credentials_fp = ee.oauth.get_credentials_path() # This func may not work on windows, uses '/'
-    if not os.path.exists(credentials_fp):
-        ee.Authenticate()
-    else:
+    import ee
+
+    if service_key_fp is not None:
+        if not os.path.exists(service_key_fp):
+            raise RuntimeError(f"EE service account key not found: '{service_key_fp}'")
+        with open(service_key_fp) as f:
+            email = json.load(f)['client_email']
         if verbose:
+            print(f"> EE Auth: Using service account {email}.")
+        creds = ee.ServiceAccountCredentials(email, key_file=service_key_fp)
+    else:
+        credentials_fp = ee.oauth.get_credentials_path() # This func may not work on windows, uses '/'
+        if not os.path.exists(credentials_fp):
+            if not interactive:
+                raise RuntimeError(f"No saved EE credentials at '{credentials_fp}'. "
+                                   "Run `earthengine authenticate` or pass a service account key.")
+            ee.Authenticate()
+        elif verbose:
             print("> EE Auth: Loading user credentials from storage.")
         creds = ee.data.get_persistent_credentials() 
     ee.Initialize(creds)
@@ -42,32 +66,55 @@ def ee_client(verbose=False):
 
 
 
-from pydrive.auth import GoogleAuth
-from pydrive.drive import GoogleDrive
-def get_drive(settings_fp: str='settings.yaml', verbose: bool=False) -> GoogleDrive:
+def get_drive(settings_fp: str='settings.yaml', verbose: bool=False, interactive: bool=True) -> 'GoogleDrive':
     """
     Authenticates PyDrive, returning the drive object.
     
     Notes:
         For configuring the settings file:
         https://pythonhosted.org/PyDrive/oauth.html
+        Unattended runs need saved credentials (save_credentials) or a 
+        service account (client_config_backend: service).
     
     Parameters:
         settings_fp (str): setttings file for pydrive. Must be yaml
             default = 'settings.yaml'
+        interactive (bool): Open the browser sign-in, else only load saved or
+            service account credentials.
+            default = True
     Returns:
         GoogleDrive: Authenticated drive object
     Raises:
-        RuntimeError: If passed settings file is not yaml.
+        RuntimeError: If passed settings file is not yaml, or interactive is False 
+            and no credentials are saved.
     """
     
+    from pydrive.auth import GoogleAuth
+    from pydrive.drive import GoogleDrive
+    from pydrive.settings import InvalidConfigError
+
     if ('.yaml' not in os.path.splitext(settings_fp)[1]):
         raise RuntimeError(f"Can't use passed settings file, must be yaml format. Recieved:\n'{settings_fp}'")
     
     gauth = GoogleAuth(settings_file=settings_fp)   
     if ((settings_fp != 'settings.yaml') and verbose):
         print(f"> Drive Auth: Loaded settings from: '{settings_fp}'")
-    gauth.LocalWebserverAuth()
+    if interactive:
+        gauth.LocalWebserverAuth()
+    elif gauth.settings.get('client_config_backend') == 'service':
+        gauth.ServiceAuth()
+    else:
+        try:
+            gauth.LoadCredentials()
+        except InvalidConfigError as e:
+            raise RuntimeError(f"Drive settings '{settings_fp}' do not save credentials: {e}") from e
+        if gauth.credentials is None:
+            raise RuntimeError(f"No saved drive credentials for '{settings_fp}', sign in once interactively.")
+        if gauth.access_token_expired:
+            gauth.Refresh()
+            gauth.SaveCredentials()
+        else:
+            gauth.Authorize()
     gdrive = GoogleDrive(auth=gauth)
     
     return gdrive
\ No newline at end of file
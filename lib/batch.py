@@ -0,0 +1,162 @@
+import os
+import csv
+import json
+import traceback
+from datetime import datetime as dt
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pytz import timezone
+tz = timezone("US/Central")
+
+"""
+batch.py
+--------
+Unattended runs over many regions.
+
+Regions come from a manifest file instead of the interactive city
+prompt. Every region's status is recorded in a JSON sidecar as it
+changes, so a crashed or interrupted batch is restarted with only the
+regions that did not finish.
+"""
+
+BOUND_KEYS = ('west', 'south', 'east', 'north')
+
+
+def read_manifest(fp: str) -> list:
+    """
+    Reads regions from a CSV or JSON lines manifest.
+
+    Each region needs a 'name', bounds as either a 'bbox' value
+    "west,south,east,north" or separate 'west', 'south', 'east', 'north'
+    fields, and a 'scale' in meters per pixel.
+
+    Args:
+        fp (str): Manifest path, '.csv' or '.jsonl'/'.json' (one object per line).
+    Returns:
+        list: dset_data dicts ('filename', bounds, 'scale') in manifest order.
+    Raises:
+        ValueError: On missing fields, bad bounds or duplicate names.
+    """
+    with open(fp, newline='') as f:
+        if fp.endswith('.csv'):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+    regions = []
+    for line, row in enumerate(rows, start=1):
+        try:
+            name = str(row['name']).strip().replace(' ', '_')
+            if row.get('bbox') not in (None, ''):
+                bbox = row['bbox']
+                bounds = [float(v) for v in (bbox.split(',') if isinstance(bbox, str) else bbox)]
+            else:
+                bounds = [float(row[k]) for k in BOUND_KEYS]
+            scale = float(row['scale'])
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Manifest '{fp}' row {line} is invalid: {e!r}") from e
+        if (len(bounds) != 4) or (bounds[0] >= bounds[2]) or (bounds[1] >= bounds[3]):
+            raise ValueError(f"Manifest '{fp}' row {line} has invalid bounds {bounds}, expected west,south,east,north.")
+        region = dict(zip(BOUND_KEYS, bounds))
+        region.update({'filename': name, 'scale': int(scale) if scale.is_integer() else scale})
+        regions.append(region)
+
+    names = [r['filename'] for r in regions]
+    duplicates = sorted({n for n in names if names.count(n) > 1})
+    if duplicates:
+        raise ValueError(f"Manifest '{fp}' has duplicate region names: {duplicates}")
+    return regions
+
+
+def region_folder(root: str, name: str) -> str:
+    """ Fixed dataset folder of a batch region, reused when the region is rerun. """
+    folder = os.path.join(root, name)
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+class BatchStatus:
+    """
+    Per-region status record, saved to a JSON file on every change.
+
+    Statuses are 'queued', 'done' or 'failed'. Regions left 'queued'
+    by a crash count as unfinished.
+
+    Args:
+        fp (str): Status file, loaded if it exists.
+    """
+
+    def __init__(self, fp: str):
+        self.fp = fp
+        self.regions = {}
+        if os.path.exists(fp):
+            with open(fp) as f:
+                self.regions = json.load(f)
+
+    def status(self, name: str) -> str:
+        return self.regions.get(name, {}).get('status')
+
+    def unfinished(self, names: list) -> list:
+        """ Names not yet marked 'done', in the given order. """
+        return [n for n in names if self.status(n) != 'done']
+
+    def mark(self, name: str, status: str, **info) -> None:
+        """ Sets a region's status with extra JSON-able info, then saves. """
+        record = {'status': status, 'updated': dt.now(tz).isoformat(timespec='seconds')}
+        record.update(info)
+        self.regions[name] = record
+        tmp_fp = self.fp + '.tmp'
+        with open(tmp_fp, 'w') as f:
+            json.dump(self.regions, f, indent=2)
+        os.replace(tmp_fp, self.fp)
+
+    def counts(self) -> dict:
+        counts = {}
+        for record in self.regions.values():
+            counts[record['status']] = counts.get(record['status'], 0) + 1
+        return counts
+
+
+def run_batch(regions: list, run_region, status_fp: str, workers: int = 2, initializer=None,
+              initargs: tuple = (), verbose: bool = False) -> BatchStatus:
+    """
+    Runs unfinished regions on a process pool, recording status as each one ends.
+
+    Args:
+        regions (list):    dset_data dicts from read_manifest.
+        run_region:        Picklable callable taking one region, returning a JSON-able
+                           dict of info, raising on failure.
+        status_fp (str):   Status file, regions already 'done' in it are skipped.
+        workers (int):     Regions run at once, one process each.
+        initializer:       Optional per-process setup (authentication, caches).
+        initargs (tuple):  Arguments for initializer.
+        verbose (bool):    Print finished regions.
+    Returns:
+        BatchStatus: Final status record.
+    """
+    status = BatchStatus(status_fp)
+    by_name = {r['filename']: r for r in regions}
+    todo = status.unfinished(list(by_name))
+    print(f"> Batch: {len(todo)} of {len(regions)} regions to run, status in '{status_fp}'")
+    if not todo:
+        return status
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as pool:
+        futures = {}
+        for name in todo:
+            status.mark(name, 'queued')
+            futures[pool.submit(run_region, by_name[name])] = name
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                info = future.result() or {}
+            except Exception as e:
+                status.mark(name, 'failed', error=f"{type(e).__name__}: {e}")
+                print(f"> Region '{name}' failed:")
+                traceback.print_exception(type(e), e, e.__traceback__)
+                continue
+            status.mark(name, 'done', **info)
+            if verbose:
+                print(f"> Region '{name}' done.")
+
+    print(f"> Batch finished: {status.counts()}")
+    return status
@@ -0,0 +1,191 @@
+import os
+import re
+import gzip
+import json
+import sqlite3
+import hashlib
+import threading
+from time import time
+from contextlib import closing
+
+"""
+cache.py
+--------
+Persistent, content-addressed cache for Overpass responses.
+
+Responses are stored gzip compressed under the sha256 of their
+normalized query, with a small sqlite index tracking size and
+access times for LRU eviction and optional expiry.
+"""
+
+DEFAULT_ROOT = os.environ.get('GEOSCRAPE_CACHE', './data/cache/overpass')
+_default_cache = None
+
+
+def normalize_query(query: str) -> str:
+    """ Collapses whitespace in Overpass QL so formatting differences share a key. """
+    query = re.sub(r'\s+', ' ', query.strip())
+    return re.sub(r'\s*([;:,()\[\]=])\s*', r'\1', query)
+
+
+def query_key(query: str, verbosity: str, fmt: str = 'json') -> str:
+    """
+    Creates cache key for an Overpass query.
+
+    Args:
+        query (str):     Overpass QL body, including the bounds string.
+        verbosity (str): Output verbosity of the query, ex. 'geom', 'body'.
+        fmt (str):       Response format stored under the key.
+    Returns:
+        str: Hex sha256 digest.
+    """
+    payload = json.dumps([normalize_query(query), verbosity.strip(), fmt])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk LRU cache of compressed responses.
+
+    Args:
+        root (str):         Folder holding cached responses and index.
+        max_bytes (int):    Compressed size limit, least recently used entries
+                            are evicted past this.
+        ttl (float):        Optional lifetime of an entry in seconds.
+        compresslevel(int): gzip compression level.
+    """
+
+    def __init__(self, root: str = DEFAULT_ROOT, max_bytes: int = int(2e09),
+                 ttl: float = None, compresslevel: int = 6):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.compresslevel = compresslevel
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self.index_fp = os.path.join(root, 'index.sqlite')
+        with closing(self._connect()) as con, con:
+            con.execute("CREATE TABLE IF NOT EXISTS entries ("
+                        "key TEXT PRIMARY KEY, size INTEGER, created REAL, accessed REAL)")
+
+    def _connect(self):
+        return sqlite3.connect(self.index_fp, timeout=30)
+
+    def path(self, key: str) -> str:
+        """ Path of compressed response for key. """
+        return os.path.join(self.root, key[:2], f"{key}.json.gz")
+
+    def _expired(self, created: float) -> bool:
+        return (self.ttl is not None) and ((time() - created) > self.ttl)
+
+    def open(self, key: str):
+        """ Opens cached response as a binary stream, returns None on a miss. """
+        with closing(self._connect()) as con, con:
+            row = con.execute("SELECT created FROM entries WHERE key=?", (key,)).fetchone()
+            if row is None:
+                return None
+            if self._expired(row[0]) or not os.path.exists(self.path(key)):
+                self._remove(con, key)
+                return None
+            con.execute("UPDATE entries SET accessed=? WHERE key=?", (time(), key))
+        return gzip.open(self.path(key), 'rb')
+
+    def get(self, key: str) -> bytes:
+        """ Returns cached response bytes, or None on a miss. """
+        stream = self.open(key)
+        if stream is None:
+            return None
+        with stream:
+            return stream.read()
+
+    def put(self, key: str, data: bytes) -> None:
+        """ Stores response bytes under key. """
+        with self.writer(key) as f:
+            f.write(data)
+
+    def writer(self, key: str):
+        """ Returns a binary stream which commits to the cache when closed without error. """
+        return _CacheWriter(self, key)
+
+    def _commit(self, key: str, tmp_fp: str) -> None:
+        os.replace(tmp_fp, self.path(key))
+        size = os.path.getsize(self.path(key))
+        now = time()
+        with closing(self._connect()) as con, con:
+            con.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", (key, size, now, now))
+        self.evict()
+
+    def _remove(self, con, key: str) -> None:
+        con.execute("DELETE FROM entries WHERE key=?", (key,))
+        if os.path.exists(self.path(key)):
+            os.remove(self.path(key))
+
+    def evict(self) -> int:
+        """ Drops expired entries, then least recently used entries past max_bytes. Returns count removed. """
+        removed = 0
+        with self._lock, closing(self._connect()) as con, con:
+            if self.ttl is not None:
+                for (key,) in con.execute("SELECT key FROM entries WHERE created < ?",
+                                          (time() - self.ttl,)).fetchall():
+                    self._remove(con, key)
+                    removed += 1
+            total = con.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= self.max_bytes:
+                return removed
+            for (key, size) in con.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall():
+                self._remove(con, key)
+                removed += 1
+                total -= size
+                if total <= self.max_bytes:
+                    break
+        return removed
+
+    def size(self) -> int:
+        """ Total compressed bytes held. """
+        with closing(self._connect()) as con, con:
+            return con.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def clear(self) -> None:
+        """ Removes all entries. """
+        with self._lock, closing(self._connect()) as con, con:
+            for (key,) in con.execute("SELECT key FROM entries").fetchall():
+                self._remove(con, key)
+
+
+class _CacheWriter:
+    """ gzip stream into a temporary file, moved into place on a clean close. """
+
+    def __init__(self, cache: ResponseCache, key: str):
+        self.cache = cache
+        self.key = key
+        os.makedirs(os.path.dirname(cache.path(key)), exist_ok=True)
+        self.tmp_fp = f"{cache.path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self._stream = gzip.open(self.tmp_fp, 'wb', compresslevel=cache.compresslevel)
+
+    def write(self, data: bytes) -> int:
+        return self._stream.write(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stream.close()
+        if exc_type is None:
+            self.cache._commit(self.key, self.tmp_fp)
+        elif os.path.exists(self.tmp_fp):
+            os.remove(self.tmp_fp)
+        return False
+
+
+def get_default_cache() -> ResponseCache:
+    """ Returns the shared cache, created under DEFAULT_ROOT on first use. """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResponseCache()
+    return _default_cache
+
+
+def set_default_cache(cache) -> None:
+    """ Replaces the shared cache, pass False to disable caching for all call sites. """
+    global _default_cache
+    _default_cache = cache
@@ -0,0 +1,219 @@
+import os
+import json
+import sqlite3
+import pandas as pd
+from time import time
+from contextlib import closing
+
+"""
+catalog.py
+----------
+SQLite catalog of every dataset generated under the local output root.
+
+pipe_script records each run here: the region bounds, raster shape,
+dtype, CRS and resolution, chips, every written layer with its row
+count and size, and per-label counts. Questions like "which sets
+contain label X" or "total chip area at 1 m" are answered from this
+metadata, no layer or raster is reopened.
+"""
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS datasets ("
+    "name TEXT PRIMARY KEY, folder TEXT, west REAL, south REAL, east REAL, north REAL, "
+    "scale REAL, markdown TEXT, metrics TEXT, failed TEXT, updated REAL)",
+    "CREATE TABLE IF NOT EXISTS rasters ("
+    "dataset TEXT, kind TEXT, path TEXT, width INTEGER, height INTEGER, count INTEGER, dtype TEXT, "
+    "crs TEXT, res_x REAL, res_y REAL, size_bytes INTEGER, chips INTEGER, chip_size INTEGER, "
+    "PRIMARY KEY (dataset, kind))",
+    "CREATE TABLE IF NOT EXISTS layers ("
+    "dataset TEXT, layer TEXT, path TEXT, format TEXT, rows INTEGER, crs TEXT, geom_type TEXT, "
+    "size_bytes INTEGER, PRIMARY KEY (dataset, layer))",
+    "CREATE TABLE IF NOT EXISTS labels ("
+    "dataset TEXT, layer TEXT, label TEXT, category TEXT, count INTEGER)",
+    "CREATE INDEX IF NOT EXISTS labels_label ON labels (label, category)",
+    "CREATE INDEX IF NOT EXISTS datasets_bounds ON datasets (west, east, south, north)",
+]
+
+
+def _bounds_tuple(b) -> tuple:
+    if isinstance(b, dict):
+        return (b['west'], b['south'], b['east'], b['north'])
+    return tuple(b)
+
+
+class Catalog:
+    """
+    Dataset catalog in a single SQLite file, safe to update from batch workers.
+
+    Args:
+        fp (str): Catalog file, created with its folder if missing.
+    """
+
+    def __init__(self, fp: str):
+        self.fp = fp
+        if os.path.dirname(fp):
+            os.makedirs(os.path.dirname(fp), exist_ok=True)
+        with closing(self._connect()) as con, con:
+            for statement in SCHEMA:
+                con.execute(statement)
+
+    def _connect(self):
+        return sqlite3.connect(self.fp, timeout=30)
+
+    def _query(self, sql: str, params: tuple = ()) -> pd.DataFrame:
+        con = self._connect()
+        try:
+            return pd.read_sql_query(sql, con, params=params)
+        finally:
+            con.close()
+
+    """ Recording """
+    def record_dataset(self, dset_data: dict, folder: str, markdown_fp: str = None,
+                       metrics_fp: str = None, failed: list = None) -> None:
+        """ Adds or replaces a dataset row from its dset_data ('filename', bounds, 'scale'). """
+        (west, south, east, north) = _bounds_tuple(dset_data)
+        with closing(self._connect()) as con, con:
+            con.execute("INSERT OR REPLACE INTO datasets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (dset_data['filename'], folder, west, south, east, north, dset_data.get('scale'),
+                         markdown_fp, metrics_fp, json.dumps(failed or []), time()))
+
+    def record_raster(self, name: str, raster_fp: str, kind: str = 'image', chips: int = None,
+                      chip_size: int = None) -> None:
+        """
+        Adds raster metadata, read from the file header only.
+
+        Args:
+            name (str):      Dataset name.
+            raster_fp (str): GeoTIFF path.
+            kind (str):      'image' or 'mask'.
+            chips (int):     Chips cut from the raster.
+            chip_size (int): Chip edge in pixels.
+        """
+        import rasterio as rio
+
+        with rio.open(raster_fp) as src:
+            row = (name, kind, raster_fp, src.width, src.height, src.count, src.dtypes[0],
+                   src.crs.to_string() if src.crs else None, abs(src.res[0]), abs(src.res[1]),
+                   os.path.getsize(raster_fp), chips, chip_size)
+        with closing(self._connect()) as con, con:
+            con.execute("INSERT OR REPLACE INTO rasters VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+
+    def record_layer(self, name: str, layer: str, gdf, fp: str, fmt: str = None,
+                     label_key: str = 'label', category_key: str = 'category') -> None:
+        """
+        Adds a written layer and its per-label counts, taken from the frame in memory.
+
+        Args:
+            name (str):         Dataset name.
+            layer (str):        Layer name, ex. 'buildings'.
+            gdf (GeoDataFrame): Layer as written.
+            fp (str):           Written file.
+            fmt (str):          Output format, default the file extension.
+            label_key (str):    Label column, layers without it record no labels.
+            category_key (str): Optional second-level label column.
+        """
+        fmt = fmt or os.path.splitext(fp)[1].lstrip('.')
+        geom_types = ','.join(sorted(gdf.geom_type.dropna().unique()))
+        size = os.path.getsize(fp) if os.path.isfile(fp) else _folder_size(fp)
+        labels = []
+        if label_key in gdf.columns:
+            keys = [label_key] + ([category_key] if category_key in gdf.columns else [])
+            counts = gdf.groupby(keys, dropna=False).size()
+            for index, count in counts.items():
+                (label, category) = index if isinstance(index, tuple) else (index, None)
+                labels.append((name, layer, _text(label), _text(category), int(count)))
+
+        with closing(self._connect()) as con, con:
+            con.execute("INSERT OR REPLACE INTO layers VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (name, layer, fp, fmt, len(gdf), gdf.crs.to_string() if gdf.crs else None,
+                         geom_types, size))
+            con.execute("DELETE FROM labels WHERE dataset=? AND layer=?", (name, layer))
+            con.executemany("INSERT INTO labels VALUES (?, ?, ?, ?, ?)", labels)
+
+    def remove(self, name: str) -> None:
+        """ Drops every row of a dataset. """
+        with closing(self._connect()) as con, con:
+            for table, column in [('datasets', 'name'), ('rasters', 'dataset'),
+                                  ('layers', 'dataset'), ('labels', 'dataset')]:
+                con.execute(f"DELETE FROM {table} WHERE {column}=?", (name,))
+
+    """ Queries """
+    def datasets(self) -> pd.DataFrame:
+        """ Every dataset with its image raster shape and resolution. """
+        return self._query("SELECT d.*, r.width, r.height, r.count, r.dtype, r.crs, r.res_x, r.res_y, "
+                           "r.size_bytes AS raster_bytes, r.chips, r.chip_size FROM datasets d "
+                           "LEFT JOIN rasters r ON r.dataset = d.name AND r.kind = 'image' ORDER BY d.name")
+
+    def layers(self, name: str = None) -> pd.DataFrame:
+        """ Written layers, of one dataset or all. """
+        if name is None:
+            return self._query("SELECT * FROM layers ORDER BY dataset, layer")
+        return self._query("SELECT * FROM layers WHERE dataset=? ORDER BY layer", (name,))
+
+    def with_label(self, label: str, category: str = None, layer: str = None, min_count: int = 1) -> pd.DataFrame:
+        """
+        Datasets holding a label.
+
+        Args:
+            label (str):     Top-level label, ex. 'house' or 'residential'.
+            category (str):  Optional second-level label.
+            layer (str):     Optional layer, ex. 'roads'.
+            min_count (int): Fewest features per dataset.
+        Returns:
+            pd.DataFrame: 'dataset', 'layer', 'count', most features first.
+        """
+        sql = "SELECT dataset, layer, SUM(count) AS count FROM labels WHERE label=?"
+        params = [label]
+        if category is not None:
+            sql += " AND category=?"
+            params.append(category)
+        if layer is not None:
+            sql += " AND layer=?"
+            params.append(layer)
+        sql += " GROUP BY dataset, layer HAVING SUM(count) >= ? ORDER BY count DESC"
+        return self._query(sql, tuple(params) + (min_count,))
+
+    def label_totals(self, layer: str = None, by_category: bool = False) -> pd.DataFrame:
+        """ Feature counts per label summed over every dataset, with the number of datasets holding it. """
+        keys = "layer, label" + (", category" if by_category else "")
+        sql = f"SELECT {keys}, SUM(count) AS count, COUNT(DISTINCT dataset) AS datasets FROM labels"
+        params = ()
+        if layer is not None:
+            sql += " WHERE layer=?"
+            params = (layer,)
+        return self._query(sql + f" GROUP BY {keys} ORDER BY count DESC", params)
+
+    def chip_area(self, res: float = None, tolerance: float = 1e-6) -> pd.DataFrame:
+        """
+        Chip count and ground area (km2) per raster resolution.
+
+        Args:
+            res (float):       Only rasters at this pixel size (CRS units, m for UTM).
+            tolerance (float): Allowed difference from res.
+        """
+        sql = ("SELECT res_x, res_y, COUNT(*) AS datasets, SUM(chips) AS chips, "
+               "SUM(chips * chip_size * chip_size * res_x * res_y) / 1e6 AS area_km2 "
+               "FROM rasters WHERE kind = 'image' AND chips IS NOT NULL")
+        params = ()
+        if res is not None:
+            sql += " AND ABS(res_x - ?) <= ? AND ABS(res_y - ?) <= ?"
+            params = (res, tolerance, res, tolerance)
+        return self._query(sql + " GROUP BY res_x, res_y ORDER BY res_x", params)
+
+    def intersecting(self, bounds) -> pd.DataFrame:
+        """ Datasets whose bounds intersect bounds (dict or (west, south, east, north), EPSG:4326). """
+        (west, south, east, north) = _bounds_tuple(bounds)
+        return self._query("SELECT * FROM datasets WHERE west <= ? AND east >= ? AND south <= ? AND north >= ? "
+                           "ORDER BY name", (east, west, north, south))
+
+
+def _text(value):
+    return None if pd.isnull(value) else str(value)
+
+
+def _folder_size(fp: str) -> int:
+    """ Total size of a partitioned dataset folder, 0 if missing. """
+    total = 0
+    for root, _, files in os.walk(fp):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
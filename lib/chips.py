@@ -0,0 +1,138 @@
+import os
+import multiprocessing
+import numpy as np
+import rasterio as rio
+from rasterio.windows import Window
+from concurrent.futures import ProcessPoolExecutor
+
+from lib.outputs import read_layer
+from lib.spatialindex import SpatialIndex, group_pairs
+
+"""
+chips.py
+--------
+Cuts rasters into fixed-size training chips with windowed reads.
+
+Rasters are never read whole: each worker process opens its own
+dataset handle once and reads only the windows it is given. Workers
+are spawned, not forked, so no GDAL state or open handle of the
+parent is inherited. Chips keep their own georeferenced transform,
+windows that hold nothing but nodata are skipped.
+"""
+
+# Dataset handle held by each worker process
+_src = None
+
+
+def chip_offsets(length: int, size: int, stride: int) -> list:
+    """ Window offsets along one axis, the last window is snapped to the edge. """
+    if length <= size:
+        return [0]
+    offsets = list(range(0, length - size + 1, stride))
+    if offsets[-1] != (length - size):
+        offsets.append(length - size)
+    return offsets
+
+
+def chip_windows(width: int, height: int, size: int = 256, stride: int = None) -> list:
+    """
+    Plans chip windows over a raster.
+
+    Args:
+        width (int):  Raster width in pixels.
+        height (int): Raster height in pixels.
+        size (int):   Chip edge in pixels.
+        stride (int): Step between chips, defaults to size (no overlap).
+                      Overlap between neighbours is size - stride.
+    Returns:
+        list: Row-major rasterio Windows, all size x size unless the raster is smaller.
+    """
+    stride = stride or size
+    return [Window(col, row, min(size, width), min(size, height))
+            for row in chip_offsets(height, size, stride)
+            for col in chip_offsets(width, size, stride)]
+
+
+def chip_name(stem: str, window: Window) -> str:
+    """ Chip file name from its pixel offsets. """
+    return f"{stem}_{int(window.row_off):06d}_{int(window.col_off):06d}.tif"
+
+
+def _open_dataset(raster_fp: str) -> None:
+    global _src
+    _src = rio.open(raster_fp)
+
+
+def _write_chip(args) -> str:
+    """ Reads one window from the worker's dataset, writes it as a chip. Returns None if skipped. """
+    (window, out_fp, skip_nodata) = args
+    if skip_nodata and not np.any(_src.read_masks(window=window)):
+        return None
+    data = _src.read(window=window)
+    profile = _src.profile.copy()
+    profile.update({
+        'driver': 'GTiff',
+        'width': int(window.width),
+        'height': int(window.height),
+        'transform': _src.window_transform(window),
+        'compress': 'deflate',
+        'tiled': False,
+    })
+    for key in ['blockxsize', 'blockysize', 'BIGTIFF']:
+        profile.pop(key, None)
+    with rio.open(out_fp, 'w', **profile) as dst:
+        dst.write(data)
+    return out_fp
+
+
+def generate_chips(raster_fp: str, out_dir: str, size: int = 256, stride: int = None,
+                   workers: int = 4, skip_nodata: bool = True, verbose: bool = False) -> list:
+    """
+    Cuts a raster into georeferenced chips using a process pool.
+
+    Args:
+        raster_fp (str):    Source GeoTIFF.
+        out_dir (str):      Chip output folder, created if missing.
+        size (int):         Chip edge in pixels.
+        stride (int):       Step between chips, defaults to size.
+        workers (int):      Worker processes, each holding its own dataset handle.
+        skip_nodata (bool): Skip windows where every pixel is masked as nodata.
+        verbose (bool):     Print summary.
+    Returns:
+        list: (path, Window) for every chip written.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    with rio.open(raster_fp) as src:
+        windows = chip_windows(src.width, src.height, size=size, stride=stride)
+    stem = os.path.splitext(os.path.basename(raster_fp))[0]
+    jobs = [(w, os.path.join(out_dir, chip_name(stem, w)), skip_nodata) for w in windows]
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_open_dataset, initargs=(raster_fp,)) as pool:
+        paths = list(pool.map(_write_chip, jobs, chunksize=max(1, len(jobs) // (workers * 8))))
+
+    chips = [(fp, w) for fp, w in zip(paths, windows) if fp is not None]
+    if verbose:
+        print(f"> Wrote {len(chips)} chips, skipped {len(windows) - len(chips)} nodata windows: '{out_dir}'")
+    return chips
+
+
+def chip_features(chips: list, raster_fp: str, index_fp: str, layer_fp: str = None) -> list:
+    """
+    Looks up the label features of every chip through a saved layer index.
+
+    Args:
+        chips (list):    (path, Window) pairs from generate_chips.
+        raster_fp (str): Raster the chips were cut from.
+        index_fp (str):  SpatialIndex saved by LayerWriter.
+        layer_fp (str):  Optional indexed layer, refines bounding box hits
+                         to exact intersections.
+    Returns:
+        list: Array of row positions in the layer for every chip.
+    """
+    index = SpatialIndex.load(index_fp)
+    geometry = read_layer(layer_fp).geometry.values if layer_fp else None
+    with rio.open(raster_fp) as src:
+        (query_idx, feature_idx) = index.query_windows([w for (_, w) in chips], src.transform, src.crs,
+                                                       geometry=geometry)
+    return group_pairs(query_idx, feature_idx, len(chips))
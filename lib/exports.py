@@ -0,0 +1,188 @@
+import threading
+from time import sleep as _sleep
+from concurrent.futures import Future
+from datetime import datetime as dt
+from pytz import timezone
+tz = timezone("US/Central")
+
+"""
+exports.py
+----------
+Non-blocking manager for Earth Engine batch export tasks.
+
+Tasks are submitted at once and started up to a concurrency limit,
+then polled together with exponential backoff between polls. Any
+object with start() and status() -> {'state': ..., 'error_message': ...}
+works as a task, so fakes can stand in for ee.batch.Task.
+"""
+
+DONE_STATES = ('COMPLETED', 'FAILED', 'CANCELLED')
+# State of a task missing from a batch status response
+UNKNOWN_STATE = 'UNKNOWN'
+
+
+class ExportManager:
+    """
+    Starts and polls export tasks.
+
+    Args:
+        max_active (int):     Tasks allowed to run at once, the rest wait queued.
+        min_interval (float): Seconds between polls right after a state change.
+        max_interval (float): Upper bound on seconds between polls.
+        backoff (float):      Poll interval multiplier while no task changes state.
+        batch_status:         Optional callable taking a list of tasks and returning
+                              their status dicts in one request. Defaults to
+                              calling task.status() on each.
+        max_unknown (int):    Polls in a row a task may be missing from the batch status
+                              before it is asked with task.status(), its Future fails
+                              if that is unknown too.
+        sleep:                Sleep function, replaceable for tests.
+        verbose (bool):       Print task state changes.
+    """
+
+    def __init__(self, max_active: int = 3, min_interval: float = 2.0, max_interval: float = 60.0,
+                 backoff: float = 2.0, batch_status=None, max_unknown: int = 5, sleep=_sleep,
+                 verbose: bool = False):
+        self.max_active = max_active
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.batch_status = batch_status or (lambda tasks: [t.status() for t in tasks])
+        self.max_unknown = max_unknown
+        self.sleep = sleep
+        self.verbose = verbose
+        self.interval = min_interval
+        self._queued = []
+        self._active = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, task, name: str = None, callback=None) -> Future:
+        """
+        Queues a task, returns a Future resolved with its final status.
+
+        Args:
+            task:           Unstarted export task.
+            name (str):     Name used when printing, defaults to the task repr.
+            callback:       Optional callable, receives the Future once the task finishes.
+        Returns:
+            Future: Result is the final status dict, raises RuntimeError on failure.
+        """
+        future = Future()
+        if callback is not None:
+            future.add_done_callback(callback)
+        name = name or repr(task)
+        with self._lock:
+            self._queued.append(_Entry(task, name, future))
+        return future
+
+    @property
+    def pending(self) -> int:
+        """ Number of queued and running tasks. """
+        with self._lock:
+            return len(self._queued) + len(self._active)
+
+    def poll_once(self) -> int:
+        """ Starts queued tasks up to the limit and polls running tasks once. Returns tasks still pending. """
+        with self._lock:
+            while self._queued and (len(self._active) < self.max_active):
+                entry = self._queued.pop(0)
+                try:
+                    entry.task.start()
+                except Exception as e:
+                    entry.future.set_exception(e)
+                    continue
+                self._active.append(entry)
+                self._log(entry, 'STARTED')
+            active = list(self._active)
+
+        changed = False
+        statuses = []
+        if active:
+            try:
+                statuses = self.batch_status([e.task for e in active])
+            except Exception as e:
+                # Transient API errors back off like an unchanged poll
+                if self.verbose:
+                    print(f"> Export status request failed, retrying: {e}")
+        for entry, status in zip(active, statuses):
+            state = status.get('state')
+            if state in (None, UNKNOWN_STATE):
+                entry.unknown += 1
+                if entry.unknown < self.max_unknown:
+                    continue
+                (status, state) = self._status_alone(entry)
+                if state in (None, UNKNOWN_STATE):
+                    changed = True
+                    with self._lock:
+                        self._active.remove(entry)
+                    self._log(entry, UNKNOWN_STATE)
+                    entry.future.set_exception(RuntimeError(
+                        status.get('error_message', f"Export state unknown after {entry.unknown} polls.")))
+                    continue
+            entry.unknown = 0
+            if state == entry.state:
+                continue
+            changed = True
+            entry.state = state
+            self._log(entry, state)
+            if state in DONE_STATES:
+                with self._lock:
+                    self._active.remove(entry)
+                if state == 'COMPLETED':
+                    entry.future.set_result(status)
+                else:
+                    entry.future.set_exception(RuntimeError(status.get('error_message', f"Export {state.lower()}.")))
+
+        self.interval = self.min_interval if changed else min(self.interval * self.backoff, self.max_interval)
+        return self.pending
+
+    def _status_alone(self, entry) -> tuple:
+        """ (status, state) of one task asked directly, for tasks missing from batch status responses. """
+        try:
+            status = entry.task.status()
+        except Exception as e:
+            return {'error_message': f"Export status unavailable: {e}"}, None
+        return status, status.get('state')
+
+    def run(self) -> None:
+        """ Polls on the calling thread until every submitted task has finished. """
+        while True:
+            if not self.poll_once():
+                # Decide to exit under the lock, so a task submitted meanwhile is either
+                # seen here or finds no poller in start() and starts a new one
+                with self._lock:
+                    if not (self._queued or self._active):
+                        if self._thread is threading.current_thread():
+                            self._thread = None
+                        return
+                continue
+            self.sleep(self.interval)
+
+    def start(self) -> threading.Thread:
+        """ Polls on a background thread until every submitted task has finished. """
+        with self._lock:
+            if (self._thread is None) or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self.run, daemon=True)
+                self._thread.start()
+            return self._thread
+
+    def _log(self, entry, state: str) -> None:
+        if self.verbose:
+            print(f"> {entry.name}: {state}", dt.now(tz).strftime("[%H:%M:%S]"))
+
+
+class _Entry:
+    def __init__(self, task, name: str, future: Future):
+        self.task = task
+        self.name = name
+        self.future = future
+        self.state = None
+        self.unknown = 0
+
+
+def ee_batch_status(tasks: list) -> list:
+    """ Fetches the status of many ee.batch.Task objects in a single request. """
+    import ee
+    statuses = {s['id']: s for s in ee.data.getTaskStatus([t.id for t in tasks])}
+    return [statuses.get(t.id, {'state': UNKNOWN_STATE}) for t in tasks]
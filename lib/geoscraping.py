@@ -1,65 +1,297 @@
 import geopandas as gpd
-import overpass
+import numpy as np
 import overpy
 import pandas as pd
+import shapely
 import shapely.geometry as geometry
 from shapely.ops import linemerge, polygonize, polygonize_full, unary_union
 
+from lib.osmtools import fetch_overpass, overpass_to_geojson
 
 
-# Get the API key (this uses default key)
-api = overpass.API()
-over = overpy.Overpass()
 
+# overpy client, created on first use
+_over = None
 
 
-# method of converting ways from Overpass query to polygons
-def linetopoly(lines):
+# returns the shared overpy client
+def get_overpy():
+    """
+    Returns:
+    over (overpy.Overpass): client attached to parsed results, created on first call
+    """
+    global _over
+    if _over is None:
+        _over = overpy.Overpass()
+    return _over
+
+
+# replaces the shared overpy client
+def set_overpy(over):
     """
     Parameters:
-    lines (list of Overpy Way objects): the ways associated with query results, stored in Overpy Way objects
+    over (overpy.Overpass): client to attach to parsed results
+    """
+    global _over
+    _over = over
+
+
+
+# assembles polygons from way node ids and coordinates
+def assemble_polygons(node_ids, coords, offsets, n_tags=None):
+    """
+    Parameters:
+    node_ids (int64 array): node ids of every way, concatenated
+    coords (float64 array, shape (n, 2)): lon/lat of each entry in node_ids
+    offsets (int64 array): start of each way in node_ids, with the total length appended
+    n_tags (int array): optional tag count of each way, picks the source of stitched rings
+
+    Returns:
+    polygons (list of Shapely Polygons): assembled polygons
+    sources (int64 array): position of the originating way for each polygon, for rings
+        stitched from several ways the one with the most tags among the ways on its boundary
+    """
+    starts, ends = offsets[:-1], offsets[1:] - 1
+    lengths = ends - starts + 1
+    valid = lengths >= 2
+    closed = np.zeros(len(starts), dtype=bool)
+    closed[valid] = node_ids[starts[valid]] == node_ids[ends[valid]]
+
+    # closed ways are rings by themselves
+    ring_ways = np.flatnonzero(closed & (lengths >= 4))
+    ring_lengths = lengths[ring_ways]
+    ring_rows = np.repeat(np.arange(len(ring_ways)), ring_lengths)
+    ring_positions = np.repeat(starts[ring_ways] - (np.cumsum(ring_lengths) - ring_lengths), ring_lengths) + np.arange(len(ring_rows))
+    polygons = []
+    if len(ring_ways):
+        polygons = list(shapely.polygons(shapely.linearrings(coords[ring_positions], indices=ring_rows)))
+    sources = list(ring_ways)
+
+    # open ways are stitched only with ways sharing their end nodes
+    open_ways = np.flatnonzero(valid & ~closed)
+    parent = {}
+
+    def find(n):
+        while parent.setdefault(n, n) != n:
+            parent[n] = parent[parent[n]]
+            n = parent[n]
+        return n
+
+    for w in open_ways:
+        parent[find(node_ids[starts[w]])] = find(node_ids[ends[w]])
+
+    components = {}
+    for w in open_ways:
+        components.setdefault(find(node_ids[starts[w]]), []).append(w)
+
+    for ways in components.values():
+        if len(ways) < 2:
+            continue
+        lines = [geometry.LineString(coords[starts[w]:ends[w] + 1]) for w in ways]
+        for polygon in polygonize(unary_union(linemerge(lines))):
+            # tags come from the ways forming this ring, not from any way of the component
+            on_ring = shapely.covers(polygon.boundary, lines)
+            ring = [w for w, on in zip(ways, on_ring) if on] or ways
+            polygons.append(polygon)
+            sources.append(max(ring, key=lambda w: n_tags[w]) if n_tags is not None else ring[0])
+
+    return polygons, np.asarray(sources, dtype=np.int64)
+
+
+# compact node coordinate table, replaces per-node overpy objects
+class NodeTable:
+    """
+    Parameters:
+    ids (int64 array): node ids, sorted on construction
+    lon (float64 array): longitude of each node
+    lat (float64 array): latitude of each node
+    """
+
+    def __init__(self, ids, lon, lat):
+        ids = np.asarray(ids, dtype=np.int64)
+        order = np.argsort(ids, kind="stable")
+        self.ids = ids[order]
+        self.lon = np.asarray(lon, dtype=np.float64)[order]
+        self.lat = np.asarray(lat, dtype=np.float64)[order]
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_elements(cls, elements):
+        """ builds the table from raw Overpass json elements, ways are ignored """
+        nodes = [e for e in elements if e["type"] == "node"]
+        return cls(
+            np.fromiter((n["id"] for n in nodes), dtype=np.int64, count=len(nodes)),
+            np.fromiter((n["lon"] for n in nodes), dtype=np.float64, count=len(nodes)),
+            np.fromiter((n["lat"] for n in nodes), dtype=np.float64, count=len(nodes)),
+        )
+
+    @classmethod
+    def from_overpy(cls, result):
+        """ builds the table from an overpy Result, reading each node once """
+        nodes = result.nodes
+        return cls(
+            np.fromiter((n.id for n in nodes), dtype=np.int64, count=len(nodes)),
+            np.fromiter((float(n.lon) for n in nodes), dtype=np.float64, count=len(nodes)),
+            np.fromiter((float(n.lat) for n in nodes), dtype=np.float64, count=len(nodes)),
+        )
+
+    def lookup(self, node_ids):
+        """
+        Parameters:
+        node_ids (int64 array): node ids to gather
+
+        Returns:
+        coords (float64 array, shape (n, 2)): lon/lat of each node, NaN where missing
+        found (bool array): whether each node is in the table
+        """
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.ids, node_ids), max(len(self.ids) - 1, 0))
+        found = (self.ids[pos] == node_ids) if len(self.ids) else np.zeros(len(node_ids), dtype=bool)
+        coords = np.full((len(node_ids), 2), np.nan)
+        coords[found, 0] = self.lon[pos[found]]
+        coords[found, 1] = self.lat[pos[found]]
+        return coords, found
+
+
+# query result held as arrays: node table, flat way node ids and way offsets
+class ArrayResult:
+    """
+    Parameters:
+    nodes (NodeTable): coordinates of every node in the response
+    way_ids (int64 array): id of each way
+    way_nodes (int64 array): node ids of every way, concatenated
+    offsets (int64 array): start of each way in way_nodes, with the total length appended
+    tags (list of dicts): tags of each way
+    """
+
+    def __init__(self, nodes, way_ids, way_nodes, offsets, tags):
+        self.nodes = nodes
+        self.way_ids = way_ids
+        self.way_nodes = way_nodes
+        self.offsets = offsets
+        self.tags = tags
+
+    def __len__(self):
+        return len(self.way_ids)
+
+    @classmethod
+    def from_elements(cls, elements):
+        """ builds the result from raw Overpass json elements (body verbosity) """
+        ways = [e for e in elements if e["type"] == "way"]
+        lengths = np.fromiter((len(w["nodes"]) for w in ways), dtype=np.int64, count=len(ways))
+        way_nodes = np.fromiter(
+            (n for w in ways for n in w["nodes"]), dtype=np.int64, count=int(lengths.sum())
+        )
+        return cls(
+            NodeTable.from_elements(elements),
+            np.fromiter((w["id"] for w in ways), dtype=np.int64, count=len(ways)),
+            way_nodes,
+            np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+            [w.get("tags", {}) for w in ways],
+        )
+
+
+# gathers way coordinates from the node table, ways with unresolved nodes are dropped
+def gather_ways(nodes, way_nodes, offsets):
+    """
+    Parameters:
+    nodes (NodeTable): node coordinates
+    way_nodes (int64 array): node ids of every way, concatenated
+    offsets (int64 array): start of each way in way_nodes, with the total length appended
+
+    Returns:
+    node_ids, coords, offsets: arrays for assemble_polygons, restricted to complete ways
+    kept (int64 array): position of each remaining way in the input
+    """
+    coords, found = nodes.lookup(way_nodes)
+    lengths = np.diff(offsets)
+    complete = np.ones(len(lengths), dtype=bool)
+    nonempty = lengths > 0
+    complete[nonempty] = np.logical_and.reduceat(found, offsets[:-1][nonempty]) if len(found) else True
+    kept = np.flatnonzero(complete)
+    mask = np.repeat(complete, lengths)
+    new_offsets = np.concatenate([[0], np.cumsum(lengths[kept])]).astype(np.int64)
+    return way_nodes[mask], coords[mask], new_offsets, kept
+
+
+# converts an ArrayResult to polygons without creating node or way objects
+def arraytopoly(result):
+    """
+    Parameters:
+    result (ArrayResult): the ways and nodes of a query
 
     Returns:
     polygons (list of Shapely Polygons): the polygons of building footprints from query
-    tags (list of strings): the associated tags of the buildings
+    tags (list of dicts): the tags of the way each polygon was built from
+    way_ids (list of ints): the id of the way each polygon was built from
     """
-    lss = []
-    tags = []
-    # iterate through ways in query
-    for ii_w, way in enumerate(lines):
-        ls_coords = []
-        tags.append(way.tags)
+    node_ids, coords, offsets, kept = gather_ways(result.nodes, result.way_nodes, result.offsets)
+    n_tags = np.fromiter((len(result.tags[w]) for w in kept), dtype=np.int64, count=len(kept))
+    polygons, sources = assemble_polygons(node_ids, coords, offsets, n_tags)
+    sources = kept[sources]
+    tags = [result.tags[s] for s in sources]
+    way_ids = result.way_ids[sources].tolist()
+    return polygons, tags, way_ids
 
-        # go through each node of the way
-        for node in way.nodes:
-            ls_coords.append((node.lon, node.lat))  # create a list of node coordinates
 
-        lss.append(geometry.LineString(ls_coords))  # create a LineString from coords
+# method of converting ways from Overpass query to polygons
+def linetopoly(lines, result=None):
+    """
+    Parameters:
+    lines (list of Overpy Way objects): the ways associated with query results, stored in Overpy Way objects
+    result (Overpy Result): the result the ways belong to, its nodes are read once into a NodeTable
+        default: the result the first way is attached to
+
+    Returns:
+    polygons (list of Shapely Polygons): the polygons of building footprints from query
+    tags (list of dicts): the tags of the way each polygon was built from
+    way_ids (list of ints): the id of the way each polygon was built from
+    """
+    if len(lines) == 0:
+        return [], [], []
+    # overpy has no public accessor for a way's node ids, Way.nodes builds a Node lookup
+    # per reference (the cost the NodeTable avoids), so the private id lists are read
+    if result is None:
+        result = lines[0]._result
+    nodes = NodeTable.from_overpy(result)
+    lengths = np.fromiter((len(way._node_ids) for way in lines), dtype=np.int64, count=len(lines))
+    way_nodes = np.fromiter(
+        (n for way in lines for n in way._node_ids), dtype=np.int64, count=int(lengths.sum())
+    )
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
 
-    merged = linemerge([*lss])  # merge LineStrings
-    borders = unary_union(merged)  # linestrings to a MultiLineString
-    polygons = list(polygonize(borders))  # polygon from MultiLineString
-    return polygons, tags
+    # ways with nodes missing from the result are dropped
+    node_ids, coords, offsets, kept = gather_ways(nodes, way_nodes, offsets)
+    n_tags = np.fromiter((len(lines[w].tags) for w in kept), dtype=np.int64, count=len(kept))
+    polygons, sources = assemble_polygons(node_ids, coords, offsets, n_tags)
+    sources = kept[sources]
+    tags = [lines[s].tags for s in sources]
+    way_ids = [lines[s].id for s in sources]
+    return polygons, tags, way_ids
 
 def querytoframe(query):
     """
     Parameters:
-    query (Overpy Result object): the results of a query, stored in the Result structure of Overpy
+    query (ArrayResult or Overpy Result object): the results of a query
 
     Returns:
-    final (GeoDataFrame): a GeoDataFrame of the results, including the polygons and associated tags
+    final (GeoDataFrame): a GeoDataFrame of the results, including the polygons, their way ids and associated tags
     """
-    # get lists of building polygons and associated tags
-    polygons, tags = linetopoly(query.ways)
-
-    # convert tags to a Dataframe and insert polygons
-    tags = pd.DataFrame(tags)
-    polygons = pd.DataFrame(polygons)
-    polygons.columns = ["geometry"]
+    # get lists of building polygons, their source way ids and tags
+    if isinstance(query, ArrayResult):
+        polygons, tags, way_ids = arraytopoly(query)
+    else:
+        polygons, tags, way_ids = linetopoly(query.ways, query)
+
+    # convert tags to a Dataframe and insert polygons, rows are already aligned
+    tags = pd.DataFrame(tags, index=range(len(polygons)))
+    polygons = pd.DataFrame({"geometry": polygons, "osm_id": way_ids})
     polygons = polygons.join(tags, how="left")
 
     # convert to a GeoDataFrame and return
-    final = gpd.GeoDataFrame(polygons)
+    final = gpd.GeoDataFrame(polygons, geometry="geometry")
     return final
 
 
@@ -90,25 +322,29 @@ def formatquery(bounds, key, value):
 
 
 # queries buildings using input
-def buildingquery(bounds, building_key, building_value):
+def buildingquery(bounds, building_key, building_value, as_overpy=False):
     """
     Parameters:
     bounds (list or comma-seperated values): set of bounds for bbox
     building_key (string): key for the overpass query (ex. amenity, building, etc.)
     building_value (string): value for the overpass query (ex. hospital, restaurant, etc.)
+    as_overpy (bool): return an Overpy Result instead of arrays
 
     Returns:
-    result (Overpy Result object): the results of the query
+    result (ArrayResult or Overpy Result object): the results of the query
     """
 
     bounds, building_key = formatquery(bounds, building_key, building_value)
 
-    # this uses the overpy query method
+    # raw json is fetched through the shared cache, then parsed into arrays (or by overpy)
     # example query is amenity=restaurant
-    result = over.query(
-        "way" + bounds + " [" + building_key + building_value + "]; (._;>;);out body;"
+    response = fetch_overpass(
+        "way" + bounds + " [" + building_key + building_value + "]; (._;>;);",
+        verbosity="body",
     )
-    return result
+    if as_overpy:
+        return overpy.Result.from_json(response, api=get_overpy())
+    return ArrayResult.from_elements(response["elements"])
 
 
 # queries roads using input
@@ -127,10 +363,10 @@ def roadquery(bounds, road_key, road_value):
 
     # this uses the overpass query method
     # example query is highway=footway
-    api_data = api.get(
+    api_data = overpass_to_geojson(fetch_overpass(
         "way" + bounds + " [" + road_key + road_value + "];(._;>;);",
         verbosity="geom",
-    )
+    ))
 
     # Make a GeoDataFrame from the data gathered from the query
     gdf = gpd.GeoDataFrame.from_features(api_data["features"])
@@ -1,7 +1,3 @@
-import ee
-import rasterio as rio 
-import geopandas as gpd
-import shapely.geometry as shp
 
 def raster_world_bounds(raster) -> dict:
     """ 
@@ -27,6 +23,9 @@ def raster_world_bounds(raster) -> dict:
             'north' (float): Maximum Lat coord
             'east' (float): Maximum Long coord
     """
+    import geopandas as gpd
+    import shapely.geometry as shp
+
     bounding_poly = shp.box(*(raster.bounds))
     gdf = gpd.GeoDataFrame(geometry=[bounding_poly], crs=raster.crs)
     gdf = gdf.to_crs('EPSG:4326')
@@ -45,6 +44,8 @@ def to_region(bounds) -> list:
     Returns:    
         List of coordinate tuples representing region for query.
     """ 
+    import ee
+
     if isinstance(bounds, list):
         coords = bounds
         if (len(coords) != 5) or (len(coords[0]) != 2):
@@ -1,33 +1,33 @@
 import numpy as np
 import pandas as pd
 
+from lib.tagstats import as_tag_store, cooccurrence, presence_matrix, subkey_fill
+
 """
 Visualization only for geometry and raster analysis.
 """
 
 
 def gdf_relational_nulls(gdf, keys):
+    """ 
+    Prints filled counts of each key and of every key pair.
     
-    null_report = {key: [] for key in keys}
-    
-    for _, row in gdf.iterrows():
-        null_series = row.isnull()
-        for key, item in null_report.items():
-            is_filled = not null_series.get(key)
-            item.append(is_filled)
-            
-    for key, item in null_report.items():
-        null_report.update({key: np.asarray(item)})
+    Returns:
+        dict: Key -> boolean array of filled rows.
+    """
+    tags = as_tag_store(gdf)
+    matrix, present = presence_matrix(tags, keys)
+    counts = cooccurrence(tags, keys)
+    null_report = {key: np.zeros(len(gdf), dtype=bool) for key in keys}
+    for col, key in enumerate(present):
+        null_report[key] = matrix[:, col].toarray().ravel()
     
-    finished_key_a = []
-    for idx, (key_a, item_a) in enumerate(null_report.items()):
-        if idx+1 == len(null_report.keys()):
-            break
-        print(f"Comparing '{key_a}' ({np.count_nonzero(item_a == True)})")
-        for key_b, item_b in null_report.items():
-            if (key_a != key_b) and (key_b not in finished_key_a):
-                print(f" - '{key_a}' and '{key_b}': {np.logical_and(item_a, item_b).sum()}")
-        finished_key_a.append(key_a)
+    for idx, key_a in enumerate(keys[:-1]):
+        filled = counts.at[key_a, key_a] if key_a in counts.index else 0
+        print(f"Comparing '{key_a}' ({filled})")
+        for key_b in keys[idx+1:]:
+            both = counts.at[key_a, key_b] if (key_a in counts.index) and (key_b in counts.index) else 0
+            print(f" - '{key_a}' and '{key_b}': {both}")
 
     return null_report
 
@@ -81,24 +81,13 @@ def gdf_value_columns(gdf, keys: list = None, verbose: bool = True):
 
 
 def print_unique_subkeys(gdf, key: str, name: str = "GDF"):
-    unique_subkeys = {}
-    for _, r in gdf.iterrows():
-        category = r[key]
-        rfulls = r.notnull()
-        if category in gdf.columns:
-            if category not in unique_subkeys:
-                unique_subkeys.update({category: {'filled': 0, 'total': 0}})
-            
-            if rfulls.get(category):
-                unique_subkeys[category]['filled'] += 1
-            unique_subkeys[category]['total'] += 1
-
-
+    """ Prints, per label of key that is also a column, how many rows fill that column. """
+    depth = subkey_fill(gdf, key, sort=False)
     print(f"{name}: '{key}'")
-    for subkey, subdata in unique_subkeys.items():
-        print(f"- '{subkey}':")
-        for k, count in subdata.items():
-            print(f'\t- {k}: {count}')
+    for row in depth.itertuples(index=False):
+        print(f"- '{row.label}':")
+        print(f'\t- filled: {row.filled}')
+        print(f'\t- total: {row.total}')
             
             
             
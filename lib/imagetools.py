@@ -1,42 +1,86 @@
 import os
-import ee
-import geopandas as gpd
-from google.oauth2.challenges import REAUTH_ORIGIN
-import shapely.geometry as shp
 
 from lib.geotools import to_region
+from lib.exports import ExportManager, ee_batch_status
+from lib.rasterfetch import ee_tile_fetcher, fetch_raster, max_tile_size
+from lib.transfer import RangeNotSupported, download_ranges
 from lib.misc import file_size, print_header, show_dict, show_keys
 
-from datetime import datetime as dt
-from pytz import timezone 
-tz = timezone("US/Central")
-
 """
 imagetools.py
 -------------
 Tools for manipulating and downloading raster imagery.
+ee is imported on first use.
 """
 
 # Earth Engine Tools        
 
-def export_naip_image(gdrive, drive_folder, dset_data) -> str:
+def naip_image():
+    """ NAIP mosaic used for all exports. """
+    import ee
+    naip_data = ee.ImageCollection("USDA/NAIP/DOQQ").filter(ee.Filter.date('2017-01-01', '2019-01-01'))
+    return naip_data.mosaic()
+
+
+def download_naip_direct(dset_data, out_dir: str, workers: int = 8, fetch=None, verbose: bool = False) -> str:
     """
-    Exports an image from the NAIP dataset to the provided google drive.
+    Downloads the NAIP mosaic over an area straight from Earth Engine as tiles,
+    stitched into a local GeoTIFF. Skips the export to drive.
     
     Args:
-        - gdrive (GoogleDrive): Google Drive object to check for duplicate files.
-        - drive_folder:         PyDrive File object, represents folder where rasters 
-                                will be exported in Google Drive.
-        - dset_data (dict):     Dict containing keyed data on area to extract.
-                                - 'west','south',...:   lat/lon bounds as floats
-                                - 'scale' (int):        resolution in meters per pixel
-                                - 'filename' (str):     name to store output under
+        - dset_data (dict): Dict containing keyed data on area to extract.
+                            - 'west','south',...:   lat/lon bounds as floats
+                            - 'scale' (int):        resolution in meters per pixel
+                            - 'filename' (str):     name to store output under
+        - out_dir (str):    Local output folder for raster.
+        - workers (int):    Concurrent tile requests.
+        - fetch:            Optional tile fetch function, see rasterfetch.fetch_raster.
+                            Defaults to getDownloadURL requests on the NAIP mosaic.
     Returns:
-        str: filename as it appears in drive. Indexed '_{:02}' if a duplicate was located.
-    """  
-    drive_fp = dset_data['filename'] + '.tif'
+        str: Path of the local raster.
+    """
+    if fetch is None:
+        fetch = ee_tile_fetcher(naip_image())
+    out_path = os.path.join(out_dir, f"{dset_data['filename']}.tif")
+    # NAIP has 4 uint8 bands (R, G, B, N)
+    fetch_raster(fetch, 
+                 bounds=dset_data, 
+                 scale=dset_data['scale'], 
+                 out_path=out_path, 
+                 tile_size=max_tile_size(count=4, dtype='uint8'), 
+                 workers=workers, 
+                 verbose=verbose)
+    print(f"> Completed direct raster download: '{out_path}'")
+    return out_path
+
 
-    # Check for duplicate filename
+def naip_export_task(drive_folder, dset_data):
+    """
+    Creates an unstarted task exporting the NAIP mosaic over an area to drive.
+    
+    Args:
+        - drive_folder:     PyDrive File object, represents folder where rasters 
+                            will be exported in Google Drive.
+        - dset_data (dict): Dict containing keyed data on area to extract.
+                            - 'west','south',...:   lat/lon bounds as floats
+                            - 'scale' (int):        resolution in meters per pixel
+                            - 'filename' (str):     name to store output under
+    Returns:
+        ee.batch.Task: Export task.
+    """
+    import ee
+    # Create 'task' to export the image, specifying scale and region.
+    return ee.batch.Export.image.toDrive(image=naip_image(),        # EE Image to export
+                                         description=dset_data['filename'],      # (str) Desription of task, will become exported file name
+                                         fileFormat='GeoTIFF',      # (str) File export format
+                                         region=to_region(dset_data),  # (list(5,2)) Bounds to crop image to
+                                         folder=drive_folder['title'],       # (str) Ouput folder in drive
+                                         scale=dset_data['scale'])               # (int) Pixel res in meters
+
+
+def check_drive_duplicate(gdrive, drive_folder, dset_data):
+    """ Raises RuntimeError if the export target already exists in the drive folder. """
+    drive_fp = dset_data['filename'] + '.tif'
     file_list = gdrive.ListFile({'q': f"title='{drive_fp}' and \
                                         '{drive_folder['id']}' in parents and \
                                         trashed=false and \
@@ -44,31 +88,55 @@ def export_naip_image(gdrive, drive_folder, dset_data) -> str:
     
     if len(file_list) > 0:
         raise RuntimeError(f"Can't export image to google drive, file already exists under passed name: '{dset_data['filename']}'")
+
+
+def export_naip_image(gdrive, drive_folder, dset_data, manager: ExportManager = None) -> None:
+    """
+    Exports an image from the NAIP dataset to the provided google drive.
+    Blocks until the export finishes, see export_naip_images for many areas.
     
-    naip_data = ee.ImageCollection("USDA/NAIP/DOQQ").filter(ee.Filter.date('2017-01-01', '2019-01-01'))
-    naip_image = naip_data.mosaic()
+    Args:
+        - gdrive (GoogleDrive): Google Drive object to check for duplicate files.
+        - drive_folder:         PyDrive File object, represents folder where rasters 
+                                will be exported in Google Drive.
+        - dset_data (dict):     Dict containing keyed data on area to extract.
+                                - 'west','south',...:   lat/lon bounds as floats
+                                - 'scale' (int):        resolution in meters per pixel
+                                - 'filename' (str):     name to store output under
+        - manager (ExportManager): Optional shared manager polling the task.
+    Raises:
+        RuntimeError: If the file already exists in drive or the export fails.
+    """  
+    future = export_naip_images(gdrive, drive_folder, [dset_data], manager=manager)[dset_data['filename']]
+    future.result()
+    print()
 
-    # Create 'task' to export the image, specifying scale and region.
-    task = ee.batch.Export.image.toDrive(image=naip_image,          # EE Image to export
-                                         description=dset_data['filename'],      # (str) Desription of task, will become exported file name
-                                         fileFormat='GeoTIFF',      # (str) File export format
-                                         region=to_region(dset_data),  # (list(5,2)) Bounds to crop image to
-                                         folder=drive_folder['title'],       # (str) Ouput folder in drive
-                                         scale=dset_data['scale'])               # (int) Pixel res in meters
 
-    # Run Export task verbosely
-    task.start()
-    print(f"Started Image export of '{drive_folder['title']}/{drive_fp}' to drive.")
-    last_state = None
-    while True:
-        if task.status()['state'] != last_state:
-            print('>', task.status()['state'], dt.now(tz).strftime("[%H:%M:%S]"))
-            last_state = task.status()['state']
-            if (last_state == "COMPLETED"):
-                print()
-                return
-            elif (last_state == "FAILED"):
-                raise RuntimeError(task.status()['error_message'])
+def export_naip_images(gdrive, drive_folder, dsets: list, manager: ExportManager = None, max_active: int = 3) -> dict:
+    """
+    Submits NAIP exports for many areas without blocking.
+    
+    Args:
+        - gdrive (GoogleDrive): Google Drive object to check for duplicate files.
+        - drive_folder:         PyDrive File object for the output folder.
+        - dsets (list):         dset_data dicts, see export_naip_image.
+        - manager (ExportManager): Manager to submit to, a new one polling on a 
+                                background thread is created when None.
+        - max_active (int):     Concurrent export limit for a new manager.
+    Returns:
+        dict: Future per dset 'filename', resolved with the final task status.
+    """
+    if manager is None:
+        manager = ExportManager(max_active=max_active, batch_status=ee_batch_status, verbose=True)
+    
+    futures = {}
+    for dset_data in dsets:
+        check_drive_duplicate(gdrive, drive_folder, dset_data)
+        task = naip_export_task(drive_folder, dset_data)
+        futures[dset_data['filename']] = manager.submit(task, name=f"{drive_folder['title']}/{dset_data['filename']}.tif")
+        print(f"Queued Image export of '{drive_folder['title']}/{dset_data['filename']}.tif' to drive.")
+    manager.start()
+    return futures
             
 # Google drive tools
 
@@ -107,9 +175,32 @@ def show_raster_keys(gdrive, show_items: bool = False):
     return raster_file
 
 
-def download_raster(gdrive, drive_folder, set_name: str, out_dir: str, skip_conf: bool = False) -> str:
+def drive_range_fetcher(drive_file):
+    """ 
+    Creates a byte range fetch function for a PyDrive file.
+    Each call authorizes its own http object, so calls can run in parallel.
+    """
+    url = drive_file['downloadUrl']
+    
+    def fetch(start: int, end: int) -> bytes:
+        http = drive_file.auth.Get_Http_Object()
+        resp, content = http.request(url, headers={'Range': f"bytes={start}-{end}"})
+        if resp.status == 206:
+            return content
+        elif resp.status == 200:
+            # Range ignored, the whole file came back, download_ranges switches to it
+            raise RangeNotSupported(content)
+        raise RuntimeError(f"Range request for '{drive_file['title']}' failed with status {resp.status}.")
+    
+    return fetch
+
+
+def download_raster(gdrive, drive_folder, set_name: str, out_dir: str, skip_conf: bool = False, 
+                    workers: int = 4, chunk_size: int = 32 * 1024 * 1024) -> str:
     """ 
     Downloads GeoTiff raster to file by name. 
+    Fetched as parallel byte ranges, resumes an interrupted download 
+    of the same file and verifies the result against the drive md5.
     
     Note:
         Need to change argument to accept all dset data as dict.
@@ -123,6 +214,8 @@ def download_raster(gdrive, drive_folder, set_name: str, out_dir: str, skip_conf
         - out_dir (str):        Local output folder for raster.
         - skip_conf (bool):     When True, skips confirmation prompt.
                                     default : False
+        - workers (int):        Concurrent range requests.
+        - chunk_size (int):     Bytes per range request.
     Returns:
         str: filename as it appears locally.
     """
@@ -157,7 +250,13 @@ def download_raster(gdrive, drive_folder, set_name: str, out_dir: str, skip_conf
         choice = input("Confirm download (y/[n]) ")
     
     if ('y' in choice):
-        target_file.GetContentFile(out_path, 'image/tif')
+        download_ranges(drive_range_fetcher(target_file), 
+                        size=int(target_file['fileSize']), 
+                        out_path=out_path, 
+                        md5=target_file.get('md5Checksum'), 
+                        chunk_size=chunk_size, 
+                        workers=workers, 
+                        verbose=True)
         print(f"> Completed Raster download: '{out_path}'")
         return out_path
     else:
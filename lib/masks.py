@@ -0,0 +1,105 @@
+import os
+import numpy as np
+import shapely
+import rasterio as rio
+from rasterio.features import rasterize
+from rasterio.windows import bounds as window_bounds
+from rasterio.windows import transform as window_transform
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from lib.outputs import read_layer
+from lib.rasterfetch import plan_tiles
+
+"""
+masks.py
+--------
+Burns label layers into class masks on a raster's pixel grid.
+
+Layers are reprojected to the raster CRS once, indexed with an STRtree
+and matched to every window in a single bulk query. Windows are then
+rasterized in parallel, each only seeing the shapes that touch it, and
+written into a tiled mask GeoTIFF co-registered with the image.
+"""
+
+# Class code per layer, layers are burned in this order so later ones win
+LAYER_CODES = {'ungrouped': 1, 'roads': 2, 'buildings': 3}
+
+
+def mask_path(raster_fp: str) -> str:
+    """ Mask GeoTIFF written next to an image. """
+    return os.path.splitext(raster_fp)[0] + '_mask.tif'
+
+
+def _burn_window(geoms, values, window, transform, all_touched):
+    out = rasterize(zip(geoms, values),
+                    out_shape=(int(window.height), int(window.width)),
+                    transform=window_transform(window, transform),
+                    fill=0,
+                    dtype='uint8',
+                    all_touched=all_touched)
+    return window, out
+
+
+def rasterize_layers(raster_fp: str, layers: dict, out_fp: str = None, codes: dict = LAYER_CODES,
+                     window_size: int = 1024, workers: int = 4, all_touched: bool = False,
+                     verbose: bool = False) -> str:
+    """
+    Rasterizes label layers into a uint8 class mask aligned to a raster.
+
+    Args:
+        raster_fp (str):   Image GeoTIFF, the mask copies its CRS, transform and shape.
+        layers (dict):     Layer name -> GeoDataFrame or layer path (see outputs.read_layer).
+        out_fp (str):      Output mask, defaults to mask_path(raster_fp).
+        codes (dict):      Class code per layer name, 0 is background. Layers missing
+                           from codes are skipped, burn order follows codes.
+        window_size (int): Window edge in pixels, multiple of 16.
+        workers (int):     Windows rasterized at once.
+        all_touched (bool): Burn every pixel touched by a shape, not only pixel centers.
+        verbose (bool):    Print summary.
+    Returns:
+        str: out_fp
+    """
+    out_fp = out_fp or mask_path(raster_fp)
+    with rio.open(raster_fp) as src:
+        (crs, transform, width, height) = (src.crs, src.transform, src.width, src.height)
+
+    # Reproject in bulk, concatenated in burn order
+    geoms, values = [], []
+    for name, code in codes.items():
+        if layers.get(name) is None:
+            continue
+        gdf = read_layer(layers[name]) if isinstance(layers[name], str) else layers[name]
+        geom = gdf.geometry[gdf.geometry.notnull()].to_crs(crs).values
+        geoms.append(np.asarray(geom, dtype=object))
+        values.append(np.full(len(geom), code, dtype='uint8'))
+    geoms = np.concatenate(geoms) if geoms else np.empty(0, dtype=object)
+    values = np.concatenate(values) if values else np.empty(0, dtype='uint8')
+
+    # One query for all windows, pairs are grouped by window
+    windows = plan_tiles(width, height, window_size)
+    boxes = shapely.box(*np.array([window_bounds(w, transform) for w in windows]).T)
+    (win_idx, geom_idx) = shapely.STRtree(geoms).query(boxes, predicate='intersects')
+    order = np.lexsort((geom_idx, win_idx))
+    (win_idx, geom_idx) = (win_idx[order], geom_idx[order])
+    starts = np.searchsorted(win_idx, np.arange(len(windows) + 1))
+    jobs = [(windows[i], geom_idx[starts[i]:starts[i + 1]])
+            for i in range(len(windows)) if starts[i + 1] > starts[i]]
+
+    with rio.open(out_fp, 'w', driver='GTiff', width=width, height=height, count=1, dtype='uint8',
+                  crs=crs, transform=transform, tiled=True, blockxsize=min(window_size, 512),
+                  blockysize=min(window_size, 512), compress='deflate', BIGTIFF='IF_SAFER') as dst:
+        # Empty windows are never written, unwritten blocks read as background
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            running = set()
+            while jobs or running:
+                while jobs and (len(running) < 2 * workers):
+                    (window, idx) = jobs.pop(0)
+                    running.add(pool.submit(_burn_window, geoms[idx], values[idx], window, transform, all_touched))
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    (window, data) = future.result()
+                    dst.write(data, 1, window=window)
+
+    if verbose:
+        print(f"> Rasterized {len(geoms)} shapes over {len(windows)} windows: '{out_fp}'")
+    return out_fp
@@ -0,0 +1,202 @@
+import sys
+import json
+import threading
+from contextlib import contextmanager
+from time import perf_counter, process_time, thread_time
+from datetime import datetime as dt
+from pytz import timezone
+tz = timezone("US/Central")
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak RSS is left out
+    resource = None
+
+"""
+metrics.py
+----------
+Lightweight instrumentation for pipeline stages and library calls.
+
+Code is wrapped in named spans recording wall time, CPU time of the
+span's own thread, CPU time of the whole process (every thread, so it
+includes concurrent stages), growth of the process peak RSS and any
+counts added while the span is open (rows, bytes in and out). Spans
+opened on the same thread nest, functions run on pool threads nest
+under the submitting span when passed through wrap().
+Records are written as JSON lines, one span per line, so many runs can
+be concatenated and compared.
+"""
+
+COUNTS = ('rows_in', 'rows_out', 'bytes_in', 'bytes_out')
+
+
+def peak_rss_kb() -> int:
+    """ Peak resident set size of this process in KiB, None where unsupported. """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, KiB elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+class Span:
+    """ One timed section. Counts passed to add() are summed, other attributes replaced. """
+
+    def __init__(self, name: str, parent: str = None, depth: int = 0, **attrs):
+        self.name = name
+        self.parent = parent
+        self.depth = depth
+        self.attrs = attrs
+        self.status = 'done'
+        self.error = None
+        self.started = dt.now(tz).isoformat(timespec='milliseconds')
+        self.t0 = perf_counter()
+        self.wall = 0.0
+        self.thread_cpu = 0.0
+        self.process_cpu = 0.0
+        self.rss_delta_kb = None
+        self.peak_rss_kb = None
+
+    def add(self, **attrs) -> None:
+        for key, value in attrs.items():
+            if (key in COUNTS) and (key in self.attrs):
+                self.attrs[key] += value
+            else:
+                self.attrs[key] = value
+
+    def to_dict(self) -> dict:
+        record = {
+            'name': self.name,
+            'parent': self.parent,
+            'depth': self.depth,
+            'started': self.started,
+            'status': self.status,
+            'wall_s': round(self.wall, 6),
+            'thread_cpu_s': round(self.thread_cpu, 6),
+            'process_cpu_s': round(self.process_cpu, 6),
+            'peak_rss_delta_kb': self.rss_delta_kb,
+            'peak_rss_kb': self.peak_rss_kb,
+        }
+        record.update(self.attrs)
+        if self.error is not None:
+            record['error'] = self.error
+        return record
+
+    def __repr__(self):
+        return f"Span('{self.name}', {self.status}, {self.wall:.3f}s)"
+
+
+class Metrics:
+    """
+    Thread-safe span recorder.
+
+    Args:
+        run (str): Run name added to every record, e.g. the dataset name.
+    """
+
+    def __init__(self, run: str = None):
+        self.run = run
+        self.spans = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self) -> list:
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def current(self) -> Span:
+        """ Innermost open span of this thread, else the span inherited through wrap(), else None. """
+        stack = self._stack()
+        return stack[-1] if stack else getattr(self._local, 'parent', None)
+
+    def wrap(self, func):
+        """ Wraps func to run on another thread, spans it opens nest under the span open here. """
+        parent = self.current()
+
+        def run(*args, **kwargs):
+            previous = getattr(self._local, 'parent', None)
+            self._local.parent = parent
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._local.parent = previous
+        return run
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """
+        Times the enclosed block, yields the Span so counts can be added.
+        Exceptions mark the span 'failed' and are re-raised.
+        """
+        parent = self.current()
+        s = Span(name, parent=parent.name if parent else None, depth=parent.depth + 1 if parent else 0, **attrs)
+        stack = self._stack()
+        stack.append(s)
+        rss = peak_rss_kb()
+        (thread_cpu, process_cpu) = (thread_time(), process_time())
+        try:
+            yield s
+        except BaseException as e:
+            s.status = 'failed'
+            s.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            s.wall = perf_counter() - s.t0
+            s.thread_cpu = thread_time() - thread_cpu
+            s.process_cpu = process_time() - process_cpu
+            s.peak_rss_kb = peak_rss_kb()
+            if rss is not None:
+                s.rss_delta_kb = s.peak_rss_kb - rss
+            stack.pop()
+            with self._lock:
+                self.spans.append(s)
+
+    def add(self, **attrs) -> None:
+        """ Adds counts or attributes to the innermost open span of this thread, if any. """
+        stack = self._stack()
+        if stack:
+            stack[-1].add(**attrs)
+
+    def records(self) -> list:
+        """ Span dicts in start order. """
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.t0)
+        return [dict({'run': self.run}, **s.to_dict()) for s in spans]
+
+    def write_jsonl(self, fp: str, append: bool = False) -> str:
+        """ Writes every span as one JSON line, returns fp. """
+        with open(fp, 'a' if append else 'w') as f:
+            for record in self.records():
+                f.write(json.dumps(record, default=str) + '\n')
+        return fp
+
+
+# Recorder used by library functions, replaced per run
+_default_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    return _default_metrics
+
+
+def set_metrics(metrics: Metrics) -> Metrics:
+    """ Replaces the recorder used by span() and add(), returns it. """
+    global _default_metrics
+    _default_metrics = metrics
+    return metrics
+
+
+def span(name: str, **attrs):
+    """ Span on the default recorder, see Metrics.span. """
+    return _default_metrics.span(name, **attrs)
+
+
+def add(**attrs) -> None:
+    """ Adds to the innermost open span on the default recorder. """
+    _default_metrics.add(**attrs)
+
+
+def wrap(func):
+    """ Wraps func for a pool thread on the default recorder, see Metrics.wrap. """
+    return _default_metrics.wrap(func)
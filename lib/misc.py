@@ -2,8 +2,6 @@ import os
 import shutil
 from time import time
 import numpy as np
-import geopandas as gpd
-import shapely.geometry as shp
 
 """
 General geometry/crs manipulation tools.
@@ -300,15 +298,15 @@ def color_excepthook():
     from kirbykit/util
     """
     import sys, traceback
-    from pygments import highlight
-    from pygments.lexers import get_lexer_by_name
-    from pygments.formatters import TerminalFormatter
-
-    lexer = get_lexer_by_name("pytb" if sys.version_info.major < 3 else "py3tb")
-    formatter = TerminalFormatter()
 
+    # pygments is only loaded once an exception is printed
     def myexcepthook(type, value, tb):
+        from pygments import highlight
+        from pygments.lexers import get_lexer_by_name
+        from pygments.formatters import TerminalFormatter
+
+        lexer = get_lexer_by_name("pytb" if sys.version_info.major < 3 else "py3tb")
         tbtext = ''.join(traceback.format_exception(type, value, tb))
-        sys.stderr.write(highlight(tbtext, lexer, formatter))
+        sys.stderr.write(highlight(tbtext, lexer, TerminalFormatter()))
 
     sys.excepthook = myexcepthook
\ No newline at end of file
@@ -0,0 +1,184 @@
+import re
+import sys
+import json
+import codecs
+from array import array
+
+import numpy as np
+import shapely
+import geopandas as gpd
+
+from lib.tagstore import TagStore
+
+"""
+osmstream.py
+------------
+Streaming parser for raw Overpass json.
+
+Elements are decoded one at a time from the response stream, nodes
+are dropped as they arrive and ways are appended to flat coordinate,
+offset and tag columns. The GeoDataFrame is built from those arrays
+directly, so no FeatureCollection or per-feature dicts are kept.
+"""
+
+_WS = re.compile(r'[\s,]*')
+_REMARK = re.compile(r'"remark"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+
+def iter_elements(stream, chunk_size: int = 1 << 16):
+    """
+    Yields elements from a raw Overpass json response one at a time.
+
+    Args:
+        stream:           Binary or text file-like object holding the response.
+        chunk_size (int): Bytes read from the stream per refill.
+    Yields:
+        dict: Single Overpass element.
+    Raises:
+        RuntimeError: If the response carries an Overpass runtime error remark.
+        ValueError:   If the stream ends before the elements array closes.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buf, pos, eof = '', 0, False
+
+    def refill():
+        nonlocal buf, pos, eof
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            eof = True
+            chunk = b''
+        if isinstance(chunk, bytes):
+            chunk = utf8.decode(chunk, final=eof)
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    # Seek to the start of the elements array
+    while True:
+        match = re.search(r'"elements"\s*:\s*\[', buf)
+        if match:
+            pos = match.end()
+            break
+        if eof:
+            raise ValueError("Response has no 'elements' array.")
+        refill()
+
+    while True:
+        pos = _WS.match(buf, pos).end()
+        if (pos >= len(buf)) and not eof:
+            refill()
+            continue
+        if buf.startswith(']', pos):
+            pos += 1
+            break
+        try:
+            elem, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise ValueError("Response ended inside the elements array.")
+            refill()
+            continue
+        pos = end
+        yield elem
+
+    # Overpass reports runtime errors in a remark after the elements
+    tail = buf[pos:]
+    while not eof:
+        buf, pos = '', 0
+        refill()
+        tail += buf
+    remark = _REMARK.search(tail)
+    if remark and remark.group(1).startswith('runtime error'):
+        raise RuntimeError(json.loads(f'"{remark.group(1)}"'))
+
+
+class WayColumns:
+    """
+    Columnar accumulator for way geometries and tags.
+
+    Coordinates are held as one flat (lon, lat) array with per-way
+    offsets, tags as a sparse column of (row, value) pairs per key.
+    """
+
+    def __init__(self):
+        self.ids = array('q')
+        self.coords = array('d')
+        self.offsets = array('q', [0])
+        self.tags = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, osm_id: int, coords, tags: dict = None) -> None:
+        """ Appends a way from an iterable of (lon, lat) pairs. """
+        row = len(self.ids)
+        for (lon, lat) in coords:
+            self.coords.append(lon)
+            self.coords.append(lat)
+        self.offsets.append(len(self.coords) // 2)
+        self.ids.append(osm_id)
+        if tags:
+            for key, value in tags.items():
+                column = self.tags.get(key)
+                if column is None:
+                    column = self.tags[key] = (array('q'), [])
+                column[0].append(row)
+                column[1].append(sys.intern(value) if isinstance(value, str) else value)
+
+    def add_element(self, elem: dict) -> bool:
+        """ Appends an Overpass way element with geometry, returns False if it was skipped. """
+        geometry = elem.get('geometry')
+        if (elem['type'] != 'way') or not geometry or (len(geometry) < 2):
+            return False
+        self.add(elem['id'], ((c['lon'], c['lat']) for c in geometry), elem.get('tags'))
+        return True
+
+    def geometry(self) -> np.ndarray:
+        """ Builds LineString array from flat coordinates. """
+        coords = np.frombuffer(self.coords, dtype=np.float64).reshape(-1, 2)
+        lengths = np.diff(np.frombuffer(self.offsets, dtype=np.int64))
+        indices = np.repeat(np.arange(len(lengths)), lengths)
+        return shapely.linestrings(coords, indices=indices)
+
+    def to_gdf(self, crs: str = 'EPSG:4326') -> gpd.GeoDataFrame:
+        """ Converts accumulated ways to a GeoDataFrame, one column per tag key. """
+        n = len(self.ids)
+        columns = {'osm_id': np.frombuffer(self.ids, dtype=np.int64).copy()}
+        for key, (rows, values) in self.tags.items():
+            column = np.full(n, None, dtype=object)
+            column[np.frombuffer(rows, dtype=np.int64)] = values
+            columns[key] = column
+        geometry = self.geometry() if n else np.empty(0, dtype=object)
+        return gpd.GeoDataFrame(columns, geometry=geometry, crs=crs)
+
+    def tag_store(self) -> TagStore:
+        """ Accumulated tags as a CSR TagStore, rows follow way order. """
+        columns = {k: (np.frombuffer(rows, dtype=np.int64), values) for k, (rows, values) in self.tags.items()}
+        return TagStore.from_columns(len(self.ids), columns)
+
+    def to_ways(self, crs: str = 'EPSG:4326') -> tuple:
+        """ Converts accumulated ways to (GeoDataFrame of 'osm_id' and geometry, TagStore). """
+        ids = np.frombuffer(self.ids, dtype=np.int64).copy()
+        geometry = self.geometry() if len(ids) else np.empty(0, dtype=object)
+        return gpd.GeoDataFrame({'osm_id': ids}, geometry=geometry, crs=crs), self.tag_store()
+
+
+def read_ways(stream, crs: str = 'EPSG:4326', chunk_size: int = 1 << 16, wide: bool = True):
+    """
+    Parses ways with geometry from a raw Overpass json stream.
+
+    Args:
+        stream:           Binary or text file-like object, ex. an open response
+                          or cache entry. Query must use 'geom' verbosity.
+        crs (str):        CRS assigned to the output.
+        chunk_size (int): Bytes read per refill.
+        wide (bool):      Expand tags into one column per key. When False, tags
+                          are returned separately as a TagStore.
+    Returns:
+        GeoDataFrame: LineString per way with 'osm_id' and a column per tag key,
+                      or (GeoDataFrame of 'osm_id' and geometry, TagStore).
+    """
+    columns = WayColumns()
+    for elem in iter_elements(stream, chunk_size=chunk_size):
+        columns.add_element(elem)
+    return columns.to_gdf(crs=crs) if wide else columns.to_ways(crs=crs)
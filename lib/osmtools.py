@@ -1,17 +1,28 @@
-import overpass 
+import json
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-import shapely.geometry as shp
-from geojson.feature import FeatureCollection
+import shapely
+from geojson.feature import Feature, FeatureCollection
+from geojson.geometry import LineString, Point
+from time import monotonic, sleep
+from overpass.errors import MultipleRequestsError, ServerLoadError, ServerRuntimeError
+from overpass.errors import TimeoutError as OverpassTimeout
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-op = overpass.API()
+from lib.cache import get_default_cache, query_key
+from lib.metrics import add, span, wrap
+from lib.overpass_client import get_client
+from lib.osmstream import WayColumns, read_ways
+from lib.tagstore import TagStore
 
 """ 
 osmtools.py
 -----------
 OpenStreetMap API toolkit for querying geometries and parsing responses. 
 
-May want to pass the API object later.
+Requests go through the shared client in overpass_client (pooled, rate
+limited, with mirror failover), see get_client/set_client.
 """
 
 def overpass_bounds(b):
@@ -36,15 +47,289 @@ def overpass_bounds(b):
     bounds_str = bounds_str.replace("]", ")")
     return bounds_str
 
+
+def bounds_dict(b) -> dict:
+    """ Converts an overpass-ordered bounding list or bounding dict to a dict of floats. """
+    if isinstance(b, dict):
+        return {key: float(b[key]) for key in ['south', 'west', 'north', 'east']}
+    if isinstance(b, list) and (len(b) == 4):
+        return dict(zip(['south', 'west', 'north', 'east'], [float(v) for v in b]))
+    raise NotImplementedError("Bounding conversion requires list of length 4 or dict.")
+
+
+def split_bounds(b, rows: int = 2, cols: int = 2) -> list:
+    """ 
+    Splits a bounding box into a grid of sub-boxes.
+    
+    Args:
+        b (dict/list):  Bounds to split, any format accepted by overpass_bounds.
+        rows (int):     Number of tiles along latitude.
+        cols (int):     Number of tiles along longitude.
+    Returns:
+        list: Bounding dicts for each tile, row-major from the south-west corner.
+    """
+    b = bounds_dict(b)
+    lats = np.linspace(b['south'], b['north'], rows + 1)
+    lons = np.linspace(b['west'], b['east'], cols + 1)
+    tiles = []
+    for r in range(rows):
+        for c in range(cols):
+            tiles.append({
+                'south': float(lats[r]), 
+                'west': float(lons[c]), 
+                'north': float(lats[r+1]), 
+                'east': float(lons[c+1]),
+            })
+    return tiles
+
+
+def tile_grid(b, tile_deg: float = 0.05) -> tuple:
+    """ Returns (rows, cols) needed to cover bounds with tiles no larger than tile_deg degrees. """
+    b = bounds_dict(b)
+    rows = int(np.ceil(((b['north'] - b['south']) / tile_deg) - 1e-9))
+    cols = int(np.ceil(((b['east'] - b['west']) / tile_deg) - 1e-9))
+    return max(rows, 1), max(cols, 1)
+
+
+def fetch_overpass(query: str, verbosity: str = "geom", cache=None) -> dict:
+    """ 
+    Runs an Overpass QL query, returning the raw json response.
+    Responses are read from and stored in the shared response cache.
+    
+    Args:
+        query (str):     Overpass QL body, output statement is added by the API.
+        verbosity (str): Output verbosity, ex. 'geom', 'body'.
+        cache:           ResponseCache to use, the shared cache when None, 
+                         False to skip caching.
+    Returns:
+        dict: Parsed Overpass json, elements under 'elements'.
+    """
+    if cache is None:
+        cache = get_default_cache()
+    if not cache:
+        return get_client().get_json(query, verbosity=verbosity)
+    
+    key = query_key(query, verbosity)
+    data = cache.get(key)
+    if data is not None:
+        return json.loads(data)
+    
+    response = get_client().get_json(query, verbosity=verbosity)
+    cache.put(key, json.dumps(response).encode('utf-8'))
+    return response
+
+
+def overpass_to_geojson(response: dict) -> FeatureCollection:
+    """ Converts raw Overpass json to GeoJSON, nodes as Points and ways with geometry as LineStrings. """
+    features = []
+    for elem in response['elements']:
+        if elem['type'] == 'node':
+            geometry = Point((elem['lon'], elem['lat']))
+        elif (elem['type'] == 'way') and elem.get('geometry'):
+            geometry = LineString([(c['lon'], c['lat']) for c in elem['geometry']])
+        else:
+            continue
+        features.append(Feature(id=elem['id'], geometry=geometry, properties=elem.get('tags', {})))
+    return FeatureCollection(features)
+
+
+def stream_overpass(query: str, verbosity: str = "geom", cache=None, chunk_size: int = 1 << 16):
+    """ 
+    Runs an Overpass QL query, returning the raw json response as a binary stream.
+    The response is never held in memory whole, on a cache miss it is written 
+    through to the shared response cache in chunks and read back from there.
+    
+    Args:
+        query (str):      Overpass QL body, output statement is added here.
+        verbosity (str):  Output verbosity, ex. 'geom', 'body'.
+        cache:            ResponseCache to use, the shared cache when None, 
+                          False to stream straight from the connection.
+        chunk_size (int): Bytes per read from the connection.
+    Returns:
+        Binary file-like object, caller closes.
+    """
+    if cache is None:
+        cache = get_default_cache()
+    if cache:
+        key = query_key(query, verbosity)
+        stream = cache.open(key)
+        if stream is not None:
+            return stream
+    
+    # Rate limits, retries and endpoint failover are handled by the client
+    r = get_client().post(f"[out:json];{query}out {verbosity};", stream=True)
+    
+    if not cache:
+        r.raw.decode_content = True
+        return r.raw
+    with r, cache.writer(key) as f:
+        for chunk in r.iter_content(chunk_size=chunk_size):
+            f.write(chunk)
+    return cache.open(key)
+
+
+def query_ways(bounds, wide: bool = True):
+    """ 
+    Queries all ways in bounds, parsed from the response stream as LineStrings. 
+    With wide=False returns (ways, TagStore) instead of one column per tag key.
+    """
+    with span("overpass ways") as s:
+        stream = stream_overpass("way" + overpass_bounds(bounds) + ";(._;>;);", verbosity="geom")
+        with stream:
+            try:
+                result = read_ways(stream, wide=wide)
+            except RuntimeError as e:
+                # Runtime errors (timeouts, memory) are reported inside the response body
+                raise ServerRuntimeError(str(e)) from e
+        s.add(rows_out=len(result if wide else result[0]))
+        return result
+
+
+def merge_frames(frames: list) -> gpd.GeoDataFrame:
+    """ Merges tiled frames, ways crossing tile edges are kept once by OSM id. """
+    frames = [f for f in frames if len(f)] or frames[:1]
+    gdf = pd.concat(frames, ignore_index=True)
+    gdf = gdf.drop_duplicates(subset='osm_id', ignore_index=True)
+    return gpd.GeoDataFrame(gdf, geometry='geometry', crs=frames[0].crs)
+
+
+def merge_ways(frames: list) -> tuple:
+    """ merge_frames for (ways, TagStore) pairs, tag tables are merged without widening. """
+    frames = [f for f in frames if len(f[0])] or frames[:1]
+    ways = pd.concat([w for (w, _) in frames], ignore_index=True)
+    tags = TagStore.concat([t for (_, t) in frames])
+    keep = ~ways['osm_id'].duplicated().to_numpy()
+    ways = gpd.GeoDataFrame(ways[keep].reset_index(drop=True), geometry='geometry', crs=frames[0][0].crs)
+    return ways, tags.take(keep)
+
+
+def get_osm_tiled(bounds, tile_deg: float = 0.05, workers: int = 4, 
+                  max_elements: int = 50000, max_depth: int = 4, verbose: bool = False, wide: bool = True,
+                  retry_delay: float = 30.0, max_requeues: int = 5):
+    """ 
+    Queries ways in bounds as a grid of tiles run through a bounded worker pool.
+    
+    Tiles that time out, overload the server, or return more than max_elements 
+    are split into quarters and requeued, up to max_depth splits. Rate limited 
+    tiles are not split, they are requeued whole after retry_delay (doubled per attempt).
+    
+    Args:
+        bounds (dict/list): Area to query, any format accepted by overpass_bounds.
+        tile_deg (float):   Largest starting tile edge in degrees.
+        workers (int):      Number of concurrent Overpass requests.
+        max_elements (int): Way count above which a tile is split further.
+                            None disables count based splitting.
+        max_depth (int):    Maximum number of times a tile can be split.
+        verbose (bool):     Print tile progress.
+        wide (bool):        One column per tag key, else tags are kept in a TagStore.
+        retry_delay (float): Seconds before a rate limited tile is sent again.
+        max_requeues (int): Rate limited attempts per tile before giving up.
+    Returns:
+        GeoDataFrame: Merged ways as LineStrings with duplicates removed,
+                      or (ways, TagStore) when wide is False.
+    Raises:
+        RuntimeError: If a tile still fails after max_depth splits or max_requeues.
+    """
+    rows, cols = tile_grid(bounds, tile_deg=tile_deg)
+    pending = [(tile, 0) for tile in split_bounds(bounds, rows=rows, cols=cols)]
+    # Rate limited tiles, (time ready, tile, depth)
+    delayed = []
+    requeues = {}
+    frames = []
+    
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        while pending or running or delayed:
+            now = monotonic()
+            pending.extend((tile, depth) for (ready, tile, depth) in delayed if ready <= now)
+            delayed = [d for d in delayed if d[0] > now]
+            while pending and (len(running) < workers):
+                tile, depth = pending.pop(0)
+                running[pool.submit(wrap(query_ways), tile, wide)] = (tile, depth)
+            
+            next_ready = min(d[0] for d in delayed) - now if delayed else None
+            if not running:
+                sleep(max(0.0, next_ready))
+                continue
+            done, _ = wait(running, timeout=next_ready, return_when=FIRST_COMPLETED)
+            for future in done:
+                tile, depth = running.pop(future)
+                try:
+                    frame = future.result()
+                    n_ways = len(frame if wide else frame[0])
+                    oversized = (max_elements is not None) and (n_ways > max_elements)
+                except MultipleRequestsError as e:
+                    # Splitting would only send more requests, retry the same tile later
+                    key = overpass_bounds(tile)
+                    requeues[key] = requeues.get(key, 0) + 1
+                    if requeues[key] > max_requeues:
+                        raise RuntimeError(f"Tile {key} still rate limited after {max_requeues} retries.") from e
+                    if verbose:
+                        print(f"> Rate limited, retrying tile {key} later")
+                    delayed.append((monotonic() + retry_delay * 2 ** (requeues[key] - 1), tile, depth))
+                    continue
+                except (OverpassTimeout, ServerLoadError, ServerRuntimeError) as e:
+                    frame, oversized = None, True
+                    if depth >= max_depth:
+                        raise RuntimeError(f"Tile {overpass_bounds(tile)} failed after {depth} splits.") from e
+                
+                if oversized and (depth < max_depth):
+                    if verbose:
+                        print(f"> Splitting tile {overpass_bounds(tile)} (depth {depth+1})")
+                    pending.extend([(t, depth+1) for t in split_bounds(tile)])
+                    continue
+                frames.append(frame)
+                if verbose:
+                    print(f"> Tile {overpass_bounds(tile)}: {n_ways} ways")
+    
+    if not wide:
+        (ways, tags) = merge_ways(frames)
+        add(rows_out=len(ways), tiles=len(frames))
+        return ways, tags
+    gdf = merge_frames(frames)
+    add(rows_out=len(gdf), tiles=len(frames))
+    return gdf
+
     
 
 def geojson_to_gdf(response: FeatureCollection):
     """ Convert a GeoJSON response object to clean GeoDataFrame. """
-    way_features = [f for f in response.features if f.geometry['type'] == "LineString"]
-    gdf = gpd.GeoDataFrame.from_features(way_features)
+    columns = WayColumns()
+    for f in response.features:
+        if f.geometry['type'] == "LineString":
+            columns.add(f.get('id', -1), f.geometry['coordinates'], f.properties)
+    gdf = columns.to_gdf()
     gdf.reset_index(inplace=True)
     return gdf
 
+def label_keys(tags: TagStore, main_key: str) -> list:
+    """ Keys parse_osm_gdf reads: main_key, 'name' and every label of main_key that is also a key. """
+    return [main_key, 'name'] + [v for v in tags.unique_values(main_key) if v in tags]
+
+
+def tagged_frame(ways, tags: TagStore, rows, keys: list = None) -> gpd.GeoDataFrame:
+    """ 
+    Materializes a wide frame for a subset of ways.
+    
+    Args:
+        ways (GeoDataFrame): 'osm_id' and geometry per way.
+        tags (TagStore):     Tags of ways, row aligned.
+        rows (array):        Row positions or boolean mask, ex. tags.has('building').
+        keys (list):         Tag columns to build, None builds every key present in rows.
+    Returns:
+        GeoDataFrame: 'index' (row position in ways), 'osm_id', tag columns 
+                      in first-seen order and geometry, like reset_index() 
+                      on a filtered wide frame.
+    """
+    rows = np.asarray(rows)
+    if rows.dtype == bool:
+        rows = np.flatnonzero(rows)
+    frame = tags.take(rows).to_frame(keys)
+    frame.insert(0, 'osm_id', ways['osm_id'].to_numpy()[rows])
+    frame.insert(0, 'index', rows)
+    return gpd.GeoDataFrame(frame, geometry=ways.geometry.to_numpy()[rows], crs=ways.crs)
+
+
 def drop_empty_cols(gdf):
     empty_keys = [k for k in gdf.columns if gdf[k].notnull().sum() == 0]
     return gdf.drop(empty_keys, axis=1) 
@@ -61,43 +346,33 @@ def get_categories(gdf, main_key: str) -> pd.Series:
     Returns:
         pd.Series: Series containing second-level labels as assigned by main column.
     """
-    categories = []
-    for _, row in gdf.iterrows():
-        filled = row.notnull()
-        label = row[main_key]
-        if (label in gdf.columns) and filled.get(label):
-            categories.append(row[label])
-        else:
-            categories.append(None)
+    labels = gdf[main_key].to_numpy(dtype=object)
+    categories = np.full(len(labels), None, dtype=object)
+    
+    # Group row positions by label, then read each label-named column once
+    codes, uniques = pd.factorize(labels)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+    for code, label in enumerate(uniques):
+        if label not in gdf.columns:
+            continue
+        rows = order[bounds[code]:bounds[code+1]]
+        values = gdf[label].to_numpy(dtype=object)[rows]
+        filled = pd.notnull(values)
+        categories[rows[filled]] = values[filled]
     
     return pd.Series(categories)
 
     
-def get_osm_gdf(bounds):
+def get_osm_gdf(bounds, tiled: bool = False, workers: int = 4):
         
     # Query returns building footprints and roads
-    response = op.get(
-        "way" + overpass_bounds(bounds) + ";(._;>;);",
-        verbosity="geom",
-    )
-    
-    # Remove nodes before conversion, this is ~25x faster than removing from GDF
-    way_features = [f for f in response.features if f.geometry['type'] == "LineString"]
-    gdf = gpd.GeoDataFrame.from_features(way_features)
+    # Nodes are dropped while the response is parsed
+    if tiled:
+        gdf = get_osm_tiled(bounds, workers=workers)
+    else:
+        gdf = query_ways(bounds)
     gdf = gdf.drop([k for k in gdf.columns if 'tiger' in k], axis=1)
-    
-    buildings = gdf[gdf.building.notnull()]
-    building_second_labels = drop_empty_cols(buildings)
-    
-    roads = gdf[gdf.highway.notnull()]
-    roads = drop_empty_cols(roads)
-    
-    other = gdf[gdf.highway.isnull() & gdf.building.isnull()]
-    other = drop_empty_cols(other)
-    
-    roads.drop([key for key in roads.columns if key not in ['highway', 'service', 'geometry', 'index']])
-    buildings.drop([key for key in buildings.columns if key not in ['building', 'geometry', 'index']])
-    
     return gdf
 
 def parse_osm_gdf(gdf, main_key: str):
@@ -115,15 +390,7 @@ def parse_osm_gdf(gdf, main_key: str):
     """
         
     # Extract second-order categories
-    categories = []
-    for _, row in gdf.iterrows():
-        filled = row.notnull()
-        label = row[main_key]
-        if (label in gdf.columns) and filled.get(label):
-            categories.append(row[label])
-        else:
-            categories.append(None)
-    categories = pd.Series(categories)
+    categories = get_categories(gdf, main_key)
     
     if (categories.notnull().sum() == 0):
         # Series has no values
@@ -135,16 +402,198 @@ def parse_osm_gdf(gdf, main_key: str):
     gdf = gdf.rename(columns={main_key: 'label'})
 
     
-    KEY_WHITELIST = ['index', 'geometry', 'name', 'category', 'label']
+    KEY_WHITELIST = ['index', 'osm_id', 'geometry', 'name', 'category', 'label']
     return gdf.drop([k for k in gdf.columns if k not in KEY_WHITELIST], axis=1)
 
                 
-def gdf_polygonize(line_gdf):
-    polys = []
-    for idx, row in line_gdf.iterrows():
-        poly = shp.Polygon(row.geometry.coords)
-        polys.append(poly)
-        row.geometry = poly
-    return pd.Series(polys)
+def gdf_polygonize(line_gdf, return_report: bool = False):
+    """ 
+    Converts building perimeter LineStrings to Polygons in bulk.
+    
+    Unclosed rings are closed with their first vertex, rings with fewer 
+    than 4 vertices are dropped (None), invalid polygons are repaired 
+    with make_valid keeping only their polygonal area, collapsed ones are dropped.
+    
+    Args:
+        line_gdf (GeoDataFrame): Frame with LineString perimeters.
+        return_report (bool):    Also return counts of closed, repaired and dropped footprints.
+    Returns:
+        pd.Series: Polygon per row aligned to line_gdf, None where dropped.
+        dict: (if return_report) 'total', 'closed', 'repaired', 'dropped' counts.
+    """
+    lines = np.asarray(line_gdf.geometry.values, dtype=object)
+    n = len(lines)
+    coords, index = shapely.get_coordinates(lines, return_index=True)
+    counts = np.bincount(index, minlength=n)
+    starts = np.cumsum(counts) - counts
+    
+    # Close open rings by repeating their first vertex
+    nonempty = counts > 0
+    unclosed = np.zeros(n, dtype=bool)
+    unclosed[nonempty] = np.any(coords[starts[nonempty]] != coords[(starts + counts - 1)[nonempty]], axis=1)
+    closing = np.flatnonzero(unclosed)
+    index = np.concatenate([index, closing])
+    coords = np.concatenate([coords, coords[starts[closing]]])
+    order = np.argsort(index, kind='stable')
+    index, coords = index[order], coords[order]
+    
+    # Build rings from rows with enough vertices, using compact ring ids
+    ring_counts = counts + unclosed
+    kept = np.flatnonzero(ring_counts >= 4)
+    keep_coords = (ring_counts >= 4)[index]
+    ring_ids = np.searchsorted(kept, index[keep_coords])
+    polys = np.full(n, None, dtype=object)
+    if len(kept):
+        polys[kept] = shapely.polygons(shapely.linearrings(coords[keep_coords], indices=ring_ids))
+    
+    # Repair invalid footprints, the structure method only returns (Multi)Polygons,
+    # so polygons nested in a collection (ex. self-touching rings) are kept
+    invalid = np.flatnonzero(~shapely.is_valid(polys) & shapely.is_geometry(polys))
+    if len(invalid):
+        repaired = shapely.make_valid(polys[invalid], method='structure', keep_collapsed=False)
+        single = (shapely.get_type_id(repaired) == 6) & (shapely.get_num_geometries(repaired) == 1)
+        repaired[single] = shapely.get_geometry(repaired[single], 0)
+        repaired[shapely.is_empty(repaired) | (shapely.area(repaired) <= 0)] = None
+        polys[invalid] = repaired
+    
+    report = {
+        'total': n,
+        'closed': int(unclosed[kept].sum()),
+        'repaired': int(shapely.is_geometry(polys[invalid]).sum()),
+        'dropped': int(n - shapely.is_geometry(polys).sum()),
+    }
+    polys = pd.Series(polys, index=line_gdf.index)
+    if return_report:
+        return polys, report
+    return polys
+
+
+def merge_roads(road_gdf, keys: tuple = ('label', 'category'), precision: float = 1e-7, return_report: bool = False):
+    """
+    Consolidates a road network: drops duplicate ways and merges degree-2 chains.
+
+    Vertices are keyed by coordinates quantized to precision, so ways
+    sharing an OSM node share a key. Ways with the same keys values whose
+    vertices match forwards or reversed are duplicates, only the first is
+    kept. Ways meeting end to end at a node touched by no other way, with 
+    matching keys values, are joined into one polyline. Attributes come 
+    from the first way of every chain.
+
+    Args:
+        road_gdf (GeoDataFrame): Frame with LineString roads and 'osm_id'.
+        keys (tuple):            Columns that must match for ways to merge.
+        precision (float):       Coordinate quantization, in CRS units.
+        return_report (bool):    Also return duplicate and merge counts.
+    Returns:
+        GeoDataFrame: Consolidated roads with 'osm_ids', comma-separated ids
+                      of every way folded into each row.
+        dict: (if return_report) 'total', 'duplicates', 'merged', 'output' counts.
+    """
+    n = len(road_gdf)
+    geoms = np.asarray(road_gdf.geometry.values, dtype=object)
+    way_ids = road_gdf['osm_id'].astype(str).to_numpy(dtype=object)
+    keys = [k for k in keys if k in road_gdf.columns]
+    groups = road_gdf.groupby(keys, dropna=False, sort=False).ngroup().to_numpy() if keys else np.zeros(n, dtype=np.int64)
+
+    # Only plain LineStrings take part, anything else passes through
+    lines = np.flatnonzero((shapely.get_type_id(geoms) == 1) & (shapely.get_num_coordinates(geoms) >= 2))
+    coords, index = shapely.get_coordinates(geoms[lines], return_index=True)
+    counts = np.bincount(index, minlength=len(lines))
+    starts = np.cumsum(counts) - counts
+    ends = starts + counts - 1
+
+    # Node key per vertex from quantized coordinates
+    q = np.round(coords / precision).astype(np.int64)
+    order = np.lexsort((q[:, 1], q[:, 0]))
+    new_key = np.ones(len(q), dtype=bool)
+    new_key[1:] = np.any(q[order][1:] != q[order][:-1], axis=1)
+    node = np.empty(len(q), dtype=np.int64)
+    node[order] = np.cumsum(new_key) - 1
+    first, last = node[starts], node[ends]
+
+    # Duplicate candidates share group, end nodes, length and node sum, then are compared exactly
+    folded = {i: [way_ids[i]] for i in range(n)}
+    keep = np.ones(len(lines), dtype=bool)
+    cand = pd.DataFrame({'g': groups[lines], 'lo': np.minimum(first, last), 'hi': np.maximum(first, last),
+                         'n': counts, 's': np.add.reduceat(node, starts) if len(lines) else counts})
+    dup_rows = np.flatnonzero(cand.duplicated(keep=False).to_numpy())
+    seen = {}
+    for w in dup_rows:
+        seq = tuple(node[starts[w]:ends[w] + 1])
+        seq = min(seq, seq[::-1])
+        key = (groups[lines[w]], seq)
+        if key in seen:
+            keep[w] = False
+            folded[lines[seen[key]]] += folded.pop(lines[w])
+        else:
+            seen[key] = w
+
+    # Merge nodes: exactly two way ends of the same group, no other way touching
+    kept = np.flatnonzero(keep)
+    interior = np.repeat(keep, counts)
+    interior[starts] = False
+    interior[ends] = False
+    n_nodes = int(node.max()) + 1 if len(node) else 0
+    end_count = np.bincount(np.concatenate([first[kept], last[kept]]), minlength=n_nodes)
+    touches = end_count + np.bincount(node[interior], minlength=n_nodes)
+    end_nodes = np.concatenate([first[kept], last[kept]])
+    end_ways = np.concatenate([kept, kept])
+    by_node = np.argsort(end_nodes, kind='stable')
+    end_nodes, end_ways = end_nodes[by_node], end_ways[by_node]
+    pair = np.flatnonzero((end_nodes[:-1] == end_nodes[1:]) & (touches[end_nodes[:-1]] == 2))
+    (a, b) = (end_ways[pair], end_ways[pair + 1])
+    same = (a != b) & (groups[lines[a]] == groups[lines[b]])
+    merge_at = dict(zip(end_nodes[pair][same].tolist(), zip(a[same].tolist(), b[same].tolist())))
+
+    parent = {}
+
+    def find(w):
+        while parent.setdefault(w, w) != w:
+            parent[w] = parent[parent[w]]
+            w = parent[w]
+        return w
+
+    for (wa, wb) in merge_at.values():
+        parent[find(wa)] = find(wb)
+    components = {}
+    for w in parent:
+        components.setdefault(find(w), []).append(w)
+
+    # Walk every chain from an open end (or anywhere on a loop), orienting each way
+    out_geoms = dict(zip(lines[kept].tolist(), geoms[lines[kept]]))
+    merged = 0
+    for chain in components.values():
+        begin = next((w for w in chain if (first[w] not in merge_at) or (last[w] not in merge_at)), chain[0])
+        v = first[begin] if (first[begin] not in merge_at) or (last[begin] in merge_at) else last[begin]
+        (w, walked, parts) = (begin, set(), [])
+        while (w is not None) and (w not in walked):
+            walked.add(w)
+            forward = (first[w] == v)
+            seg = coords[starts[w]:ends[w] + 1]
+            parts.append((seg if forward else seg[::-1])[1 if parts else 0:])
+            v = last[w] if forward else first[w]
+            ab = merge_at.get(v)
+            w = None if ab is None else (ab[0] if ab[1] == w else ab[1])
+        head = lines[begin]
+        for other in walked - {begin}:
+            folded[head] += folded.pop(lines[other])
+            del out_geoms[lines[other]]
+        out_geoms[head] = shapely.linestrings(np.concatenate(parts))
+        merged += len(walked) - 1
 
+    # Untouched rows keep their geometry, output follows input row order
+    rows = np.array(sorted(set(range(n)) - set(lines.tolist()) | set(out_geoms)), dtype=np.int64)
+    out_gdf = road_gdf.iloc[rows].copy()
+    out_gdf['geometry'] = [out_geoms.get(r, geoms[r]) for r in rows]
+    out_gdf['osm_ids'] = [','.join(folded[r]) for r in rows]
+    out_gdf = out_gdf.reset_index(drop=True)
 
+    report = {
+        'total': n,
+        'duplicates': int((~keep).sum()),
+        'merged': merged,
+        'output': len(out_gdf),
+    }
+    if return_report:
+        return out_gdf, report
+    return out_gdf
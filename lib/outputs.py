@@ -0,0 +1,142 @@
+import os
+import json
+import threading
+import numpy as np
+import geopandas as gpd
+
+from lib.metrics import span
+from lib.spatialindex import SpatialIndex, INDEX_EXT
+
+"""
+outputs.py
+----------
+Output backends for pipeline layers.
+
+GeoParquet is the default, optionally sorted by label with one
+row group per label so single classes can be read without scanning
+the file. GeoPackage writes every layer into one multi-layer file.
+Shapefiles remain available for older tooling. Layers can be written
+with a packed spatial index over their rows as written.
+"""
+
+FORMATS = {'parquet': '.parquet', 'gpkg': '.gpkg', 'shp': '.shp'}
+
+
+class LayerWriter:
+    """
+    Writes named GeoDataFrame layers to a dataset folder.
+
+    Args:
+        out_dir (str):      Dataset folder.
+        fmt (str):          One of 'parquet', 'gpkg', 'shp'.
+        partition_by (str): Parquet only, column to sort on and split
+                            into one row group per value. Skipped for
+                            layers missing the column.
+        name (str):         File name of the GeoPackage (without extension).
+        index (bool):       Save a SpatialIndex next to every layer, its feature
+                            indices are row positions in the written layer.
+    """
+
+    def __init__(self, out_dir: str, fmt: str = 'parquet', partition_by: str = None, name: str = 'layers',
+                 index: bool = False):
+        if fmt not in FORMATS:
+            raise NotImplementedError(f"Unsupported output format '{fmt}'. Expected one of: {list(FORMATS.keys())}")
+        self.out_dir = out_dir
+        self.fmt = fmt
+        self.partition_by = partition_by
+        self.name = name
+        self.index = index
+        self.paths = {}
+        self.index_paths = {}
+        # Layers share one GeoPackage, writes from concurrent stages are serialized
+        self._lock = threading.Lock()
+
+    def path(self, layer: str) -> str:
+        """ Output path of a layer. """
+        if self.fmt == 'gpkg':
+            return os.path.join(self.out_dir, self.name + FORMATS['gpkg'])
+        return os.path.join(self.out_dir, layer + FORMATS[self.fmt])
+
+    def index_path(self, layer: str) -> str:
+        """ Spatial index path of a layer. """
+        return os.path.join(self.out_dir, layer + INDEX_EXT)
+
+    def write(self, layer: str, gdf: gpd.GeoDataFrame) -> str:
+        """ Writes layer, returns its path. """
+        fp = self.path(layer)
+        with span(f"write {layer}", rows_in=len(gdf), format=self.fmt) as s:
+            if self.fmt == 'parquet':
+                gdf = write_parquet(gdf, fp, partition_by=self.partition_by)
+            elif self.fmt == 'gpkg':
+                with self._lock:
+                    gdf.to_file(fp, layer=layer, driver='GPKG')
+            else:
+                gdf.to_file(fp)
+            s.add(bytes_out=os.path.getsize(fp))
+            self.paths[layer] = fp
+            if self.index:
+                self.index_paths[layer] = SpatialIndex.build(gdf.geometry).save(self.index_path(layer))
+        return fp
+
+
+def geo_metadata(gdf: gpd.GeoDataFrame) -> dict:
+    """ GeoParquet 1.0 'geo' file metadata of gdf's active geometry column, WKB encoded. """
+    geom_types = sorted(t for t in gdf.geom_type.dropna().unique())
+    column = {'encoding': 'WKB', 'geometry_types': geom_types}
+    if gdf.crs is not None:
+        column['crs'] = gdf.crs.to_json_dict()
+    bounds = gdf.total_bounds
+    if np.all(np.isfinite(bounds)):
+        column['bbox'] = bounds.tolist()
+    return {'version': '1.0.0', 'primary_column': gdf.geometry.name, 'columns': {gdf.geometry.name: column}}
+
+
+def write_parquet(gdf: gpd.GeoDataFrame, fp: str, partition_by: str = None) -> gpd.GeoDataFrame:
+    """
+    Writes GeoParquet file.
+
+    Args:
+        gdf (GeoDataFrame): Frame to write.
+        fp (str):           Output path.
+        partition_by (str): Optional column, rows are sorted on it and each
+                            distinct value is written as its own row group.
+    Returns:
+        GeoDataFrame: gdf in the row order written.
+    """
+    if (partition_by is None) or (partition_by not in gdf.columns) or (len(gdf) == 0):
+        gdf.to_parquet(fp, index=False)
+        return gdf
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    gdf = gdf.sort_values(partition_by, kind='stable', na_position='last')
+    table = pa.table(gdf.to_arrow(index=False, geometry_encoding='WKB'))
+    metadata = dict(table.schema.metadata or {})
+    metadata[b'geo'] = json.dumps(geo_metadata(gdf)).encode('utf-8')
+    table = table.replace_schema_metadata(metadata)
+    keys = gdf[partition_by].fillna('').astype(str).to_numpy()
+    bounds = np.concatenate([[0], np.flatnonzero(keys[1:] != keys[:-1]) + 1, [len(keys)]])
+    with pq.ParquetWriter(fp, table.schema) as writer:
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            writer.write_table(table.slice(start, stop - start), row_group_size=stop - start)
+    return gdf
+
+
+def read_layer(fp: str, layer: str = None, labels: list = None) -> gpd.GeoDataFrame:
+    """
+    Reads a layer written by LayerWriter.
+
+    Args:
+        fp (str):      Layer path.
+        layer (str):   Layer name inside a GeoPackage.
+        labels (list): Parquet only, keep rows with these 'label' values.
+                       Row groups of other labels are skipped when partitioned.
+    """
+    if fp.endswith(FORMATS['parquet']):
+        filters = [('label', 'in', labels)] if labels else None
+        return gpd.read_parquet(fp, filters=filters)
+    gdf = gpd.read_file(fp, layer=layer)
+    if labels:
+        gdf = gdf[gdf['label'].isin(labels)]
+    return gdf
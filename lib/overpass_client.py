@@ -0,0 +1,326 @@
+import os
+import re
+import json
+import threading
+import requests
+from time import monotonic
+from requests.adapters import HTTPAdapter
+from overpass.errors import MultipleRequestsError, OverpassSyntaxError, ServerLoadError, ServerRuntimeError, UnknownOverpassError
+from overpass.errors import TimeoutError as OverpassTimeout
+
+"""
+overpass_client.py
+------------------
+Shared HTTP client for Overpass interpreters.
+
+One requests.Session keeps pooled keep-alive connections to every
+endpoint. Each endpoint has a token bucket (requests per second with a
+burst) and a cap on queries in flight, matching the server's slots.
+Requests go to the endpoint that can take them soonest. A 429 reads
+the endpoint's /status page and cools it down until a slot frees.
+Timeouts, 5xx responses and connection errors move the query to the
+next endpoint. A slot stays taken until the response is closed, since
+the server keeps it busy while the body is sent. Optional shared
+semaphores cap queries in flight per endpoint across processes (batch
+workers).
+
+Errors are raised as overpass.errors types, so callers (ex. the tile
+splitting in osmtools.get_osm_tiled) handle them as before.
+"""
+
+DEFAULT_ENDPOINT = 'https://overpass-api.de/api/interpreter'
+# Public mirrors, opt in through endpoints or GEOSCRAPE_OVERPASS
+PUBLIC_MIRRORS = [
+    'https://overpass-api.de/api/interpreter',
+    'https://overpass.kumi.systems/api/interpreter',
+    'https://overpass.private.coffee/api/interpreter',
+]
+USER_AGENT = 'geo-scraping (python-requests)'
+
+_RATE_LIMIT = re.compile(r'Rate limit:\s*(\d+)')
+_AVAILABLE = re.compile(r'(\d+)\s+slots?\s+available\s+now')
+_WAIT = re.compile(r'Slot available after:.*?in\s+(-?\d+)\s+seconds?')
+
+_default_client = None
+
+
+def status_url(endpoint: str) -> str:
+    """ Status page of an interpreter endpoint, ex. .../api/interpreter -> .../api/status. """
+    return endpoint.rstrip('/').rsplit('/', 1)[0] + '/status'
+
+
+def parse_status(text: str) -> dict:
+    """
+    Parses an Overpass /status page.
+
+    Returns:
+        dict: 'rate_limit' (slots per client, 0 is unlimited, None if missing),
+              'available' (free slots now) and 'waits' (seconds until each
+              busy slot frees, ascending).
+    """
+    rate_limit = _RATE_LIMIT.search(text)
+    available = _AVAILABLE.search(text)
+    return {'rate_limit': int(rate_limit.group(1)) if rate_limit else None,
+            'available': int(available.group(1)) if available else 0,
+            'waits': sorted(max(0, int(w)) for w in _WAIT.findall(text))}
+
+
+class _Endpoint:
+    """ Scheduling state of one interpreter. """
+
+    def __init__(self, url: str, slots: int, burst: float):
+        self.url = url
+        self.status_url = status_url(url)
+        self.slots = slots
+        self.active = 0
+        self.tokens = burst
+        self.updated = monotonic()
+        self.cooldown_until = 0.0
+        self.failures = 0
+
+
+class OverpassClient:
+    """
+    Pooled, rate limited Overpass client over one or more endpoints.
+
+    Args:
+        endpoints (list):    Interpreter URLs (ex. mirrors or a local stand-in), tried
+                             in order of readiness. Default DEFAULT_ENDPOINT.
+        rate (float):        Requests per second allowed per endpoint.
+        burst (float):       Requests allowed at once before rate applies.
+        slots (int):         Queries in flight per endpoint, replaced by the server's
+                             rate limit once a /status page was read.
+        timeout (float):     Request timeout in seconds.
+        max_retries (int):   Rate limited (429) attempts before giving up.
+        backoff (float):     First cooldown (s) of a failing endpoint, doubled per failure.
+        max_backoff (float): Longest cooldown (s).
+        pool_size (int):     Keep-alive connections kept per endpoint.
+        user_agent (str):    User-Agent header.
+        shared_slots (dict): Optional endpoint URL -> semaphore held by every query in
+                             flight there, ex. multiprocessing.Manager().BoundedSemaphore(n)
+                             shared by batch worker processes querying the same servers.
+    """
+
+    def __init__(self, endpoints: list = None, rate: float = 1.0, burst: float = 2, slots: int = 2,
+                 timeout: float = 180, max_retries: int = 5, backoff: float = 2.0, max_backoff: float = 60.0,
+                 pool_size: int = 8, user_agent: str = USER_AGENT, shared_slots=None):
+        endpoints = list(endpoints or [DEFAULT_ENDPOINT])
+        self.rate = rate
+        self.burst = burst
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.shared_slots = shared_slots or {}
+        self.endpoints = [_Endpoint(url, slots, burst) for url in endpoints]
+        self.headers = {'Accept-Charset': 'utf-8;q=0.7,*;q=0.7', 'User-Agent': user_agent}
+        self._cond = threading.Condition()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(endpoints), pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __repr__(self):
+        return f"OverpassClient({[e.url for e in self.endpoints]}, rate={self.rate}, burst={self.burst})"
+
+    @property
+    def endpoint(self) -> str:
+        """ First endpoint, the primary server. """
+        return self.endpoints[0].url
+
+    """ Scheduling """
+    def _wait_time(self, ep: _Endpoint, now: float):
+        """ Seconds until ep can take a request, None while all its slots are busy. """
+        ep.tokens = min(self.burst, ep.tokens + (now - ep.updated) * self.rate)
+        ep.updated = now
+        if ep.cooldown_until > now:
+            return ep.cooldown_until - now
+        if ep.slots and (ep.active >= ep.slots):
+            return None
+        if ep.tokens < 1:
+            return (1 - ep.tokens) / self.rate
+        return 0.0
+
+    def _acquire(self, exclude: set = frozenset()) -> _Endpoint:
+        """ Blocks until an endpoint outside exclude has a token and a free slot, then takes both. """
+        with self._cond:
+            while True:
+                now = monotonic()
+                candidates = [e for e in self.endpoints if e.url not in exclude] or self.endpoints
+                waits = [(self._wait_time(e, now), e) for e in candidates]
+                ready = sorted((e for (w, e) in waits if w == 0), key=lambda e: (e.active, e.failures))
+                for ep in ready:
+                    if self._take_shared(ep):
+                        ep.tokens -= 1
+                        ep.active += 1
+                        return ep
+                timed = [w for (w, _) in waits if w is not None]
+                if ready:
+                    # Slots taken by other processes, poll as their release isn't notified here
+                    timed.append(0.05)
+                self._cond.wait(timeout=min(timed) if timed else None)
+
+    def _take_shared(self, ep: _Endpoint) -> bool:
+        shared = self.shared_slots.get(ep.url)
+        return (shared is None) or shared.acquire(False)
+
+    def _release(self, ep: _Endpoint) -> None:
+        if ep.url in self.shared_slots:
+            self.shared_slots[ep.url].release()
+        with self._cond:
+            ep.active -= 1
+            self._cond.notify_all()
+
+    def _hold(self, r: requests.Response, ep: _Endpoint) -> requests.Response:
+        """ Keeps ep's slot taken until r (or its raw stream) is closed. """
+        lock = threading.Lock()
+        held = [True]
+
+        def release():
+            with lock:
+                if not held[0]:
+                    return
+                held[0] = False
+            self._release(ep)
+
+        def closing(close):
+            def wrapped(*args, **kwargs):
+                try:
+                    return close(*args, **kwargs)
+                finally:
+                    release()
+            return wrapped
+
+        r.close = closing(r.close)
+        r.raw.close = closing(r.raw.close)
+        return r
+
+    def _cool(self, ep: _Endpoint, seconds: float) -> None:
+        with self._cond:
+            ep.cooldown_until = max(ep.cooldown_until, monotonic() + seconds)
+            self._cond.notify_all()
+
+    def _fail(self, ep: _Endpoint) -> None:
+        """ Cools ep down with exponential backoff. """
+        with self._cond:
+            ep.failures += 1
+            self._cool(ep, min(self.max_backoff, self.backoff * 2 ** (ep.failures - 1)))
+
+    def status(self, endpoint: str = None) -> dict:
+        """ Reads and parses the /status page of an endpoint (default the first). """
+        url = status_url(endpoint) if endpoint else self.endpoints[0].status_url
+        r = self.session.get(url, headers=self.headers, timeout=min(self.timeout, 30))
+        r.raise_for_status()
+        return parse_status(r.text)
+
+    def _rate_limited(self, ep: _Endpoint) -> None:
+        """ Handles a 429: cools ep down until the server reports a free slot. """
+        try:
+            status = self.status(ep.url)
+        except requests.RequestException:
+            self._fail(ep)
+            return
+        if status['rate_limit'] is not None:
+            with self._cond:
+                ep.slots = status['rate_limit']
+        if status['available'] > 0:
+            self._cool(ep, 1.0 / self.rate)
+        elif status['waits']:
+            self._cool(ep, status['waits'][0] + 1)
+        else:
+            self._fail(ep)
+
+    """ Requests """
+    def post(self, query: str, stream: bool = False) -> requests.Response:
+        """
+        Sends a full Overpass QL query to the first endpoint that can take it.
+
+        The endpoint's slot stays taken until the caller closes the response
+        (or its raw stream), so a response must always be closed.
+
+        Args:
+            query (str):   Complete query, including the [out:...] setting.
+            stream (bool): Leave the body unread, for streaming.
+        Returns:
+            requests.Response: Successful (200) response.
+        Raises:
+            OverpassSyntaxError:   On 400, not retried.
+            MultipleRequestsError: Still rate limited (429) after max_retries.
+            ServerLoadError:       Every endpoint answered 5xx.
+            OverpassTimeout:       Every endpoint timed out or was unreachable.
+            UnknownOverpassError:  Other status codes.
+        """
+        (tried, limited) = (set(), 0)
+        while True:
+            ep = self._acquire(exclude=tried)
+            try:
+                r = self.session.post(ep.url, data={'data': query}, headers=self.headers,
+                                      timeout=self.timeout, stream=stream)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                self._release(ep)
+                self._fail(ep)
+                tried.add(ep.url)
+                if len(tried) >= len(self.endpoints):
+                    raise OverpassTimeout(self.timeout) from e
+                continue
+
+            if r.status_code == 200:
+                ep.failures = 0
+                return self._hold(r, ep)
+            r.close()
+            self._release(ep)
+            if r.status_code == 400:
+                raise OverpassSyntaxError(query)
+            elif r.status_code == 429:
+                limited += 1
+                if limited > self.max_retries:
+                    raise MultipleRequestsError()
+                self._rate_limited(ep)
+            elif r.status_code >= 500:
+                # 502/503/504, overloaded or restarting server
+                self._fail(ep)
+                tried.add(ep.url)
+                if len(tried) >= len(self.endpoints):
+                    raise ServerLoadError(self.timeout)
+            else:
+                raise UnknownOverpassError(f"The request returned status code {r.status_code}")
+
+    def get_json(self, query: str, verbosity: str = "body") -> dict:
+        """
+        Runs an Overpass QL body like overpass.API.get(query, responseformat="json").
+
+        Raises:
+            ServerRuntimeError:   If the response carries a runtime error remark.
+            UnknownOverpassError: If the response has no elements.
+        """
+        with self.post(f"[out:json];{query}out {verbosity};") as r:
+            response = json.loads(r.text)
+        if 'elements' not in response:
+            raise UnknownOverpassError("Received an invalid answer from Overpass.")
+        remark = response.get('remark')
+        if remark and remark.startswith('runtime error'):
+            raise ServerRuntimeError(remark)
+        return response
+
+    def close(self) -> None:
+        self.session.close()
+
+
+def get_client() -> OverpassClient:
+    """
+    Returns the shared client, created on first use.
+    Endpoints can be set with GEOSCRAPE_OVERPASS, a comma separated list of interpreter URLs.
+    """
+    global _default_client
+    if _default_client is None:
+        endpoints = [e.strip() for e in os.environ.get('GEOSCRAPE_OVERPASS', '').split(',') if e.strip()]
+        _default_client = OverpassClient(endpoints or None)
+    return _default_client
+
+
+def set_client(client: OverpassClient) -> OverpassClient:
+    """ Replaces the shared client, returns the previous one. """
+    global _default_client
+    previous, _default_client = _default_client, client
+    return previous
@@ -0,0 +1,112 @@
+import os
+import tempfile
+
+from lib.osmstream import WayColumns
+
+"""
+pbf.py
+------
+Offline way ingestion from local OpenStreetMap extracts (.osm.pbf).
+
+Requires pyosmium (`pip install osmium`), imported on first use.
+Node locations are kept in an on-disk osmium index instead of memory,
+ways with at least one node inside the bounds are kept with their full
+geometry (like an Overpass `way(bbox);(._;>;);` query) and parsed into
+the same columns as osmtools.geojson_to_gdf.
+"""
+
+# 'sparse_file_array' suits regional extracts, 'dense_file_array' country or planet files
+DEFAULT_INDEX = 'sparse_file_array'
+
+
+def _way_handler(bounds: dict, columns: WayColumns, keys: set = None):
+    import osmium
+
+    (west, south, east, north) = (bounds['west'], bounds['south'], bounds['east'], bounds['north'])
+
+    class WayHandler(osmium.SimpleHandler):
+        def __init__(self):
+            super().__init__()
+            self.missing = 0
+
+        def way(self, w):
+            if keys and not any(k in w.tags for k in keys):
+                return
+            coords = []
+            inside = False
+            for n in w.nodes:
+                loc = n.location
+                if not loc.valid():
+                    # Node outside the extract
+                    self.missing += 1
+                    continue
+                (lon, lat) = (loc.lon, loc.lat)
+                coords.append((lon, lat))
+                inside = inside or ((west <= lon <= east) and (south <= lat <= north))
+            if inside and (len(coords) >= 2):
+                columns.add(w.id, coords, {t.k: t.v for t in w.tags})
+
+    return WayHandler()
+
+
+def _apply_ways(handler, pbf_fp: str, idx: str) -> None:
+    """ Runs handler over the ways of pbf_fp only, locations come from an existing index. """
+    import osmium
+
+    locations = osmium.NodeLocationsForWays(osmium.index.create_map(idx))
+    locations.ignore_errors()
+    osmium.apply(osmium.io.Reader(pbf_fp, osmium.osm.WAY), locations, handler)
+
+
+def read_pbf_ways(pbf_fp: str, bounds: dict, keys: list = None, index: str = DEFAULT_INDEX,
+                  index_fp: str = None, verbose: bool = False, wide: bool = True):
+    """
+    Reads ways touching bounds from a local .osm.pbf extract.
+
+    Args:
+        pbf_fp (str):   OSM extract (.osm.pbf, .osm, .osm.bz2).
+        bounds (dict):  'west', 'south', 'east', 'north' in EPSG:4326.
+        keys (list):    Optional tag keys, only ways with one of them are kept
+                        (ex. ['building', 'highway']).
+        index (str):    osmium file-backed location index type.
+        index_fp (str): Index file, a temporary file removed afterwards when None.
+                        A given file is kept and reused by later reads of the same
+                        extract (only the way pass runs), rebuilt if the extract is newer.
+        verbose (bool): Print summary.
+        wide (bool):    One column per tag key, else tags are returned as a TagStore.
+    Returns:
+        GeoDataFrame: Same layout as osmtools.geojson_to_gdf, or (ways, TagStore)
+                      when wide is False.
+    """
+    if not os.path.exists(pbf_fp):
+        raise FileNotFoundError(f"OSM extract not found: '{pbf_fp}'")
+    columns = WayColumns()
+    handler = _way_handler(bounds, columns, set(keys) if keys else None)
+    if (index_fp is not None) and os.path.exists(index_fp) and (os.path.getmtime(index_fp) >= os.path.getmtime(pbf_fp)):
+        _apply_ways(handler, pbf_fp, f"{index},{index_fp}")
+    elif index_fp is not None:
+        # Built under a unique temporary name, so an interrupted build is never reused
+        # and concurrent readers (ex. batch workers) never write the same file
+        (fd, build_fp) = tempfile.mkstemp(suffix='.nodes.tmp', dir=os.path.dirname(os.path.abspath(index_fp)))
+        os.close(fd)
+        try:
+            handler.apply_file(pbf_fp, locations=True, idx=f"{index},{build_fp}")
+            os.replace(build_fp, index_fp)
+        finally:
+            if os.path.exists(build_fp):
+                os.remove(build_fp)
+    else:
+        (fd, tmp_fp) = tempfile.mkstemp(suffix='.nodes')
+        os.close(fd)
+        try:
+            handler.apply_file(pbf_fp, locations=True, idx=f"{index},{tmp_fp}")
+        finally:
+            os.remove(tmp_fp)
+
+    if verbose:
+        print(f"> Read {len(columns)} ways from '{pbf_fp}' ({handler.missing} node refs outside the extract)")
+    if not wide:
+        return columns.to_ways()
+    gdf = columns.to_gdf()
+    gdf.reset_index(inplace=True)
+    return gdf
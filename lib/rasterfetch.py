@@ -0,0 +1,183 @@
+import os
+import math
+import tempfile
+import requests
+import numpy as np
+import rasterio as rio
+from rasterio.io import MemoryFile
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window
+from rasterio.windows import transform as window_transform
+from affine import Affine
+from time import sleep
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from lib.metrics import add
+
+"""
+rasterfetch.py
+--------------
+Tiled raster download engine.
+
+An output grid is laid over a lat/lon region, split into pixel tiles
+small enough for a single request, fetched concurrently through a
+pluggable fetch function and stitched into one tiled GeoTIFF with
+windowed writes. Fetch functions only see a tile window, its affine
+transform and the CRS, so they can be mocked for offline runs.
+Failed tiles are retried with exponential backoff (quota errors clear
+after a while), the GeoTIFF is written under a temporary name and only
+moved to its path once every tile arrived.
+"""
+
+# Earth Engine getDownloadURL request limit (uncompressed bytes)
+MAX_REQUEST_BYTES = 48 * 1024 * 1024
+
+
+def utm_crs(bounds: dict) -> str:
+    """ WGS 84 / UTM zone CRS containing the center of lat/lon bounds. """
+    lon = (bounds['west'] + bounds['east']) / 2
+    lat = (bounds['south'] + bounds['north']) / 2
+    zone = int((lon + 180) // 6) % 60 + 1
+    return f"EPSG:{(32600 if lat >= 0 else 32700) + zone}"
+
+
+def raster_grid(bounds: dict, scale: float, crs: str) -> tuple:
+    """
+    Creates a pixel grid covering lat/lon bounds, snapped to multiples of scale.
+
+    Args:
+        bounds (dict): 'west', 'south', 'east', 'north' in EPSG:4326.
+        scale (float): Pixel size in CRS units.
+        crs (str):     Output CRS.
+    Returns:
+        tuple: (Affine transform, width, height)
+    """
+    (min_x, min_y, max_x, max_y) = transform_bounds('EPSG:4326', crs, bounds['west'], bounds['south'],
+                                                    bounds['east'], bounds['north'])
+    x0 = math.floor(min_x / scale) * scale
+    y0 = math.ceil(max_y / scale) * scale
+    width = int(math.ceil((max_x - x0) / scale))
+    height = int(math.ceil((y0 - min_y) / scale))
+    return Affine(scale, 0.0, x0, 0.0, -scale, y0), width, height
+
+
+def max_tile_size(count: int, dtype: str, max_bytes: int = MAX_REQUEST_BYTES, multiple: int = 256) -> int:
+    """ Largest square tile edge (pixels) whose uncompressed size fits max_bytes. """
+    pixel_bytes = count * np.dtype(dtype).itemsize
+    edge = int(math.sqrt(max_bytes / pixel_bytes))
+    return max(multiple, (edge // multiple) * multiple)
+
+
+def plan_tiles(width: int, height: int, tile_size: int) -> list:
+    """ Splits a width x height grid into row-major Windows of at most tile_size pixels per side. """
+    return [Window(col, row, min(tile_size, width - col), min(tile_size, height - row))
+            for row in range(0, height, tile_size)
+            for col in range(0, width, tile_size)]
+
+
+def _as_array(data) -> np.ndarray:
+    """ Tile data as (bands, rows, cols) array, accepts GeoTIFF bytes or arrays. """
+    if isinstance(data, (bytes, bytearray)):
+        with MemoryFile(data) as mem, mem.open() as src:
+            return src.read()
+    data = np.asarray(data)
+    return data[np.newaxis] if data.ndim == 2 else data
+
+
+def _fetch(fetch, window, transform, crs, retries, backoff, max_backoff):
+    for attempt in range(retries + 1):
+        try:
+            return window, _as_array(fetch(window, window_transform(window, transform), crs))
+        except Exception:
+            if attempt == retries:
+                raise
+            sleep(min(max_backoff, backoff * 2 ** attempt))
+
+
+def fetch_raster(fetch, bounds: dict, scale: float, out_path: str, crs: str = None,
+                 tile_size: int = 2048, workers: int = 8, retries: int = 2, backoff: float = 2.0,
+                 max_backoff: float = 60.0, nodata=None, block_size: int = 512, verbose: bool = False) -> str:
+    """
+    Downloads a region tile by tile and stitches the result into a tiled GeoTIFF.
+
+    Args:
+        fetch:            Callable (window, transform, crs) -> GeoTIFF bytes or array
+                          (bands, rows, cols) for exactly that window.
+        bounds (dict):    Lat/lon bounds, 'west', 'south', 'east', 'north'.
+        scale (float):    Pixel size in CRS units.
+        out_path (str):   Output GeoTIFF.
+        crs (str):        Output CRS, defaults to the UTM zone of the region so 
+                          scale is in meters.
+        tile_size (int):  Request tile edge in pixels, see max_tile_size.
+        workers (int):    Concurrent fetches.
+        retries (int):    Extra attempts per tile before failing.
+        backoff (float):  Seconds before the first retry of a tile, doubled per attempt.
+        max_backoff (float): Longest wait between attempts.
+        nodata:           Nodata value written to the output profile.
+        block_size (int): Internal GeoTIFF tile size, must be a multiple of 16.
+        verbose (bool):   Print progress.
+    Returns:
+        str: out_path, only written once every tile succeeded.
+    """
+    crs = crs or utm_crs(bounds)
+    transform, width, height = raster_grid(bounds, scale, crs=crs)
+    windows = plan_tiles(width, height, tile_size)
+    if verbose:
+        print(f"> Fetching {width}x{height} px as {len(windows)} tiles")
+
+    # Partial rasters never appear at out_path, later stages would take them as finished
+    (fd, part_path) = tempfile.mkstemp(suffix='.tif.part', dir=os.path.dirname(os.path.abspath(out_path)))
+    os.close(fd)
+    dst = None
+    pending = list(windows)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # Bound tiles held in memory to twice the worker count
+            running = set()
+            while pending or running:
+                while pending and (len(running) < 2 * workers):
+                    running.add(pool.submit(_fetch, fetch, pending.pop(0), transform, crs, retries,
+                                            backoff, max_backoff))
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    window, data = future.result()
+                    if dst is None:
+                        dst = rio.open(part_path, 'w', driver='GTiff', width=width, height=height,
+                                       count=data.shape[0], dtype=data.dtype, crs=crs, transform=transform,
+                                       nodata=nodata, tiled=True, blockxsize=block_size, blockysize=block_size,
+                                       compress='deflate', BIGTIFF='IF_SAFER')
+                    dst.write(data[:, :int(window.height), :int(window.width)], window=window)
+                    if verbose:
+                        print(f"> Wrote tile at ({window.col_off}, {window.row_off})")
+        if dst is not None:
+            dst.close()
+        os.replace(part_path, out_path)
+    finally:
+        if (dst is not None) and not dst.closed:
+            dst.close()
+        if os.path.exists(part_path):
+            os.remove(part_path)
+    add(tiles=len(windows), bytes_out=os.path.getsize(out_path))
+    return out_path
+
+
+def ee_tile_fetcher(image, timeout: float = 300):
+    """
+    Creates a fetch function downloading tiles of an ee.Image through getDownloadURL.
+
+    Args:
+        image (ee.Image): Image to download.
+        timeout (float):  Seconds per tile request.
+    """
+    def fetch(window, transform, crs):
+        url = image.getDownloadURL({
+            'crs': crs,
+            'crs_transform': [transform.a, transform.b, transform.c, transform.d, transform.e, transform.f],
+            'dimensions': f"{int(window.width)}x{int(window.height)}",
+            'format': 'GEO_TIFF',
+        })
+        r = requests.get(url, timeout=timeout)
+        r.raise_for_status()
+        return r.content
+
+    return fetch
@@ -0,0 +1,165 @@
+import math
+import numpy as np
+import shapely
+from rasterio.warp import transform as warp_transform
+from rasterio.windows import bounds as window_bounds
+
+"""
+spatialindex.py
+---------------
+Persistent packed R-tree over label layers.
+
+Features are ordered with Sort-Tile-Recursive packing and grouped into
+fixed-capacity nodes, so the whole tree is a handful of bounds arrays.
+Trees are saved as .npz next to their layer and loaded without being
+rebuilt. Queries take many boxes at once and walk the tree level by
+level with array operations, returning (query, feature) index pairs.
+"""
+
+INDEX_EXT = '.sindex.npz'
+
+
+class SpatialIndex:
+    """
+    Packed R-tree over feature bounds.
+
+    Args:
+        levels (list):  Node bounds arrays (n, 4) from the root level down to
+                        the leaf level, leaves hold one feature each.
+        order (array):  Feature index of every leaf.
+        capacity (int): Children per node.
+        crs (str):      CRS of the indexed bounds.
+    """
+
+    def __init__(self, levels: list, order: np.ndarray, capacity: int, crs: str = None):
+        self.levels = levels
+        self.order = order
+        self.capacity = capacity
+        self.crs = crs
+
+    def __len__(self):
+        return len(self.order)
+
+    def __repr__(self):
+        return f"SpatialIndex({len(self)} features, {len(self.levels)} levels, crs={self.crs})"
+
+    @classmethod
+    def build(cls, geometry, capacity: int = 16, crs: str = None):
+        """
+        Packs a tree over geometries.
+
+        Args:
+            geometry:       GeoSeries or array of shapely geometries, indices
+                            returned by queries are positions in it.
+            capacity (int): Children per node.
+            crs (str):      Bounds CRS, taken from a GeoSeries when not given.
+        """
+        if (crs is None) and (getattr(geometry, 'crs', None) is not None):
+            crs = geometry.crs.to_string()
+        bounds = shapely.bounds(np.asarray(geometry, dtype=object))
+        n = len(bounds)
+
+        # Sort-Tile-Recursive: vertical slices by x center, then y within slices
+        n_slices = max(1, math.ceil(math.sqrt(math.ceil(n / capacity))))
+        slice_len = n_slices * capacity
+        cx = (bounds[:, 0] + bounds[:, 2]) / 2
+        cy = (bounds[:, 1] + bounds[:, 3]) / 2
+        by_x = np.argsort(cx, kind='stable')
+        order = by_x[np.lexsort((cy[by_x], np.arange(n) // slice_len))]
+
+        # Empty geometries have NaN bounds, fmin/fmax leave them out of their nodes
+        levels = [bounds[order]]
+        while len(levels[0]) > capacity:
+            child = levels[0]
+            starts = np.arange(0, len(child), capacity)
+            levels.insert(0, np.column_stack([np.fmin.reduceat(child[:, 0], starts),
+                                              np.fmin.reduceat(child[:, 1], starts),
+                                              np.fmax.reduceat(child[:, 2], starts),
+                                              np.fmax.reduceat(child[:, 3], starts)]))
+        return cls(levels, order, capacity, crs)
+
+    def query(self, boxes, geometry=None) -> tuple:
+        """
+        Finds features intersecting many boxes at once.
+
+        Args:
+            boxes (array):  (n, 4) minx, miny, maxx, maxy in the index CRS.
+            geometry:       Optional indexed geometries, refines bounding box
+                            hits to exact intersections.
+        Returns:
+            tuple: (query_idx, feature_idx) arrays, sorted by query then feature.
+        """
+        boxes = np.asarray(boxes, dtype='float64').reshape(-1, 4)
+        empty = (np.empty(0, dtype='int64'), np.empty(0, dtype='int64'))
+        if (len(boxes) == 0) or (len(self) == 0):
+            return empty
+
+        n_top = len(self.levels[0])
+        q = np.repeat(np.arange(len(boxes)), n_top)
+        node = np.tile(np.arange(n_top), len(boxes))
+        for depth, level in enumerate(self.levels):
+            b = level[node]
+            qb = boxes[q]
+            hit = (b[:, 0] <= qb[:, 2]) & (b[:, 2] >= qb[:, 0]) & (b[:, 1] <= qb[:, 3]) & (b[:, 3] >= qb[:, 1])
+            (q, node) = (q[hit], node[hit])
+            if depth == len(self.levels) - 1:
+                break
+            # Expand every hit node into its contiguous children
+            first = node * self.capacity
+            count = np.minimum(self.capacity, len(self.levels[depth + 1]) - first)
+            q = np.repeat(q, count)
+            node = np.repeat(first - np.cumsum(count) + count, count) + np.arange(count.sum())
+
+        feature = self.order[node]
+        if geometry is not None:
+            exact = shapely.intersects(np.asarray(geometry, dtype=object)[feature], shapely.box(*boxes[q].T))
+            (q, feature) = (q[exact], feature[exact])
+        order = np.lexsort((feature, q))
+        return q[order], feature[order]
+
+    def query_windows(self, windows: list, transform, crs: str, geometry=None) -> tuple:
+        """
+        Finds features intersecting raster windows, e.g. chips.
+
+        Args:
+            windows (list): rasterio Windows.
+            transform:      Affine transform of the raster.
+            crs (str):      Raster CRS, window corners are reprojected to the index CRS.
+            geometry:       Optional indexed geometries for exact refinement.
+        Returns:
+            tuple: (window_idx, feature_idx) arrays.
+        """
+        boxes = np.array([window_bounds(w, transform) for w in windows], dtype='float64').reshape(-1, 4)
+        if self.crs and crs and (str(crs) != self.crs):
+            xs = boxes[:, [0, 2, 2, 0]].ravel()
+            ys = boxes[:, [1, 1, 3, 3]].ravel()
+            (xs, ys) = warp_transform(crs, self.crs, xs, ys)
+            (xs, ys) = (np.reshape(xs, (-1, 4)), np.reshape(ys, (-1, 4)))
+            boxes = np.column_stack([xs.min(1), ys.min(1), xs.max(1), ys.max(1)])
+        return self.query(boxes, geometry=geometry)
+
+    def save(self, fp: str) -> str:
+        """ Saves tree arrays as .npz, returns the path written (fp with '.npz' appended if missing). """
+        if not fp.endswith('.npz'):
+            fp += '.npz'
+        np.savez(fp,
+                 bounds=np.concatenate(self.levels),
+                 level_sizes=np.array([len(level) for level in self.levels], dtype='int64'),
+                 order=self.order,
+                 capacity=np.int64(self.capacity),
+                 crs=np.str_(self.crs or ''))
+        return fp
+
+    @classmethod
+    def load(cls, fp: str):
+        """ Loads a tree saved with save(). """
+        with np.load(fp) as data:
+            splits = np.cumsum(data['level_sizes'])[:-1]
+            levels = np.split(data['bounds'], splits)
+            return cls(levels, data['order'], int(data['capacity']), str(data['crs']) or None)
+
+
+def group_pairs(query_idx: np.ndarray, feature_idx: np.ndarray, n_queries: int) -> list:
+    """ Splits sorted query results into one feature index array per query. """
+    starts = np.searchsorted(query_idx, np.arange(n_queries + 1))
+    return [feature_idx[starts[i]:starts[i + 1]] for i in range(n_queries)]
@@ -0,0 +1,139 @@
+import traceback
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from lib.metrics import span, wrap
+
+"""
+stages.py
+---------
+Small dependency-graph scheduler for pipeline stages.
+
+Each stage runs once all of its dependencies have finished, independent
+stages run concurrently on a thread pool. Stages are expected to be
+I/O bound (network, disk) or to release the GIL (numpy, shapely, GDAL).
+Every stage runs inside a metrics span named after it, nested under the
+span open where run_stages was called.
+"""
+
+
+class Stage:
+    """
+    Pipeline stage.
+
+    Args:
+        name (str):  Unique stage name, used in reports.
+        func:        Callable, receives the results of deps as positional
+                     arguments in the order they are listed.
+        deps (list): Names of stages that must finish first.
+    """
+
+    def __init__(self, name: str, func, deps: list = ()):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+
+    def __repr__(self):
+        return f"Stage('{self.name}', deps={self.deps})"
+
+
+class StageResult:
+    """ Outcome of a stage: status is one of 'done', 'failed' or 'skipped'. """
+
+    def __init__(self, name: str, status: str, result=None, error: BaseException = None,
+                 start: float = None, end: float = None):
+        self.name = name
+        self.status = status
+        self.result = result
+        self.error = error
+        self.start = start
+        self.end = end
+
+    @property
+    def elapsed(self) -> float:
+        if (self.start is None) or (self.end is None):
+            return 0.0
+        return self.end - self.start
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 'done'
+
+    def __repr__(self):
+        return f"StageResult('{self.name}', {self.status}, {self.elapsed:.3f}s)"
+
+
+def _timed(stage: Stage, args: list) -> StageResult:
+    start = perf_counter()
+    try:
+        with span(stage.name, kind='stage'):
+            result = stage.func(*args)
+    except Exception as e:
+        return StageResult(stage.name, 'failed', error=e, start=start, end=perf_counter())
+    return StageResult(stage.name, 'done', result=result, start=start, end=perf_counter())
+
+
+def run_stages(stages: list, max_workers: int = 4, verbose: bool = False) -> dict:
+    """
+    Runs stages as soon as their dependencies are met.
+
+    A failed stage does not stop independent branches, its dependents are
+    marked 'skipped'.
+
+    Args:
+        stages (list):     Stage objects, in any order.
+        max_workers (int): Number of stages allowed to run at once.
+        verbose (bool):    Print stage starts, completions and failures.
+    Returns:
+        dict: StageResult keyed by stage name, in the order stages were passed.
+    Raises:
+        ValueError: On duplicate names, unknown dependencies or cycles.
+    """
+    by_name = {s.name: s for s in stages}
+    if len(by_name) != len(stages):
+        raise ValueError("Stage names must be unique.")
+    for s in stages:
+        missing = [d for d in s.deps if d not in by_name]
+        if missing:
+            raise ValueError(f"Stage '{s.name}' depends on unknown stages: {missing}")
+
+    results = {}
+    pending = list(stages)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        running = {}
+        while pending or running:
+            scheduled = True
+            while scheduled:
+                scheduled = False
+                for s in list(pending):
+                    dep_results = [results.get(d) for d in s.deps]
+                    if any(r is None for r in dep_results):
+                        continue
+                    pending.remove(s)
+                    scheduled = True
+                    if not all(r.ok for r in dep_results):
+                        results[s.name] = StageResult(s.name, 'skipped')
+                        if verbose:
+                            print(f"> Skipped stage '{s.name}', a dependency did not complete.")
+                        continue
+                    if verbose:
+                        print(f"> Started stage '{s.name}'")
+                    running[pool.submit(wrap(_timed), s, [r.result for r in dep_results])] = s
+
+            if not running:
+                if pending:
+                    raise ValueError(f"Stage dependencies contain a cycle: {pending}")
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                s = running.pop(future)
+                result = future.result()
+                results[s.name] = result
+                if verbose and result.ok:
+                    print(f"> Finished stage '{s.name}' ({result.elapsed:.3f}s)")
+                elif not result.ok:
+                    print(f"> Stage '{s.name}' failed:")
+                    traceback.print_exception(type(result.error), result.error, result.error.__traceback__)
+
+    return {s.name: results[s.name] for s in stages}
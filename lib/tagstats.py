@@ -0,0 +1,166 @@
+import numpy as np
+import pandas as pd
+
+from lib.tagstore import TagStore
+
+"""
+tagstats.py
+-----------
+Tag co-occurrence and label-depth statistics for designing label hierarchies.
+
+Key presence is built once as a sparse boolean (rows x keys) matrix P,
+straight from the TagStore CSR arrays. Pairwise co-occurrence is P.T @ P
+and per-label fill rates are L.T @ P with L the (rows x labels) one-hot
+of a top-level key, so no statistic loops over rows or key pairs.
+
+Requires scipy (scipy.sparse), imported on first use. Every function
+takes a TagStore or a wide GeoDataFrame (one column per tag key).
+"""
+
+# Wide frame columns that are not tags
+NON_TAG_COLUMNS = ('index', 'osm_id', 'geometry')
+
+
+def as_tag_store(source) -> TagStore:
+    """ Returns source as a TagStore, wide frames are encoded without their non-tag columns. """
+    if isinstance(source, TagStore):
+        return source
+    return TagStore.from_frame(source, [k for k in source.columns if k not in NON_TAG_COLUMNS])
+
+
+def presence_matrix(source, keys: list = None) -> tuple:
+    """
+    Builds the sparse key presence matrix.
+
+    Args:
+        source:      TagStore or wide GeoDataFrame.
+        keys (list): Keys to keep as columns, default every present key.
+    Returns:
+        tuple: (scipy.sparse.csr_matrix bool of shape (rows, keys), key list)
+    """
+    from scipy import sparse
+
+    tags = as_tag_store(source)
+    matrix = sparse.csr_matrix((np.ones(len(tags.key_ids), dtype=bool), tags.key_ids, tags.indptr),
+                               shape=(len(tags), len(tags.keys)))
+    keys = tags.present_keys() if keys is None else [k for k in keys if k in tags]
+    key_index = {k: i for i, k in enumerate(tags.keys)}
+    return matrix[:, [key_index[k] for k in keys]], keys
+
+
+def key_counts(source, keys: list = None) -> pd.Series:
+    """ Rows tagged with each key, most common first. """
+    matrix, keys = presence_matrix(source, keys)
+    counts = np.asarray(matrix.sum(axis=0)).ravel()
+    return pd.Series(counts, index=keys, name='count').sort_values(ascending=False, kind='stable')
+
+
+def cooccurrence(source, keys: list = None) -> pd.DataFrame:
+    """
+    Rows tagged with both keys, for every key pair.
+
+    Args:
+        source:      TagStore or wide GeoDataFrame.
+        keys (list): Keys to compare, default every present key.
+    Returns:
+        pd.DataFrame: Symmetric (keys x keys) counts, the diagonal holds key counts.
+    """
+    matrix, keys = presence_matrix(source, keys)
+    matrix = matrix.astype(np.int64)
+    counts = (matrix.T @ matrix).toarray()
+    return pd.DataFrame(counts, index=keys, columns=keys)
+
+
+def cooccurrence_pairs(source, keys: list = None, min_count: int = 1) -> pd.DataFrame:
+    """ Long form of cooccurrence: one row per key pair (key_a before key_b), most common first. """
+    counts = cooccurrence(source, keys)
+    (a, b) = np.triu_indices(len(counts), k=1)
+    values = counts.to_numpy()[a, b]
+    keep = values >= min_count
+    pairs = pd.DataFrame({'key_a': counts.index[a[keep]], 'key_b': counts.index[b[keep]], 'count': values[keep]})
+    return pairs.sort_values('count', ascending=False, kind='stable', ignore_index=True)
+
+
+def label_fill(source, main_key: str, keys: list = None) -> pd.DataFrame:
+    """
+    Fill rate of every key within each top-level label.
+
+    Args:
+        source:         TagStore or wide GeoDataFrame.
+        main_key (str): Key holding the top-level labels, ex. 'building'.
+        keys (list):    Keys to report, default every present key.
+    Returns:
+        pd.DataFrame: (labels x keys) share of the label's rows tagged with the key,
+                      with a 'total' column of rows per label.
+    """
+    from scipy import sparse
+
+    tags = as_tag_store(source)
+    labels = tags.column(main_key)
+    rows = np.flatnonzero(pd.notnull(labels))
+    codes, uniques = pd.factorize(labels[rows])
+    onehot = sparse.csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, codes)),
+                               shape=(len(tags), len(uniques)))
+    matrix, keys = presence_matrix(tags, keys)
+    filled = (onehot.T @ matrix.astype(np.int64)).toarray()
+    totals = np.bincount(codes, minlength=len(uniques))
+
+    fill = pd.DataFrame(filled / np.maximum(totals, 1)[:, None], index=pd.Index(uniques, name=main_key), columns=keys)
+    fill.insert(0, 'total', totals)
+    return fill.sort_values('total', ascending=False, kind='stable')
+
+
+def subkey_fill(source, main_key: str, sort: bool = True) -> pd.DataFrame:
+    """
+    Label depth: for every label of main_key that is also a key (ex. building=house
+    and 'house'), how many of its rows carry the second-level key.
+
+    Args:
+        source:         TagStore or wide GeoDataFrame.
+        main_key (str): Key holding the top-level labels.
+        sort (bool):    Most common label first, else labels in first-seen row order.
+    Returns:
+        pd.DataFrame: 'label', 'total', 'filled' and 'fill_rate'.
+    """
+    tags = as_tag_store(source)
+    labels = tags.column(main_key)
+    rows = np.flatnonzero(pd.notnull(labels))
+    codes, uniques = pd.factorize(labels[rows])
+    subkeys = [label for label in uniques if label in tags]
+
+    # Pairs whose key is the row's own label
+    entry_rows = tags.entry_rows
+    row_code = np.full(len(tags), -1, dtype=np.int64)
+    row_code[rows] = codes
+    key_index = {k: i for i, k in enumerate(tags.keys)}
+    label_key = np.array([key_index.get(u, -1) for u in uniques], dtype=np.int64)
+    entry_code = row_code[entry_rows]
+    own = (entry_code >= 0) & (label_key[np.maximum(entry_code, 0)] == tags.key_ids)
+
+    totals = np.bincount(codes, minlength=len(uniques))
+    filled = np.bincount(entry_code[own], minlength=len(uniques))
+    depth = pd.DataFrame({'label': uniques, 'total': totals, 'filled': filled})
+    depth = depth[depth.label.isin(subkeys)]
+    depth['fill_rate'] = depth.filled / depth.total
+    if not sort:
+        return depth.reset_index(drop=True)
+    return depth.sort_values('total', ascending=False, kind='stable', ignore_index=True)
+
+
+def compare_sources(sources: dict, keys: list = None) -> pd.DataFrame:
+    """
+    Key counts side by side for several datasets, ex. one TagStore per city.
+
+    Args:
+        sources (dict): Name -> TagStore or wide GeoDataFrame.
+        keys (list):    Keys to count, default every key present in any source.
+    Returns:
+        pd.DataFrame: (names x keys) tagged row counts with a 'rows' column.
+    """
+    stores = {name: as_tag_store(source) for name, source in sources.items()}
+    counts = {name: key_counts(tags, keys) for name, tags in stores.items()}
+    table = pd.DataFrame(counts).T.fillna(0).astype(np.int64)
+    if keys is not None:
+        table = table.reindex(columns=[k for k in keys if k in table.columns])
+    table.insert(0, 'rows', [len(tags) for tags in stores.values()])
+    return table
@@ -0,0 +1,173 @@
+import numpy as np
+import pandas as pd
+
+"""
+tagstore.py
+-----------
+Compact sparse storage for OSM tags.
+
+Tags are dictionary encoded against shared key and value string tables
+and held as (key id, value id) pairs per feature in CSR arrays: the
+pairs of row r are at indptr[r]:indptr[r+1]. Memory scales with the
+number of tags present, not rows x distinct keys, and filters such as
+"has a 'building' tag" are answered without building any columns. Wide
+frames are only materialized for the keys a caller asks for.
+"""
+
+
+class TagStore:
+    """
+    CSR tag table.
+
+    Args:
+        indptr (array):    int64 row pointers, length rows + 1.
+        key_ids (array):   int32 key id of every pair.
+        value_ids (array): int32 value id of every pair.
+        keys (list):       Key string table.
+        values (list):     Value table.
+    """
+
+    def __init__(self, indptr, key_ids, value_ids, keys: list, values: list):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.key_ids = np.asarray(key_ids, dtype=np.int32)
+        self.value_ids = np.asarray(value_ids, dtype=np.int32)
+        self.keys = list(keys)
+        self.values = np.asarray(values, dtype=object)
+        self._key_index = {k: i for i, k in enumerate(self.keys)}
+        self._entry_rows = None
+        self._by_key = None
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def __contains__(self, key) -> bool:
+        return key in self._key_index
+
+    def __repr__(self):
+        return f"TagStore({len(self)} rows, {len(self.key_ids)} tags, {len(self.keys)} keys, {len(self.values)} values)"
+
+    @property
+    def nbytes(self) -> int:
+        """ Bytes held by the CSR arrays (string tables excluded). """
+        return self.indptr.nbytes + self.key_ids.nbytes + self.value_ids.nbytes
+
+    @property
+    def entry_rows(self) -> np.ndarray:
+        """ Row of every (key, value) pair. """
+        if self._entry_rows is None:
+            self._entry_rows = np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.indptr))
+        return self._entry_rows
+
+    @classmethod
+    def from_columns(cls, n_rows: int, columns: dict):
+        """
+        Builds a store from sparse columns.
+
+        Args:
+            n_rows (int):   Number of rows.
+            columns (dict): Key -> (row positions, values), ex. WayColumns.tags.
+        """
+        keys = list(columns)
+        if not keys:
+            return cls(np.zeros(n_rows + 1), [], [], [], [])
+        rows = np.concatenate([np.asarray(r, dtype=np.int64) for (r, _) in columns.values()])
+        key_ids = np.repeat(np.arange(len(keys), dtype=np.int32), [len(v) for (_, v) in columns.values()])
+        values = np.empty(len(rows), dtype=object)
+        values[:] = [v for (_, vals) in columns.values() for v in vals]
+        value_ids, value_table = pd.factorize(values)
+        order = np.lexsort((key_ids, rows))
+        indptr = np.searchsorted(rows[order], np.arange(n_rows + 1))
+        return cls(indptr, key_ids[order], value_ids[order], keys, value_table)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, keys: list = None):
+        """ Builds a store from wide tag columns, nulls are left out. """
+        keys = list(keys if keys is not None else df.columns)
+        columns = {}
+        for key in keys:
+            values = df[key].to_numpy(dtype=object)
+            rows = np.flatnonzero(pd.notnull(values))
+            columns[key] = (rows, values[rows])
+        return cls.from_columns(len(df), columns)
+
+    @classmethod
+    def concat(cls, stores: list):
+        """ Stacks stores row-wise, merging their key and value tables. """
+        keys, values = {}, {}
+        (indptr, key_ids, value_ids) = ([np.zeros(1, dtype=np.int64)], [], [])
+        offset = 0
+        for store in stores:
+            key_map = np.array([keys.setdefault(k, len(keys)) for k in store.keys], dtype=np.int32)
+            value_map = np.array([values.setdefault(v, len(values)) for v in store.values], dtype=np.int32)
+            key_ids.append(key_map[store.key_ids] if len(key_map) else store.key_ids)
+            value_ids.append(value_map[store.value_ids] if len(value_map) else store.value_ids)
+            indptr.append(store.indptr[1:] + offset)
+            offset += store.indptr[-1]
+        return cls(np.concatenate(indptr), np.concatenate(key_ids or [np.empty(0)]),
+                   np.concatenate(value_ids or [np.empty(0)]), list(keys), list(values))
+
+    def take(self, rows):
+        """ Store restricted to rows, given as positions or a boolean mask. """
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        entries = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        indptr = np.concatenate([[0], np.cumsum(lengths)])
+        return TagStore(indptr, self.key_ids[entries], self.value_ids[entries], self.keys, self.values)
+
+    def _entries(self, key) -> np.ndarray:
+        """ Pair positions of key, from one stable sort of the pairs by key id. """
+        kid = self._key_index.get(key)
+        if kid is None:
+            return np.empty(0, dtype=np.int64)
+        if self._by_key is None:
+            order = np.argsort(self.key_ids, kind='stable')
+            self._by_key = (order, np.searchsorted(self.key_ids[order], np.arange(len(self.keys) + 1)))
+        (order, bounds) = self._by_key
+        return order[bounds[kid]:bounds[kid + 1]]
+
+    def has(self, key: str) -> np.ndarray:
+        """ Boolean mask of rows tagged with key, like gdf[key].notnull(). """
+        mask = np.zeros(len(self), dtype=bool)
+        mask[self.entry_rows[self._entries(key)]] = True
+        return mask
+
+    def column(self, key: str) -> np.ndarray:
+        """ Object array of key's values, None where untagged. """
+        column = np.full(len(self), None, dtype=object)
+        entries = self._entries(key)
+        column[self.entry_rows[entries]] = self.values[self.value_ids[entries]]
+        return column
+
+    def key_counts(self) -> pd.Series:
+        """ Tagged rows per key, keys without tags left out. """
+        counts = np.bincount(self.key_ids, minlength=len(self.keys))
+        present = np.flatnonzero(counts)
+        return pd.Series(counts[present], index=[self.keys[i] for i in present])
+
+    def present_keys(self) -> list:
+        """ Keys with at least one tag, in key table order. """
+        return list(self.key_counts().index)
+
+    def unique_values(self, key: str) -> list:
+        """ Distinct values of key. """
+        return list(self.values[np.unique(self.value_ids[self._entries(key)])])
+
+    def to_frame(self, keys: list = None, index=None) -> pd.DataFrame:
+        """
+        Materializes wide columns.
+
+        Args:
+            keys (list): Keys to build, in key table order. Defaults to every
+                         present key, so empty columns never appear. Unknown
+                         keys are skipped.
+            index:       Index of the returned frame.
+        """
+        if keys is None:
+            keys = self.present_keys()
+        else:
+            keys = sorted((k for k in set(keys) if k in self._key_index), key=self._key_index.get)
+        index = index if index is not None else pd.RangeIndex(len(self))
+        return pd.DataFrame({k: self.column(k) for k in keys}, index=index)
@@ -0,0 +1,154 @@
+import os
+import json
+import hashlib
+from concurrent.futures import CancelledError, ThreadPoolExecutor, as_completed
+
+from lib.metrics import add
+from lib.misc import file_size
+
+"""
+transfer.py
+-----------
+Resumable, chunked download engine.
+
+A file is fetched as byte ranges in parallel and written in place into
+a preallocated output. Finished chunks are recorded in a sidecar
+progress file, so an interrupted download resumes with the chunks
+still missing. The result is verified against an md5 checksum.
+Servers that ignore Range are read once, sequentially.
+"""
+
+
+class RangeNotSupported(Exception):
+    """ Raised by a fetch_range callable when the server ignored the Range header and sent the whole file. """
+
+    def __init__(self, content: bytes):
+        super().__init__("Server ignored the Range header.")
+        self.content = content
+
+
+def progress_path(out_path: str) -> str:
+    """ Sidecar progress record for an output file. """
+    return out_path + '.progress.json'
+
+
+def _load_progress(out_path: str, size: int, chunk_size: int, md5: str) -> set:
+    """ Returns finished chunk indices if the sidecar matches this download, else an empty set. """
+    fp = progress_path(out_path)
+    if not (os.path.exists(fp) and os.path.exists(out_path)):
+        return set()
+    try:
+        with open(fp) as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return set()
+    if (record.get('size'), record.get('chunk_size'), record.get('md5')) != (size, chunk_size, md5):
+        return set()
+    if os.path.getsize(out_path) != size:
+        return set()
+    return set(record.get('done', []))
+
+
+def _save_progress(out_path: str, size: int, chunk_size: int, md5: str, done: set) -> None:
+    fp = progress_path(out_path)
+    tmp_fp = fp + '.tmp'
+    with open(tmp_fp, 'w') as f:
+        json.dump({'size': size, 'chunk_size': chunk_size, 'md5': md5, 'done': sorted(done)}, f)
+    os.replace(tmp_fp, fp)
+
+
+def file_md5(filepath: str, block_size: int = 1 << 22) -> str:
+    """ Hex md5 digest of a file, read in blocks. """
+    digest = hashlib.md5()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _fetch_chunk(fetch_range, out_path: str, index: int, start: int, end: int) -> int:
+    data = fetch_range(start, end)
+    if len(data) != (end - start + 1):
+        raise RuntimeError(f"Chunk {index} returned {len(data)} bytes, expected {end - start + 1}.")
+    with open(out_path, 'r+b') as f:
+        f.seek(start)
+        f.write(data)
+    return index
+
+
+def download_ranges(fetch_range, size: int, out_path: str, md5: str = None, chunk_size: int = 32 * 1024 * 1024,
+                    workers: int = 4, verbose: bool = False) -> str:
+    """
+    Downloads a file as parallel byte ranges, resuming from a previous attempt.
+
+    Args:
+        fetch_range:      Callable (start, end) -> bytes for the inclusive byte range,
+                          raises RangeNotSupported with the whole file if ranges are ignored.
+        size (int):       Total file size in bytes.
+        out_path (str):   Output file.
+        md5 (str):        Expected hex md5, skips verification when None.
+        chunk_size (int): Bytes per range request.
+        workers (int):    Concurrent range requests.
+        verbose (bool):   Print progress.
+    Returns:
+        str: out_path
+    Raises:
+        RuntimeError: If the finished file does not match md5. The progress
+                      record is removed, so the next attempt starts over.
+        Exception:    The first failed range request, raised once every chunk
+                      already in flight has finished and been recorded.
+    """
+    n_chunks = -(-size // chunk_size)
+    done = _load_progress(out_path, size, chunk_size, md5)
+    if not done:
+        # Preallocate, chunks are written in place
+        with open(out_path, 'wb') as f:
+            f.truncate(size)
+        _save_progress(out_path, size, chunk_size, md5, done)
+    elif verbose:
+        print(f"> Resuming download: {len(done)}/{n_chunks} chunks already on disk.")
+
+    missing = [i for i in range(n_chunks) if i not in done]
+    (error, whole) = (None, None)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_fetch_chunk, fetch_range, out_path, i,
+                               i * chunk_size, min(size, (i + 1) * chunk_size) - 1) for i in missing]
+        for future in as_completed(futures):
+            try:
+                index = future.result()
+            except CancelledError:
+                continue
+            except RangeNotSupported as e:
+                whole = whole if whole is not None else e.content
+                for f in futures:
+                    f.cancel()
+                continue
+            except Exception as e:
+                # Keep recording chunks already in flight, start no new ones
+                error = error or e
+                for f in futures:
+                    f.cancel()
+                continue
+            done.add(index)
+            _save_progress(out_path, size, chunk_size, md5, done)
+            if verbose:
+                print(f"> Downloaded {len(done)}/{n_chunks} chunks ({file_size(size=min(size, len(done) * chunk_size))})")
+
+    if whole is not None:
+        if len(whole) != size:
+            raise RuntimeError(f"Server returned {len(whole)} bytes for '{out_path}', expected {size}.")
+        if verbose:
+            print("> Server ignored byte ranges, wrote the whole file from one response.")
+        with open(out_path, 'r+b') as f:
+            f.write(whole)
+        done = set(range(n_chunks))
+        _save_progress(out_path, size, chunk_size, md5, done)
+    elif error is not None:
+        raise error
+
+    if md5 and (file_md5(out_path) != md5.lower()):
+        os.remove(progress_path(out_path))
+        raise RuntimeError(f"Downloaded file '{out_path}' does not match expected md5 '{md5}'.")
+    os.remove(progress_path(out_path))
+    add(bytes_in=sum(min(size, (i + 1) * chunk_size) - i * chunk_size for i in missing), chunks=len(missing))
+    return out_path
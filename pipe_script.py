@@ -1,15 +1,21 @@
 import re, os, sys
-import overpass
 import rasterio as rio
-import geopandas as gpd
-from shapely.geometry.base import deserialize_wkb
 
 import lib.misc as m
 import lib.osmtools as ost
 import lib.imagetools as img
+from lib.chips import generate_chips
+from lib.masks import rasterize_layers
+from lib.pbf import read_pbf_ways
+from lib.cache import ResponseCache, set_default_cache
+from lib.overpass_client import OverpassClient, set_client
+from lib.outputs import LayerWriter
+from lib.stages import Stage, run_stages
+from lib.batch import read_manifest, region_folder, run_batch
+from lib.metrics import Metrics, set_metrics
+from lib.catalog import Catalog
 from lib.authkit import ee_client, get_drive
 
-from time import perf_counter
 from datetime import datetime as dt
 from pytz import timezone 
 tz = timezone("US/Central")
@@ -25,16 +31,87 @@ Change available sample areas in lib/misc.py.
 #? Filepaths
 # Drive Authentication File
 GDRIVE_SETTINGS = './keys/pydrive/settings.yaml'
+# Earth Engine service account key (json) for batch runs, None uses saved user credentials
+EE_SERVICE_KEY = None
 # Output folder for downloaded data
 LOCAL_ROOT = './data/osm-sets'
 # Google Drive output folder
 DRIVE_FOLDER_NAME = 'geo-scrape-sets'
 
+#? OSM Query
+# Largest tile edge (degrees) sent to overpass in one request
+OSM_TILE_DEG = 0.05
+# Concurrent overpass requests
+OSM_WORKERS = 4
+# Overpass response cache folder, size limit (bytes) and lifetime (seconds, None keeps forever)
+CACHE_ROOT = './data/cache/overpass'
+CACHE_MAX_BYTES = int(5e09)
+CACHE_TTL = None
+# Local .osm.pbf extract read instead of querying overpass, None uses overpass
+OSM_PBF = None
+# Node location index of the extract, built by the first region and reused by every later one,
+# None keeps it next to OSM_PBF as '<extract>.nodes'
+OSM_PBF_INDEX = None
+# Overpass interpreters, load is spread over all of them (ex. add lib.overpass_client.PUBLIC_MIRRORS)
+OSM_ENDPOINTS = ['https://overpass-api.de/api/interpreter']
+# Requests per second and queries in flight allowed per endpoint
+OSM_RATE = 1.0
+OSM_SLOTS = 2
+
+#? Raster
+# Concurrent tile requests for direct downloads
+RASTER_WORKERS = 8
+# Training chip edge and step (pixels), step below size overlaps chips, None steps by size
+CHIP_SIZE = 256
+CHIP_STRIDE = None
+# Worker processes cutting chips
+CHIP_WORKERS = 4
+# Label mask window edge (pixels) and windows rasterized at once
+MASK_WINDOW = 1024
+MASK_WORKERS = 4
+
+#? Scheduling
+# Pipeline stages allowed to run at once
+STAGE_WORKERS = 4
+# Regions run at once in batch mode, one process each
+BATCH_WORKERS = 2
+
+#? Output
+# Layer format: 'parquet' (GeoParquet), 'gpkg' (single GeoPackage) or 'shp'
+OUTPUT_FORMAT = 'parquet'
+# Parquet only, write one row group per label value
+PARTITION_BY = 'label'
+# Save a spatial index next to every layer for chip-to-feature lookups
+INDEX_LAYERS = True
+# SQLite catalog of every set under LOCAL_ROOT, updated after each run, None disables it
+CATALOG_FP = os.path.join(LOCAL_ROOT, 'catalog.sqlite')
+
 #? Flags 
 # Use '-y' flag to skip confirmation prompts
 SKIP_PROMPT = ('-y' in sys.argv)
 # Use '-v' for verbose
 VERBOSE = ('-v' in sys.argv)
+# Use '--no-cache' to always query overpass
+USE_CACHE = ('--no-cache' not in sys.argv)
+# Use '--direct' to download imagery from EE in tiles instead of exporting through drive
+DIRECT_DOWNLOAD = ('--direct' in sys.argv)
+# Use '--chips' to cut the downloaded raster into training chips
+MAKE_CHIPS = ('--chips' in sys.argv)
+# Use '--masks' to burn label layers into a class mask aligned to the raster
+MAKE_MASKS = ('--masks' in sys.argv)
+# Use '--batch <manifest>' to run every region of a CSV/JSON lines manifest unattended,
+# '--workers <n>' overrides BATCH_WORKERS. Rerunning a batch skips regions already done.
+BATCH_MANIFEST = sys.argv[sys.argv.index('--batch') + 1] if '--batch' in sys.argv else None
+if '--workers' in sys.argv:
+    BATCH_WORKERS = int(sys.argv[sys.argv.index('--workers') + 1])
+# Use '--pbf <extract.osm.pbf>' to read OSM ways from a local extract (offline)
+if '--pbf' in sys.argv:
+    OSM_PBF = sys.argv[sys.argv.index('--pbf') + 1]
+# Use '--gpkg' or '--shp' to override the output format
+if '--gpkg' in sys.argv:
+    OUTPUT_FORMAT = 'gpkg'
+elif '--shp' in sys.argv:
+    OUTPUT_FORMAT = 'shp'
 """ --------------- """
 
 # Verbosity printing
@@ -43,144 +120,362 @@ def printv(*args):
         print(*args)
     else:
         return
-    
-
-# Authenticate
-trecord = [("Authentication", perf_counter())] # init time tracker
-op = overpass.API()
-gdrive = get_drive(settings_fp=GDRIVE_SETTINGS, verbose=VERBOSE)
-ee_client()
-
-
-# Creates output folder in drive if missing. 
-trecord.append(("Drive Folder Creation", perf_counter()))
-drive_folder = img.create_drive_folder(gdrive, DRIVE_FOLDER_NAME)
-
-# Create output folder from user-selected city.
-trecord.append(("User Prompt", perf_counter()))
-dset_data = m.prompt_cities()
-
-trecord.append(("Local Folder Prep", perf_counter()))
-dset_name, dset_folder = m.make_set_folder(LOCAL_ROOT, dset_data['filename'])
-
-dset_data.update({'filename': dset_name})
-print("updated filename:", dset_data['filename'])
-
-
-# Export from EE Cloud to personal drive
-trecord.append(("EE to Drive", perf_counter()))
-result = img.export_naip_image(gdrive=gdrive, 
-                      drive_folder=drive_folder, 
-                      dset_data=dset_data)
-
-if result: 
-    # Failed, check output here
-    print(result.keys())
-    sys.exit(0)
-
-# Download to local
-trecord.append(("Raster Download", perf_counter()))
-raster_fp = img.download_raster(gdrive=gdrive, 
-                                drive_folder=drive_folder,
-                                set_name=dset_name, 
-                                out_dir=dset_folder,
-                                skip_conf=SKIP_PROMPT)
-
-trecord.append(("OSM Query", perf_counter()))
-response = op.get(
-    "way" + ost.overpass_bounds(dset_data) + ";(._;>;);",
-    verbosity="geom",
-)
-printv("> Parsing OSM Query...")
-# Remove nodes before conversion, this is ~25x faster than removing from GDF
-trecord.append(("Parse Query", perf_counter()))
-way_features = [f for f in response.features if f.geometry['type'] == "LineString"]
-gdf = gpd.GeoDataFrame.from_features(way_features)
-gdf.set_crs(epsg=4326, inplace=True)
-printv("> Parsed raw response as gdf.")
-
-# Parse building perimiters (Linestrings)
-trecord.append(("Parse Building GDF", perf_counter()))
-build_gdf = gdf[gdf.building.notnull()].reset_index()
-build_gdf = ost.parse_osm_gdf(gdf=build_gdf, main_key='building')
-perimeter_fp = os.path.join(dset_folder, 'building_perimeters.shp')
-build_gdf.to_file(perimeter_fp)
-# Polygonize, save footprints
-build_gdf['geometry'] = ost.gdf_polygonize(build_gdf)
-footprint_fp = os.path.join(dset_folder, 'buildings.shp')
-build_gdf.to_file(footprint_fp)
-printv(">> Building footprints saved as labeled polygons.")
-
-# Parse Roads
-trecord.append(("Parse Road GDF", perf_counter()))
-road_gdf = gdf[gdf.highway.notnull()].reset_index()
-road_gdf = ost.parse_osm_gdf(gdf=road_gdf, main_key='highway')
-raw_road_fp = os.path.join(dset_folder, 'roads.shp')
-road_gdf.to_file(raw_road_fp)
-printv(">> Roads saved as labeled linestrings.")
-
-# Parse ungrouped
-trecord.append(("Parse Ungrouped GDF", perf_counter()))
-other_gdf = gdf[gdf.highway.isnull() & gdf.building.isnull()]
-other_gdf = ost.drop_empty_cols(other_gdf)
-other_gdf.reset_index(inplace=True)
-other_fp = os.path.join(dset_folder, 'ungrouped.shp')
-other_gdf.to_file(other_fp)
-printv(">> Ungrouped shapes saved as uncleaned labeled linestrings.\n")
-
-# Print results and save in md
-md_data = []
-md_data.append(f"# {dset_data['filename']} Dataset Info\n")
-md_data.append(dt.now(tz=tz).strftime("### %a, %D - [%I:%M %p]\n"))
-md_data.append('\n---\n')
-md_data.append("\n")
-
-# Add Raster Info
-md_data.append("## Exported Raster\n")
-with rio.open(raster_fp) as raster:
-    md_data.append(f"- City:  {re.compile('[^a-zA-Z]').sub('', dset_data['filename'])}\n")  
-    md_data.append(f"- Type:  {raster.dtypes}\n")  
-    md_data.append(f"- Shape: ({raster.count}, {raster.height}, {raster.width})\n")
-    md_data.append(f"- Path:  '{raster_fp}'\n")
-    md_data.append(f"- Size:  {m.file_size(filepath=raster_fp)}\n") 
-md_data.append("\n")
-
-md_data.append("## Parsed OSM GeoDataFrames\n")
-gdf_data = [("Raw", gdf), ("Buildings", build_gdf), ("Roads", road_gdf), ("Ungrouped", other_gdf)]
-for (name, frame) in gdf_data:
-    md_data.append(f"### {name} frame:\n")
-    md_data.append(f" - Rows: {frame.rows}\n")
-    md_data.append(f" - Cols: {frame.cols}\n")
-    md_data.append(f" - CRS:  {frame.crs}\n")
-    md_data.append(f" - Geom Type: {type(frame.geometry[0]).__name__}\n")
-    if name != 'Raw':
-        fp = f"{dset_folder}/{name.lower()}.shp"
-        md_data.append(f" - Path: '{fp}'\n")
-        md_data.append(f" - Size: {m.file_size(filepath=fp)}\n")  
+
+
+def run_region(dset_data, gdrive, drive_folder, dset_folder, metrics, skip_conf=SKIP_PROMPT, resume=False):
+    """
+    Runs the stage graph for one region, writes its markdown report and metrics.
+
+    Args:
+        dset_data (dict):   Region bounds, 'scale' and 'filename'.
+        gdrive:             Authenticated GoogleDrive.
+        drive_folder:       Drive output folder.
+        dset_folder (str):  Local dataset folder.
+        metrics (Metrics):  Default recorder for this run, stage spans are added to it.
+        skip_conf (bool):   Skip the download confirmation prompt.
+        resume (bool):      Reuse a raster already exported to drive instead of failing.
+    Returns:
+        tuple: (markdown path, md_data lines, names of stages that did not complete)
+    Metrics are written as JSON lines to '<filename>_metrics.jsonl' in dset_folder.
+    """
+    dset_name = dset_data['filename']
+    writer = LayerWriter(dset_folder, fmt=OUTPUT_FORMAT, partition_by=PARTITION_BY, name=dset_name, 
+                         index=INDEX_LAYERS)
+
+    """ Stages """
+    # The raster branch (EE export, download) and the OSM branch share no data, 
+    # they run concurrently and the run takes as long as the slower branch.
+
+    # Export from EE Cloud to personal drive
+    def export_stage():
+        if resume:
+            try:
+                img.check_drive_duplicate(gdrive, drive_folder, dset_data)
+            except RuntimeError:
+                printv(f"> '{dset_name}.tif' already exported, skipping export.")
+                return
+        img.export_naip_image(gdrive=gdrive, 
+                              drive_folder=drive_folder, 
+                              dset_data=dset_data)
+
+    # Download to local
+    def download_stage(_):
+        raster_fp = img.download_raster(gdrive=gdrive, 
+                                        drive_folder=drive_folder,
+                                        set_name=dset_name, 
+                                        out_dir=dset_folder,
+                                        skip_conf=skip_conf)
+        if not isinstance(raster_fp, str):
+            raise RuntimeError(f"Raster '{dset_name}.tif' was not downloaded.")
+        return raster_fp
+
+    # Download tiles from EE straight to local, no drive round trip
+    def direct_download_stage():
+        return img.download_naip_direct(dset_data, 
+                                        out_dir=dset_folder, 
+                                        workers=RASTER_WORKERS, 
+                                        verbose=VERBOSE)
+
+    # Cut raster into training chips, nodata-only windows are skipped
+    def chip_stage(raster_fp):
+        return generate_chips(raster_fp, 
+                              out_dir=os.path.join(dset_folder, 'chips'), 
+                              size=CHIP_SIZE, 
+                              stride=CHIP_STRIDE, 
+                              workers=CHIP_WORKERS, 
+                              verbose=VERBOSE)
+
+    # Burn buildings, roads and ungrouped shapes into a mask next to the raster
+    def mask_stage(raster_fp, build_gdf, road_gdf, other_gdf):
+        return rasterize_layers(raster_fp, 
+                                {'buildings': build_gdf, 'roads': road_gdf, 'ungrouped': other_gdf}, 
+                                window_size=MASK_WINDOW, 
+                                workers=MASK_WORKERS, 
+                                verbose=VERBOSE)
+
+    # Nodes are dropped while the response streams in, ways are parsed straight to columns.
+    # Tags stay in a sparse TagStore, stages only widen the keys they read.
+    def query_stage():
+        if OSM_PBF:
+            ways, tags = read_pbf_ways(OSM_PBF, dset_data, 
+                                       index_fp=OSM_PBF_INDEX or OSM_PBF + '.nodes', 
+                                       verbose=VERBOSE, 
+                                       wide=False)
+        else:
+            ways, tags = ost.get_osm_tiled(dset_data, 
+                                           tile_deg=OSM_TILE_DEG, 
+                                           workers=OSM_WORKERS, 
+                                           verbose=VERBOSE, 
+                                           wide=False)
+        printv(f"> Parsed OSM query: {len(ways)} ways, {len(tags.key_ids)} tags over {len(tags.keys)} keys.")
+        return ways, tags
+
+    # Parse building perimiters (Linestrings)
+    def building_stage(query):
+        (ways, tags) = query
+        build_gdf = ost.tagged_frame(ways, tags, tags.has('building'), keys=ost.label_keys(tags, 'building'))
+        build_gdf = ost.parse_osm_gdf(gdf=build_gdf, main_key='building')
+        metrics.add(rows_in=len(ways))
+        writer.write('building_perimeters', build_gdf)
+        # Polygonize, save footprints
+        build_gdf['geometry'], poly_report = ost.gdf_polygonize(build_gdf, return_report=True)
+        build_gdf = build_gdf[build_gdf.geometry.notnull()].reset_index(drop=True)
+        printv(f">> Polygonized {poly_report['total']} footprints: {poly_report['closed']} closed, "
+               f"{poly_report['repaired']} repaired, {poly_report['dropped']} dropped.")
+        writer.write('buildings', build_gdf)
+        metrics.add(rows_out=len(build_gdf))
+        printv(">> Building footprints saved as labeled polygons.")
+        return build_gdf
+
+    # Parse Roads
+    def road_stage(query):
+        (ways, tags) = query
+        road_gdf = ost.tagged_frame(ways, tags, tags.has('highway'), keys=ost.label_keys(tags, 'highway'))
+        road_gdf = ost.parse_osm_gdf(gdf=road_gdf, main_key='highway')
+        # Drop repeated ways, join chains of the same label and category
+        road_gdf, road_report = ost.merge_roads(road_gdf, return_report=True)
+        metrics.add(rows_in=len(ways), rows_out=len(road_gdf))
+        printv(f">> Consolidated {road_report['total']} road ways: {road_report['duplicates']} duplicates dropped, "
+               f"{road_report['merged']} merged into chains, {road_report['output']} kept.")
+        writer.write('roads', road_gdf)
+        printv(">> Roads saved as labeled linestrings.")
+        return road_gdf
+
+    # Parse ungrouped
+    def ungrouped_stage(query):
+        (ways, tags) = query
+        # Only keys present in these rows are built, so no empty columns
+        other_gdf = ost.tagged_frame(ways, tags, ~tags.has('highway') & ~tags.has('building'))
+        metrics.add(rows_in=len(ways), rows_out=len(other_gdf))
+        writer.write('ungrouped', other_gdf)
+        printv(">> Ungrouped shapes saved as uncleaned labeled linestrings.\n")
+        return other_gdf
+
+    if DIRECT_DOWNLOAD:
+        stages = [Stage("Raster Download", direct_download_stage)]
+    else:
+        stages = [
+            Stage("EE to Drive", export_stage),
+            Stage("Raster Download", download_stage, deps=["EE to Drive"]),
+        ]
+    if MAKE_CHIPS:
+        stages.append(Stage("Raster Chips", chip_stage, deps=["Raster Download"]))
+    stages += [
+        Stage("OSM Query", query_stage),
+        Stage("Parse Building GDF", building_stage, deps=["OSM Query"]),
+        Stage("Parse Road GDF", road_stage, deps=["OSM Query"]),
+        Stage("Parse Ungrouped GDF", ungrouped_stage, deps=["OSM Query"]),
+    ]
+    if MAKE_MASKS:
+        stages.append(Stage("Label Masks", mask_stage, deps=["Raster Download", "Parse Building GDF", 
+                                                             "Parse Road GDF", "Parse Ungrouped GDF"]))
+    with metrics.span("Stage Graph", kind='graph'):
+        stage_results = run_stages(stages, max_workers=STAGE_WORKERS, verbose=VERBOSE)
+
+    # Print results and save in md
+    md_data = []
+    md_data.append(f"# {dset_data['filename']} Dataset Info\n")
+    md_data.append(dt.now(tz=tz).strftime("### %a, %D - [%I:%M %p]\n"))
+    md_data.append('\n---\n')
+    md_data.append("\n")
+
+    # Add Raster Info
+    md_data.append("## Exported Raster\n")
+    if stage_results["Raster Download"].ok:
+        raster_fp = stage_results["Raster Download"].result
+        with rio.open(raster_fp) as raster:
+            md_data.append(f"- City:  {re.compile('[^a-zA-Z]').sub('', dset_data['filename'])}\n")  
+            md_data.append(f"- Type:  {raster.dtypes}\n")  
+            md_data.append(f"- Shape: ({raster.count}, {raster.height}, {raster.width})\n")
+            md_data.append(f"- Path:  '{raster_fp}'\n")
+            md_data.append(f"- Size:  {m.file_size(filepath=raster_fp)}\n") 
+    else:
+        md_data.append("- Not available, see stage results.\n")
+    if MAKE_CHIPS and stage_results["Raster Chips"].ok:
+        md_data.append(f"- Chips: {len(stage_results['Raster Chips'].result)} of {CHIP_SIZE}x{CHIP_SIZE} px, "
+                       f"'{os.path.join(dset_folder, 'chips')}'\n")
+    if MAKE_MASKS and stage_results["Label Masks"].ok:
+        mask_fp = stage_results["Label Masks"].result
+        md_data.append(f"- Mask:  '{mask_fp}' ({m.file_size(filepath=mask_fp)})\n")
+    md_data.append("\n")
+
+    md_data.append("## Parsed OSM GeoDataFrames\n")
+    gdf_stages = [("Raw", "OSM Query"), ("Buildings", "Parse Building GDF"), 
+                  ("Roads", "Parse Road GDF"), ("Ungrouped", "Parse Ungrouped GDF")]
+    for (name, stage_name) in gdf_stages:
+        if not stage_results[stage_name].ok:
+            continue
+        frame = stage_results[stage_name].result
+        md_data.append(f"### {name} frame:\n")
+        if name == 'Raw':
+            (frame, tags) = frame
+            md_data.append(f" - Rows: {len(frame)}\n")
+            md_data.append(f" - Tags: {len(tags.key_ids)} over {len(tags.keys)} keys\n")
+        else:
+            md_data.append(f" - Rows: {len(frame)}\n")
+            md_data.append(f" - Cols: {len(frame.columns)}\n")
+        md_data.append(f" - CRS:  {frame.crs}\n")
+        md_data.append(f" - Geom Type: {', '.join(frame.geom_type.dropna().unique())}\n")
+        if name != 'Raw':
+            fp = writer.paths[name.lower()]
+            md_data.append(f" - Path: '{fp}'\n")
+            md_data.append(f" - Size: {m.file_size(filepath=fp)}\n")  
+        md_data.append("\n")
+    md_data.append("\n")
+
+    md_data.append("## Stage Results\n")
+    for name, result in stage_results.items():
+        line = f"- {name}: {result.status}, {m.fmt_time(result.elapsed)}"
+        if result.error is not None:
+            line += f" ({type(result.error).__name__}: {result.error})"
+        md_data.append(line + "\n")
     md_data.append("\n")
-md_data.append("\n")
-
-md_data.append("## Time Data\n")
-for idx, (title, tstamp) in enumerate(trecord):
-    next_stamp = perf_counter()
-    if ((idx+1) < len(trecord)):
-        next_stamp = trecord[(idx+1)][1]
-    elapsed = m.fmt_time((tstamp - next_stamp))
-    md_data.append(f"- {title}: {elapsed}\n")
-    
-
-printv("> Writing to Markdown")
-markdown_fp = os.path.join(dset_folder, dset_data['filename']+"_info.md")
-with open(markdown_fp, 'w+') as md:
-    md.writelines(md_data)    
-
-
-fin_time = dt.now(tz=tz).strftime("%D - [%I:%M %p]")
-if SKIP_PROMPT:
-    print(f"Completed EE dataset export. {fin_time}\nResults here: '{markdown_fp}'")
-else:
-    show_results = input("Print results? (y/N) ")
-    if 'y' in show_results.lower():
-        for mdline in md_data:
-            print(mdline.replace('\n', ''))
-    print("\n\nCompleted EE dataset export.", fin_time)
\ No newline at end of file
+
+    markdown_fp = os.path.join(dset_folder, dset_data['filename']+"_info.md")
+    metrics_fp = os.path.join(dset_folder, dset_data['filename']+"_metrics.jsonl")
+    failed = [name for name, result in stage_results.items() if not result.ok]
+
+    # Record the set in the catalog, from results in memory and file headers only
+    if CATALOG_FP:
+        with metrics.span("Catalog Update", kind='catalog'):
+            catalog = Catalog(CATALOG_FP)
+            catalog.remove(dset_name)
+            catalog.record_dataset(dset_data, dset_folder, markdown_fp=markdown_fp, metrics_fp=metrics_fp, 
+                                   failed=failed)
+            if stage_results["Raster Download"].ok:
+                chips = stage_results["Raster Chips"] if MAKE_CHIPS else None
+                catalog.record_raster(dset_name, stage_results["Raster Download"].result, 
+                                      chips=len(chips.result) if (chips is not None) and chips.ok else None, 
+                                      chip_size=CHIP_SIZE if MAKE_CHIPS else None)
+            if MAKE_MASKS and stage_results["Label Masks"].ok:
+                catalog.record_raster(dset_name, stage_results["Label Masks"].result, kind='mask')
+            for (name, stage_name) in gdf_stages[1:]:
+                if stage_results[stage_name].ok:
+                    catalog.record_layer(dset_name, name.lower(), stage_results[stage_name].result, 
+                                         writer.paths[name.lower()], fmt=OUTPUT_FORMAT)
+
+    # Setup, graph and stage spans, library spans are only in the metrics file
+    metrics.write_jsonl(metrics_fp)
+    md_data.append("## Time Data\n")
+    for record in metrics.records():
+        if 'kind' not in record:
+            continue
+        line = f"- {record['name']}: {m.fmt_time(record['wall_s'])} (thread CPU {m.fmt_time(record['thread_cpu_s'])}, process CPU {m.fmt_time(record['process_cpu_s'])}"
+        if record['peak_rss_delta_kb'] is not None:
+            line += f", peak RSS +{m.file_size(size=record['peak_rss_delta_kb'] * 1024)}"
+        md_data.append(line + ")\n")
+    md_data.append(f"\nMetrics: '{metrics_fp}'\n")
+
+    printv("> Writing to Markdown")
+    with open(markdown_fp, 'w+') as md:
+        md.writelines(md_data)    
+
+    return markdown_fp, md_data, failed
+
+
+def main():
+    """ Interactive run over one city picked from misc.CITIES. """
+    # Share one response cache and one rate limited client across all overpass queries
+    set_default_cache(ResponseCache(CACHE_ROOT, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL) if USE_CACHE else False)
+    set_client(OverpassClient(OSM_ENDPOINTS, rate=OSM_RATE, slots=OSM_SLOTS))
+
+    metrics = set_metrics(Metrics())
+
+    # Ask first, authentication is slow and not needed to pick a city
+    with metrics.span("User Prompt", kind='setup'):
+        dset_data = m.prompt_cities()
+
+    # Authenticate, direct downloads don't go through drive
+    (gdrive, drive_folder) = (None, None)
+    with metrics.span("Authentication", kind='setup'):
+        if not DIRECT_DOWNLOAD:
+            gdrive = get_drive(settings_fp=GDRIVE_SETTINGS, verbose=VERBOSE)
+        ee_client()
+
+    # Creates output folder in drive if missing. 
+    if not DIRECT_DOWNLOAD:
+        with metrics.span("Drive Folder Creation", kind='setup'):
+            drive_folder = img.create_drive_folder(gdrive, DRIVE_FOLDER_NAME)
+
+    with metrics.span("Local Folder Prep", kind='setup'):
+        dset_name, dset_folder = m.make_set_folder(LOCAL_ROOT, dset_data['filename'])
+
+    dset_data.update({'filename': dset_name})
+    metrics.run = dset_name
+    print("updated filename:", dset_data['filename'])
+
+    markdown_fp, md_data, failed = run_region(dset_data, gdrive, drive_folder, dset_folder, metrics)
+
+    fin_time = dt.now(tz=tz).strftime("%D - [%I:%M %p]")
+    if failed:
+        print(f"Stages did not complete: {failed}")
+    if SKIP_PROMPT:
+        print(f"Completed EE dataset export. {fin_time}\nResults here: '{markdown_fp}'")
+    else:
+        show_results = input("Print results? (y/N) ")
+        if 'y' in show_results.lower():
+            for mdline in md_data:
+                print(mdline.replace('\n', ''))
+        print("\n\nCompleted EE dataset export.", fin_time)
+
+
+""" Batch """
+# Clients can't be pickled, each worker loads the credentials batch_auth checked
+_gdrive = None
+_drive_folder = None
+
+def batch_auth():
+    """ Authenticates once before any worker starts, fails fast without saved or service account credentials. """
+    ee_client(interactive=False, service_key_fp=EE_SERVICE_KEY)
+    if DIRECT_DOWNLOAD:
+        return None
+    gdrive = get_drive(settings_fp=GDRIVE_SETTINGS, verbose=VERBOSE, interactive=False)
+    folder = img.create_drive_folder(gdrive, DRIVE_FOLDER_NAME)
+    return {'id': folder['id'], 'title': folder['title']}
+
+def init_batch_worker(shared_slots=None, drive_folder=None):
+    global _gdrive, _drive_folder
+    set_default_cache(ResponseCache(CACHE_ROOT, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL) if USE_CACHE else False)
+    # Workers split the request rate, shared_slots caps queries in flight across all of them
+    set_client(OverpassClient(OSM_ENDPOINTS, rate=OSM_RATE / BATCH_WORKERS, burst=1, slots=OSM_SLOTS, 
+                              shared_slots=shared_slots))
+    ee_client(interactive=False, service_key_fp=EE_SERVICE_KEY)
+    if drive_folder is not None:
+        _gdrive = get_drive(settings_fp=GDRIVE_SETTINGS, interactive=False)
+        _drive_folder = drive_folder
+
+def run_batch_region(dset_data):
+    """ Runs one manifest region in a worker process, raises if any stage did not complete. """
+    metrics = set_metrics(Metrics(run=dset_data['filename']))
+    with metrics.span("Local Folder Prep", kind='setup'):
+        dset_folder = region_folder(LOCAL_ROOT, dset_data['filename'])
+    markdown_fp, _, failed = run_region(dset_data, _gdrive, _drive_folder, dset_folder, metrics, 
+                                        skip_conf=True, resume=True)
+    if failed:
+        raise RuntimeError(f"Stages did not complete: {failed}, see '{markdown_fp}'")
+    return {'folder': dset_folder, 'markdown': markdown_fp}
+
+def batch_main(manifest_fp):
+    """ Unattended run over every unfinished region of a manifest. """
+    from multiprocessing import Manager
+
+    regions = read_manifest(manifest_fp)
+    drive_folder = batch_auth()
+    with Manager() as manager:
+        shared_slots = {url: manager.BoundedSemaphore(OSM_SLOTS) for url in OSM_ENDPOINTS}
+        status = run_batch(regions, 
+                           run_batch_region, 
+                           status_fp=os.path.splitext(manifest_fp)[0] + '.status.json', 
+                           workers=BATCH_WORKERS, 
+                           initializer=init_batch_worker, 
+                           initargs=(shared_slots, drive_folder),
+                           verbose=VERBOSE)
+    fin_time = dt.now(tz=tz).strftime("%D - [%I:%M %p]")
+    print(f"Completed batch export. {fin_time}\nStatus here: '{status.fp}'")
+
+
+if __name__ == '__main__':
+    if BATCH_MANIFEST:
+        batch_main(BATCH_MANIFEST)
+    else:
+        main()